@@ -0,0 +1,266 @@
+from collections.abc import Mapping
+
+from cow import unshared
+from lazy_json import LazyObject
+
+# Per-directory aggregates, shown next to directory entries: how many leaves
+# and fits a subtree holds, how many of its leaves are unset (None), and the
+# spread of its tmin and tmax values.
+#
+# Aggregates are kept in a shadow tree of _Entry objects, one per directory.
+# Counts add up, so taking a subtree away subtracts its summary; for min and
+# max a summary keeps a histogram of its tmin and tmax values instead, which
+# for fit ranges holds a few dozen distinct time slices at most. An op
+# changes the summary of the directory it edits by the difference between
+# what the keys it touches contributed before and after it, and apply(op)
+# adds that difference to the directory and to every directory above it:
+# O(depth) per op, whatever the size of the tree.
+#
+# A copied subtree has the same counts as its source, so a copy op puts the
+# source's entry in both places instead of counting it again, and entries
+# are copied on write the way the tree is (see cow.py): an edit replaces each
+# shared entry on its path with a private shallow copy, whose own children
+# are still shared.
+#
+# Subtrees that are not parsed yet (lazily loaded files) are counted as
+# `pending` until the explorer opens them (see visit).
+
+FIT_KEYS = ('tmin', 'tmax')
+_NUMBERS = frozenset((int, float))
+_LEAVES = frozenset((int, float, str, bool, type(None), list))
+
+
+class Summary:
+    __slots__ = ('leaves', 'fits', 'unset', 'pending', 'tmin', 'tmax')
+
+    def __init__(self):
+        self.leaves = 0
+        self.fits = 0  # Directories holding a tmin or a tmax
+        self.unset = 0  # Leaves that are None
+        self.pending = 0  # Unparsed subtrees, not counted yet
+        self.tmin = {}  # tmin value -> number of fits with it
+        self.tmax = {}
+
+    def add(self, other, sign=1):
+        self.leaves += sign * other.leaves
+        self.fits += sign * other.fits
+        self.unset += sign * other.unset
+        self.pending += sign * other.pending
+        for mine, theirs in ((self.tmin, other.tmin), (self.tmax, other.tmax)):
+            for value, n in theirs.items():
+                n = mine.get(value, 0) + sign * n
+                if n:
+                    mine[value] = n
+                else:
+                    del mine[value]
+
+    def spread(self, key):
+        # (min, max) of the tmin or tmax values below; None if there are none
+        values = getattr(self, key)
+        return (min(values), max(values)) if values else None
+
+
+class _Entry:
+    __slots__ = ('summary', 'children', 'shared')
+
+    def __init__(self):
+        self.summary = Summary()
+        self.children = {}  # key -> _Entry of a (parsed) directory value
+        self.shared = False  # Held in more than one place since a copy
+
+
+def _fit_part(summary, directory, sign=1):
+    # What `directory` adds as a fit, apart from its leaves
+    if 'tmin' in directory or 'tmax' in directory:
+        summary.fits += sign
+        for key in FIT_KEYS:
+            value = directory[key] if key in directory else None
+            if type(value) in _NUMBERS:
+                histogram = getattr(summary, key)
+                n = histogram.get(value, 0) + sign
+                if n:
+                    histogram[value] = n
+                else:
+                    del histogram[value]
+
+
+def _add_value(summary, value, entry):
+    # What a key with `value` adds to its directory; a directory without an
+    # entry has not been counted yet
+    if isinstance(value, Mapping):
+        if entry is None:
+            summary.pending += 1
+        else:
+            summary.add(entry.summary)
+    elif isinstance(value, LazyObject):
+        summary.pending += 1
+    else:
+        summary.leaves += 1
+        if value is None:
+            summary.unset += 1
+
+
+def _build(directory):
+    # The entry of a parsed directory, from scratch
+    entry = _Entry()
+    summary = entry.summary
+    _fit_part(summary, directory)
+    leaves = unset = 0
+    for key in list(directory.keys()):
+        value = directory[key]
+        kind = type(value)
+        if kind in _LEAVES:
+            leaves += 1
+            if value is None:
+                unset += 1
+        elif isinstance(value, Mapping):
+            child = entry.children[key] = _build(value)
+            summary.add(child.summary)
+        else:
+            _add_value(summary, value, None)
+    summary.leaves += leaves
+    summary.unset += unset
+    return entry
+
+
+def _copy(entry, deep=False):
+    # A private copy of `entry`: its children are shared with it, or, for a
+    # copy that lands inside its own source, copied too
+    clone = _Entry()
+    mine, theirs = clone.summary, entry.summary
+    mine.leaves, mine.fits, mine.unset, mine.pending = theirs.leaves, theirs.fits, theirs.unset, theirs.pending
+    mine.tmin, mine.tmax = theirs.tmin.copy(), theirs.tmax.copy()
+    if deep:
+        clone.children = {key: _copy(child, deep) for key, child in entry.children.items()}
+    else:
+        clone.children = entry.children.copy()
+        for child in clone.children.values():
+            child.shared = True
+    return clone
+
+
+class Aggregates:
+    def __init__(self, directory_tree):
+        self.directory_tree = directory_tree
+        self.root = None
+        self._before = None  # (entries down to the edited directory, touched keys, their old part)
+
+    def build(self):
+        self.root = _build(self.directory_tree)
+
+    def summary(self, path):
+        # Summary of the directory at `path`; None if it is not counted
+        # (not a directory, or not parsed yet)
+        entry = self._source(path)
+        return entry.summary if entry is not None else None
+
+    def _lookup(self, path):
+        # The raw value at `path` (unparsed subtrees stay unparsed); None if missing
+        value = self.directory_tree
+        for key in path:
+            if not isinstance(value, Mapping) or key not in value:
+                return None
+            value = value[key]
+        return value
+
+    def _entries(self, path):
+        # Entries from the root down to the directory at `path`, made private
+        # to be changed; None if it is not counted
+        entries = [self.root]
+        for key in path:
+            entry = entries[-1].children.get(key)
+            if entry is None:
+                return None
+            if entry.shared:
+                entry = entries[-1].children[key] = _copy(entry)
+            entries.append(entry)
+        return entries
+
+    def _source(self, path):
+        # The entry at `path`, to be read only; None if it is not counted
+        entry = self.root
+        for key in path:
+            entry = entry.children.get(key)
+            if entry is None:
+                return None
+        return entry
+
+    def _part(self, directory, entry, names):
+        # What `names` and the fit keys of `directory` add to its summary
+        part = Summary()
+        _fit_part(part, directory)
+        for name in names:
+            if name in directory:
+                _add_value(part, directory[name], entry.children.get(name))
+        return part
+
+    def before(self, op):
+        # Call before a journal op is applied: note what it replaces
+        self._before = None
+        if self.root is None:
+            return
+        parent = op['path'][:-1]
+        entries = self._entries(parent)
+        directory = self._lookup(parent)
+        if entries is None or not isinstance(directory, Mapping):
+            return  # Inside a subtree that is not counted yet
+        names = (op['path'][-1], op['to']) if op['op'] == 'rename' else (op['path'][-1],)
+        self._before = (entries, names, self._part(directory, entries[-1], names))
+
+    def apply(self, op):
+        # Call after a journal op was applied: add the difference it made to
+        # its directory and everything above
+        if self._before is None:
+            return
+        entries, names, old = self._before
+        self._before = None
+        entry = entries[-1]
+        directory = self._lookup(op['path'][:-1])
+        name = op['path'][-1]
+        if op['op'] == 'rename':
+            entry.children.pop(op['to'], None)
+            moved = entry.children.pop(name, None)
+            if moved is not None:
+                entry.children[op['to']] = moved  # Same content, new name
+        else:
+            # A copy holds what its source held: share the source's entry, or
+            # clone it before it changes if the copy lands inside the source
+            copied = self._source(op['from']) if op['op'] == 'copy' else None
+            if copied is not None:
+                if op['path'][:len(op['from'])] == op['from']:
+                    copied = _copy(copied, deep=True)
+                else:
+                    copied.shared = True
+            entry.children.pop(name, None)
+            if copied is not None:
+                entry.children[name] = copied
+            elif op['op'] != 'delete' and isinstance(directory[name], Mapping):
+                entry.children[name] = _build(unshared(directory[name]))
+        new = self._part(directory, entry, names)
+        for ancestor in entries:
+            ancestor.summary.add(new)
+            ancestor.summary.add(old, -1)
+
+    def visit(self, path):
+        # Called when the explorer enters `path`: count subtrees on the way
+        # down that were unparsed so far and have been parsed since
+        if self.root is None:
+            return
+        entry = self.root
+        value = self.directory_tree
+        for depth, key in enumerate(path):
+            if not isinstance(value, Mapping) or key not in value:
+                return
+            value = value[key]
+            child = entry.children.get(key)
+            if child is None:
+                if not isinstance(value, Mapping):
+                    return  # Still unparsed, or a leaf
+                entries = self._entries(path[:depth])
+                child = entries[-1].children[key] = _build(value)
+                delta = Summary()
+                delta.add(child.summary)
+                delta.pending -= 1
+                for ancestor in entries:
+                    ancestor.summary.add(delta)
+            entry = child
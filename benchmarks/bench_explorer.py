@@ -0,0 +1,273 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import urwid
+from urwid.display.raw import Screen
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import count_leaves, make_shaped_tree, write_tree  # noqa: E402
+from edit_fitparams import PALETTE, DirectoryExplorer  # noqa: E402
+from fittree import load_directory_tree  # noqa: E402
+from snapshot import snapshot_path  # noqa: E402
+
+# Drives DirectoryExplorer the way a user would, without a terminal: keys go
+# through the widgets and then explorer.keypress exactly as urwid.MainLoop
+# hands them on, and every key is followed by a redraw on urwid's raw Screen
+# attached to a pseudo-terminal whose output is thrown away. Measures, on a
+# synthetic tree of the given width and depth (see synthetic.py):
+#
+#   load_cold / load_warm   load_directory_tree without / with the snapshot
+#   first_frame             warm load, DirectoryExplorer(...) and the first frame
+#   key_down, key_enter,    one key plus the redraw after it
+#   key_backspace
+#   key_burst               BURST 'down' keys arriving together, plus one redraw
+#   update_view             update_directory_view alone
+#   edit_commit             the 'enter' that commits an edited value, plus redraw
+#   save                    one save of the background saver, run inline
+#
+# Results are JSON (times in milliseconds) so runs at different commits can
+# be compared:
+#
+#   python benchmarks/bench_explorer.py --width 12 --depth 4 --output new.json
+#   python benchmarks/bench_explorer.py --width 12 --depth 4 --compare new.json
+
+SCREEN_SIZE = (120, 40)
+BURST = 50  # Keys per batch for key_burst, about a second of key repeat
+
+
+class HeadlessScreen:
+    # urwid's raw Screen on a pseudo-terminal; a thread drains and drops what it writes
+    def __init__(self, size=SCREEN_SIZE):
+        self.size = size
+        self.master, slave = os.openpty()
+        self.input = os.fdopen(slave, 'r')
+        self.output = os.fdopen(os.dup(slave), 'w')
+        threading.Thread(target=self._drain, name='bench-drain', daemon=True).start()
+        self.screen = Screen(input=self.input, output=self.output)
+        self.screen.register_palette(PALETTE)
+        self.screen.start()
+
+    def _drain(self):
+        while True:
+            try:
+                if not os.read(self.master, 1 << 16):
+                    return
+            except OSError:
+                return
+
+    def draw(self, widget):
+        self.screen.draw_screen(self.size, widget.render(self.size, focus=True))
+
+    def close(self):
+        self.screen.stop()
+        self.output.close()
+        self.input.close()
+        os.close(self.master)
+
+
+class FakeLoop:
+    # Stands in for urwid.MainLoop: the attributes the explorer sets, and
+    # MainLoop.process_input + draw_screen for a single key or, as
+    # TimedMainLoop does, a batch of the same key
+    def __init__(self, explorer, screen):
+        self.widget = explorer.frame
+        self.unhandled_input = explorer.keypress
+        self.jump = explorer.jump
+        self.screen = screen
+        self.screen_size = screen.size
+
+    def press(self, key):
+        self._process(key)
+        self.draw()
+
+    def burst(self, key, count):
+        if not self.jump(key, count):
+            for _ in range(count):
+                self._process(key)
+        self.draw()
+
+    def _process(self, key):
+        if self.widget.selectable():
+            key = self.widget.keypress(self.screen.size, key)
+        if key:
+            self.unhandled_input(key)
+
+    def draw(self):
+        self.screen.draw(self.widget)
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def summary(seconds):
+    ms = sorted(t * 1e3 for t in seconds)
+    return {
+        'n': len(ms),
+        'min': round(ms[0], 4),
+        'median': round(statistics.median(ms), 4),
+        'mean': round(statistics.fmean(ms), 4),
+        'p95': round(ms[min(len(ms) - 1, int(0.95 * len(ms)))], 4),
+        'max': round(ms[-1], 4),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip() or None
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def open_explorer(directory_tree, json_file, screen):
+    explorer = DirectoryExplorer(directory_tree, json_file)
+    explorer.loop = FakeLoop(explorer, screen)
+    explorer.loop.draw()
+    return explorer
+
+
+def navigate(explorer, rounds, times):
+    # Each round: a few rows down, then into directories until a fit's
+    # leaves are shown, then back out to where it started
+    loop = explorer.loop
+    for i in range(rounds):
+        for _ in range(1 + i % 5):
+            times['key_down'].append(timed(lambda: loop.press('down')))
+        depth = 0
+        while True:
+            node = explorer.focused_node()
+            if node is None or not node.is_directory():
+                break
+            times['key_enter'].append(timed(lambda: loop.press('enter')))
+            depth += 1
+        times['key_burst'].append(timed(lambda: loop.burst('down', BURST)))
+        for _ in range(depth):
+            times['key_backspace'].append(timed(lambda: loop.press('backspace')))
+
+
+def descend_to_fit(explorer):
+    # Enter directories along the first rows until the focused row is a leaf
+    while True:
+        node = explorer.focused_node()
+        if node is None or not node.is_directory():
+            return node
+        explorer.loop.press('enter')
+
+
+def edit_focused(explorer, value):
+    # 'e', clear the prompt, type the value; returns the time of the
+    # committing 'enter'
+    loop = explorer.loop
+    loop.press('e')
+    loop.press('end')
+    for _ in explorer.edit_edit.get_edit_text():
+        loop.press('backspace')
+    for char in str(value):
+        loop.press(char)
+    return timed(lambda: loop.press('enter'))
+
+
+def run(args, json_file):
+    tree = write_tree(json_file, make=make_shaped_tree, width=args.width, depth=args.depth, states=args.states)
+    times = {name: [] for name in ('load_cold', 'load_warm', 'first_frame', 'key_down', 'key_enter',
+                                   'key_backspace', 'key_burst', 'update_view', 'edit_commit', 'save')}
+    lazy = {'auto': None, 'lazy': True, 'eager': False}[args.mode]
+    screen = HeadlessScreen()
+    try:
+        for _ in range(args.repeat):
+            if os.path.exists(snapshot_path(json_file)):
+                os.remove(snapshot_path(json_file))
+            times['load_cold'].append(timed(lambda: load_directory_tree(json_file, lazy=lazy)))
+            start = time.perf_counter()
+            directory_tree = load_directory_tree(json_file, lazy=lazy)
+            times['load_warm'].append(time.perf_counter() - start)
+            explorer = open_explorer(directory_tree, json_file, screen)
+            times['first_frame'].append(time.perf_counter() - start)
+            explorer.session.close()
+
+        explorer = open_explorer(load_directory_tree(json_file, lazy=lazy), json_file, screen)
+        saver = explorer.session.saver
+        saver.flush()  # Saves are timed inline below, not on the writer thread
+        navigate(explorer, args.rounds, times)
+        for _ in range(args.rounds):
+            times['update_view'].append(timed(explorer.update_directory_view))
+        explorer.loop.draw()
+
+        node = descend_to_fit(explorer)
+        while node.name != 'tmin':
+            explorer.loop.press('down')
+            node = explorer.focused_node()
+        for i in range(args.edits):
+            times['edit_commit'].append(edit_focused(explorer, 3 + i % 2))
+        for i in range(args.repeat):
+            edit_focused(explorer, 5 + i % 2)
+            times['save'].append(timed(saver._save))  # What the writer thread does per save
+        explorer.session.close()
+    finally:
+        screen.close()
+
+    return {
+        'benchmark': 'explorer',
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'urwid': urwid.__version__,
+        'shape': {'width': args.width, 'depth': args.depth, 'states': args.states, 'mode': args.mode},
+        'file_bytes': os.path.getsize(json_file),
+        'leaves': count_leaves(tree),
+        'metrics': {name: summary(values) for name, values in times.items() if values},
+    }
+
+
+def compare(baseline, result):
+    # Median of each metric against a previous run, on stderr
+    print("%-14s %12s %12s %8s" % ('metric (ms)', 'baseline', 'this run', 'change'), file=sys.stderr)
+    for name, stats in result['metrics'].items():
+        old = baseline.get('metrics', {}).get(name)
+        if old is None:
+            continue
+        change = (stats['median'] / old['median'] - 1) * 100 if old['median'] else float('nan')
+        print("%-14s %12.3f %12.3f %+7.1f%%" % (name, old['median'], stats['median'], change), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless DirectoryExplorer benchmark')
+    parser.add_argument('--width', type=int, default=10, help='directories per level')
+    parser.add_argument('--depth', type=int, default=4, help='levels of directories above the fits')
+    parser.add_argument('--states', type=int, default=3)
+    parser.add_argument('--mode', choices=('auto', 'lazy', 'eager'), default='auto',
+                        help='how the file is loaded (auto: lazily above LAZY_LOAD_SIZE)')
+    parser.add_argument('--repeat', type=int, default=3, help='loads, first frames and saves')
+    parser.add_argument('--rounds', type=int, default=20, help='navigation rounds')
+    parser.add_argument('--edits', type=int, default=50)
+    parser.add_argument('--output', help='write the JSON results here instead of stdout')
+    parser.add_argument('--compare', metavar='BASELINE', help='JSON results of an earlier run')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        result = run(args, os.path.join(tmp, 'synthetic.json'))
+
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), result)
+
+
+if __name__ == '__main__':
+    main()
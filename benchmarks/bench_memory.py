@@ -0,0 +1,78 @@
+import argparse
+import gc
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import write_tree  # noqa: E402
+
+# Resident memory of a loaded tree, plain dicts vs compact Records. Each mode
+# is loaded in a fresh interpreter so the measurements do not share memory.
+#
+#   python benchmarks/bench_memory.py --configs 1000
+
+
+def rss_mb():
+    # Current RSS on Linux, peak RSS elsewhere
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def child(json_file, compact):
+    from fittree import load_directory_tree
+    gc.collect()
+    before = rss_mb()
+    start = time.perf_counter()
+    directory_tree = load_directory_tree(json_file, lazy=False, compact=compact)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    print("%.1f %.3f" % (rss_mb() - before, elapsed))
+    return directory_tree
+
+
+def measure(json_file, compact):
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), '--child', json_file] + (['--compact'] if compact else []))
+    rss, elapsed = output.split()
+    return float(rss), float(elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Memory use of plain vs compact trees')
+    parser.add_argument('--particles', type=int, default=4)
+    parser.add_argument('--momenta', type=int, default=8)
+    parser.add_argument('--configs', type=int, default=500)
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--compact', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.compact)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_file = os.path.join(tmp, 'synthetic.json')
+        write_tree(json_file, particles=args.particles, momenta=args.momenta, configs=args.configs)
+        size_mb = os.path.getsize(json_file) / 1e6
+        plain_rss, plain_time = measure(json_file, compact=False)
+        compact_rss, compact_time = measure(json_file, compact=True)
+
+    print("file size: %.1f MB" % size_mb)
+    print("plain dicts:     %7.1f MB RSS, load %.3f s" % (plain_rss, plain_time))
+    print("compact records: %7.1f MB RSS, load %.3f s" % (compact_rss, compact_time))
+    print("reduction: %.1fx" % (plain_rss / compact_rss))
+
+
+if __name__ == '__main__':
+    main()
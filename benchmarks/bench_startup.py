@@ -0,0 +1,52 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import write_tree  # noqa: E402
+from fittree import load_directory_tree  # noqa: E402
+from snapshot import snapshot_path  # noqa: E402
+
+# Cold vs warm startup: a cold load parses the JSON text (and writes the
+# binary snapshot), a warm load reuses the snapshot.
+#
+#   python benchmarks/bench_startup.py --configs 2000 --repeat 3
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold vs warm startup benchmark')
+    parser.add_argument('--particles', type=int, default=4)
+    parser.add_argument('--momenta', type=int, default=8)
+    parser.add_argument('--configs', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_file = os.path.join(tmp, 'synthetic.json')
+        write_tree(json_file, particles=args.particles, momenta=args.momenta, configs=args.configs)
+        size_mb = os.path.getsize(json_file) / 1e6
+
+        cold, warm = [], []
+        for _ in range(args.repeat):
+            if os.path.exists(snapshot_path(json_file)):
+                os.remove(snapshot_path(json_file))
+            cold.append(timed(lambda: load_directory_tree(json_file, lazy=False)))
+            warm.append(timed(lambda: load_directory_tree(json_file, lazy=False)))
+
+        print("file size: %.1f MB" % size_mb)
+        print("cold start (parse JSON + write snapshot): best %.3f s" % min(cold))
+        print("warm start (load snapshot):               best %.3f s" % min(warm))
+        print("speedup: %.1fx" % (min(cold) / min(warm)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+import json
+
+# Synthetic fit-range trees shaped like the real ensemble files:
+# fit_ranges/<particle>/<momentum>/<smearing>/<channel>/<config>/<Nstate>/{tmin, tmax}
+#
+# or, for scaling runs, of any width and depth:
+# fit_ranges/<a0..>/<b0..>/.../<Nstate>/{tmin, tmax}
+
+PARTICLES = ['Pion', 'Kaon', 'Proton', 'Omega', 'Pion_ss', 'Kaon_ss']
+SMEARINGS = ['SS', 'SP']
+CHANNELS = ['HPo', 'ALL']
+
+
+def fit_window(nstate):
+    return {'tmin': 2 + 13 // nstate, 'tmax': 31}
+
+
+def make_tree(particles=4, momenta=8, configs=50, states=3):
+    fit_ranges = {}
+    for p in range(particles):
+        particle = PARTICLES[p] if p < len(PARTICLES) else 'Particle%d' % p
+        fit_ranges[particle] = {
+            '_%d' % m: {
+                smearing: {
+                    channel: {
+                        'cfg%05d' % c: {
+                            '%dstate' % n: fit_window(n) for n in range(1, states + 1)
+                        } for c in range(configs)
+                    } for channel in CHANNELS
+                } for smearing in SMEARINGS
+            } for m in range(momenta)
+        }
+    return {'fit_ranges': fit_ranges}
+
+
+def make_shaped_tree(width=10, depth=4, states=3):
+    # `depth` levels of `width` directories each above the Nstate fits
+    def level(d):
+        if d == depth:
+            return {'%dstate' % n: fit_window(n) for n in range(1, states + 1)}
+        return {'%s%d' % (chr(ord('a') + d % 26), i): level(d + 1) for i in range(width)}
+    return {'fit_ranges': level(0)}
+
+
+def count_leaves(tree):
+    if not isinstance(tree, dict):
+        return 1
+    return sum(count_leaves(v) for v in tree.values())
+
+
+def write_tree(path, make=make_tree, **shape):
+    tree = make(**shape)
+    with open(path, 'w') as f:
+        json.dump(tree, f, indent=4)
+    return tree
@@ -0,0 +1,157 @@
+import re
+from collections.abc import Mapping
+
+from journal import apply_op, lookup_parent
+from lazy_json import resolve
+
+# Pattern-based bulk edits of fit ranges, e.g.
+#
+#   fit_ranges/Pion/*/S?/**/2state/tmin = 6
+#   fit_ranges/Pion/**/tmin += 1
+#
+# Patterns are '/'-separated globs over leaf paths: '*' and '?' match within
+# one path component, '[...]' is a character class, and '**' matches any
+# number of components. Supported operators are '=', '+=', '-=' and '*='.
+#
+# Matching runs against a PathIndex, a precomputed newline-joined listing of
+# every leaf path, so a pattern is resolved by a single regex scan in C rather
+# than a recursive walk. Edits are returned as journal ops ('set' records)
+# that the caller applies and persists in one go. Current values are read
+# through the tree by path when a command is planned, never through
+# directories remembered from when the index was built: an edit may have
+# replaced those since (a pasted copy is thawed into a new dict on its first
+# edit, see cow.py).
+
+_COMMAND = re.compile(r'^\s*(?P<pattern>.+?)\s*(?P<op>\+=|-=|\*=|=)\s*(?P<value>.*?)\s*$')
+_SEGMENT = r'[^/\n]'
+
+
+class BulkEditError(ValueError):
+    pass
+
+
+def parse_value(text):
+    # Same rules as the explorer's edit prompt: a '.' means float, otherwise
+    # try int, and fall back to the raw string; 'None'/'null' unset a leaf
+    if text in ('None', 'null'):
+        return None
+    try:
+        if '.' in text:
+            return float(text)
+        return int(text)
+    except ValueError:
+        return text
+
+
+def glob_to_regex(pattern):
+    parts = [part for part in pattern.split('/') if part]
+    if not parts:
+        raise BulkEditError("Empty pattern")
+    regex = ''
+    for i, part in enumerate(parts):
+        last = i == len(parts) - 1
+        if part == '**':
+            regex += '.*' if last else '(?:%s+/)*' % _SEGMENT
+            continue
+        j = 0
+        while j < len(part):
+            c = part[j]
+            if c == '*':
+                regex += _SEGMENT + '*'
+            elif c == '?':
+                regex += _SEGMENT
+            elif c == '[' and ']' in part[j + 1:]:
+                end = part.index(']', j + 1)
+                body = part[j + 1:end]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                regex += '[' + body.replace('\\', '\\\\') + ']'
+                j = end
+            else:
+                regex += re.escape(c)
+            j += 1
+        if not last:
+            regex += '/'
+    return regex
+
+
+class PathIndex:
+    # Flat listing of every leaf path in a tree. Value edits keep it valid;
+    # structural edits (add/delete/rename) make it stale and the owner has
+    # to rebuild it.
+    def __init__(self, directory_tree):
+        self.directory_tree = directory_tree
+        self.paths = []
+        self._collect(directory_tree, ())
+        self.text = '\n'.join('/'.join(path) for path in self.paths)
+        self.starts = {}
+        offset = 0
+        for i, path in enumerate(self.paths):
+            self.starts[offset] = i
+            offset += sum(len(key) for key in path) + len(path)  # keys, '/'s and the '\n'
+
+    def _collect(self, directory, prefix):
+        # Iterative walk; children are pushed in reverse so leaves come out in
+        # document order
+        stack = [(directory, prefix)]
+        while stack:
+            node, path = stack.pop()
+            if isinstance(node, Mapping):
+                stack.extend((resolve(node, key), path + (key,)) for key in reversed(list(node.keys())))
+            else:
+                self.paths.append(path)
+
+    def match(self, pattern, base=()):
+        # Indices of the leaves matching a glob pattern, relative to `base`
+        # unless the pattern starts with '/'
+        if not pattern.startswith('/') and base:
+            pattern = '/'.join(re.sub(r'([*?\[])', r'[\1]', key) for key in base) + '/' + pattern
+        regex = re.compile('^' + glob_to_regex(pattern) + '$', re.M)
+        starts = self.starts
+        return [starts[m.start()] for m in regex.finditer(self.text)]
+
+
+def plan_bulk_edit(index, command, base=()):
+    # Returns (ops, skipped) for a command such as 'Pion/**/tmin += 1'
+    m = _COMMAND.match(command)
+    if m is None:
+        raise BulkEditError("Expected '<pattern> = value' or '<pattern> += / -= / *= number'")
+    operator = m.group('op')
+    value = parse_value(m.group('value'))
+    if operator != '=' and (isinstance(value, bool) or not isinstance(value, (int, float))):
+        raise BulkEditError("'%s' needs a numeric value" % operator)
+    ops = []
+    skipped = 0
+    paths = index.paths
+    parent_path = parent = None
+    for i in index.match(m.group('pattern'), base):
+        path = paths[i]
+        if path[:-1] != parent_path:
+            # Matches come in document order: siblings share one lookup
+            parent_path, parent = path[:-1], lookup_parent(index.directory_tree, path)
+        current = parent[path[-1]]
+        if operator == '=':
+            new = value
+        elif isinstance(current, bool) or not isinstance(current, (int, float)):
+            skipped += 1  # Unset or non-numeric leaf
+            continue
+        elif operator == '+=':
+            new = current + value
+        elif operator == '-=':
+            new = current - value
+        else:
+            new = current * value
+        if new != current or type(new) is not type(current):
+            ops.append({'op': 'set', 'path': list(path), 'value': new})
+    return ops, skipped
+
+
+def apply_bulk_edit(directory_tree, command, index=None, base=()):
+    # Function API: resolve and apply a bulk edit in memory, returning the ops
+    # so the caller can persist them once (e.g. via save_directory_tree)
+    if index is None:
+        index = PathIndex(directory_tree)
+    ops, skipped = plan_bulk_edit(index, command, base)
+    for op in ops:
+        apply_op(directory_tree, op)
+    return ops, skipped
@@ -0,0 +1,139 @@
+import operator
+import sys
+from collections.abc import MutableMapping
+
+# Compact in-memory representation for large fit-parameter trees.
+#
+# Fit-range trees are mostly small directories with the same few keys
+# ({tmin, tmax}, {1state, 2state, 3state}, ...), each of which costs a
+# 184-byte dict. When a file is parsed with compact_pairs, every small
+# directory becomes a Record instead: an instance of a class generated per key
+# tuple that keeps the (interned) keys once on the class and the values in
+# __slots__, about a third of the size. Records are MutableMappings, so the explorer,
+# the journal and the savers use them like dicts, and they encode to the same
+# JSON.
+#
+# Setting the value of an existing key stays compact. Anything that changes
+# the key set or order (add, delete, rename) turns that one record into a
+# plain dict held in its '_dict' slot, so dict semantics are kept exactly.
+
+MAX_RECORD_KEYS = 8  # Larger directories stay dicts
+MAX_RECORD_CLASSES = 4096  # Distinct key tuples before we stop generating classes
+
+_classes = {}
+_LEAF_TYPES = frozenset((int, float, str, bool, type(None)))
+
+
+class Record(MutableMapping):
+    __slots__ = ('_dict',)
+    _keys = ()
+    _slots = {}  # key -> slot name, filled in per generated class
+
+    def __getitem__(self, key):
+        d = self._dict
+        if d is not None:
+            return d[key]
+        return getattr(self, self._slots[key])
+
+    def __setitem__(self, key, value):
+        if self._dict is None:
+            slot = self._slots.get(key)
+            if slot is not None:
+                setattr(self, slot, value)
+                return
+            self._to_dict()
+        self._dict[key] = value
+
+    def __delitem__(self, key):
+        self._to_dict()
+        del self._dict[key]
+
+    def __iter__(self):
+        d = self._dict
+        return iter(d if d is not None else self._keys)
+
+    def __len__(self):
+        d = self._dict
+        return len(d) if d is not None else len(self._keys)
+
+    def __contains__(self, key):
+        d = self._dict
+        return key in (d if d is not None else self._slots)
+
+    def _to_dict(self):
+        if self._dict is None:
+            self._dict = {key: getattr(self, slot) for key, slot in self._slots.items()}
+            for slot in self._slots.values():
+                setattr(self, slot, None)
+
+    def to_dict(self):
+        if self._dict is not None:
+            return dict(self._dict)
+        return dict(zip(self._keys, self._values(self)))
+
+    def copy(self, copy_value=None):
+        # A new record of the same class; `copy_value` is applied to each
+        # value except plain scalars, which are immutable and shared
+        cls = type(self)
+        if self._dict is not None:
+            record = cls.__new__(cls)
+            record._dict = {key: value if not copy_value or type(value) in _LEAF_TYPES
+                            else copy_value(value) for key, value in self._dict.items()}
+            return record
+        values = self._values(self)
+        if copy_value and not _LEAF_TYPES.issuperset(map(type, values)):
+            values = [value if type(value) in _LEAF_TYPES else copy_value(value)
+                      for value in values]
+        return cls(*values)
+
+    def __reduce__(self):
+        # Pickles (and copies) as the plain dict it stands for
+        return dict, (list(self.items()),)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+def record_class(keys):
+    # The Record subclass for a key tuple, or None once the class budget is spent
+    if len(_classes) >= MAX_RECORD_CLASSES:
+        return None
+    keys = tuple(sys.intern(key) for key in keys)
+    slots = {key: '_%d' % i for i, key in enumerate(keys)}
+    # A generated __init__ fills the slots from positional values
+    source = "def __init__(self, %s):\n    self._dict = None\n" % ", ".join(slots.values())
+    source += "".join("    self.%s = %s\n" % (slot, slot) for slot in slots.values())
+    namespace = {}
+    exec(source, namespace)
+    getter = operator.attrgetter(*slots.values())
+    cls = _classes[keys] = type('Record', (Record,), {
+        '__module__': __name__,
+        '__slots__': tuple(slots.values()),
+        '__init__': namespace['__init__'],
+        '_keys': keys,
+        '_slots': slots,
+        '_values': staticmethod(getter if len(keys) > 1 else lambda record: (getter(record),)),
+    })
+    return cls
+
+
+def make_record(directory):
+    # A Record holding the same items as `directory`, or None if it should stay a dict
+    keys = tuple(directory)
+    cls = _classes.get(keys)
+    if cls is None:
+        if not 0 < len(keys) <= MAX_RECORD_KEYS or not all(type(key) is str for key in keys):
+            return None
+        cls = record_class(keys)
+        if cls is None:
+            return None
+    return cls(*directory.values())
+
+
+def compact_pairs(pairs):
+    # json object_pairs_hook: small directories are built as Records straight
+    # away, so the parse never allocates the dicts they replace (freeing them
+    # afterwards would leave the interpreter's memory pools fragmented and
+    # barely lower the RSS)
+    directory = dict(pairs)
+    return make_record(directory) or directory
@@ -0,0 +1,66 @@
+from collections.abc import Mapping
+
+_LEAVES = frozenset((int, float, str, bool, type(None), list))
+
+# Copy-on-write sharing of subtrees, for copy/paste and moves.
+#
+# A 'copy' journal op (see journal.py) puts one subtree in two places without
+# copying it: both keys then hold a SharedObject, a read-only view of the
+# same dict. Reads go through the view, and directories read from a view
+# come out as views too, so a copy costs O(1) however large the subtree.
+# Nothing is copied until an edit goes through it: apply_op then swaps each
+# shared directory on the edited path for a private shallow copy whose own
+# directories are still shared (see thaw), so the first edit below a copy
+# costs the size of the directories on its path, and no other holder of the
+# subtree ever sees it. The saver snapshots the tree the same way (see
+# freeze_tree in journal.py), and 'set' ops put their value in as a view,
+# since the op (and the undo history) keeps holding it.
+#
+# The dict behind a view is not changed again, except by resolve() caching a
+# parsed LazyObject in it, which is the same content for every holder.
+
+
+class SharedObject(Mapping):
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __getitem__(self, key):
+        return share(self.data[key])
+
+    def __setitem__(self, key, value):
+        # Only resolve() stores through a view, see above
+        self.data[key] = value
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def thaw(self):
+        # A private shallow copy; the directories in it are still shared
+        return {key: share(value) for key, value in self.data.items()}
+
+    def __repr__(self):
+        return "<SharedObject (%d keys)>" % len(self.data)
+
+
+def share(value):
+    # `value` as it may be held in more than one place. Leaves are replaced
+    # rather than changed in place, and LazyObjects are immutable, so only
+    # directories need a view.
+    kind = type(value)
+    if kind in _LEAVES or kind is SharedObject or not isinstance(value, Mapping):
+        return value
+    return SharedObject(value)
+
+
+def unshared(value):
+    # The dict behind a view, for code that only reads it: walking it skips
+    # a view per directory on the way down
+    return value.data if type(value) is SharedObject else value
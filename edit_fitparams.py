@@ -1,22 +1,118 @@
 import urwid
+import argparse
 import json
-import sys
+import re
 import logging
+import os
+import time
+from itertools import groupby
+from collections import OrderedDict
+from collections.abc import Mapping
+
+from fittree import is_directory, load_directory_tree
+# load_directory_tree and save_directory_tree used to be defined here; keep
+# both importable from this module for scripts written against it
+from fittree import save_directory_tree  # noqa: F401
+from journal import changes_structure, encode_value
+from lazy_json import LazyObject
+from bulk_edit import BulkEditError, PathIndex, plan_bulk_edit
+from nodes import NodeTable
+from fittable import FitTable, TableError
+from instrument import recorder, start_logging, stop_logging
+from merkle import MerkleTree, diff_trees
+from session import TreeSession
+from undo import UndoHistory
+from watcher import FileWatcher
+from workspace import EnsembleRef, Workspace
+
+PALETTE = [
+    ('dir', 'dark green', ''),
+    ('file', 'dark cyan', ''),
+    ('reversed', 'standout', ''),
+    ('save_status', 'dark gray', ''),
+    ('save_error', 'light red', ''),
+    ('table_bad', 'light red', ''),
+    ('diff_changed', 'yellow', ''),
+    ('diff_added', 'light green', ''),
+    ('diff_removed', 'light red', ''),
+    ('diff_reordered', 'dark gray', ''),
+    ('invalid', 'light red', ''),
+]
+
+
+NAVIGATION_KEYS = frozenset(('up', 'down', 'page up', 'page down', 'home', 'end', 'enter', 'backspace',
+                             'left', 'right'))
+JUMP_KEYS = frozenset(('up', 'down', 'page up', 'page down'))  # Runs of these become one focus move
+MAX_FPS = 30  # Default cap on redraws per second; 0 redraws after every input
+
+
+# The prompts of the edit modes: edit_type -> (attribute holding the prompt's
+# Edit, method given its text on Enter, whether an empty text is ignored)
+PROMPTS = {
+    'add_choice': ('add_choice_edit', 'choose_add_type', False),
+    'add_name': ('add_edit', 'apply_add_name', True),
+    'rename': ('edit_edit', 'apply_rename', True),
+    'edit_data': ('edit_edit', 'apply_edit_data', True),
+    'add_data': ('edit_edit', 'apply_add_data', True),
+    'delete_confirm': ('delete_confirm_edit', 'apply_delete_key', False),
+    'delete_data_confirm': ('delete_data_confirm_edit', 'apply_delete_data', False),
+    'diff_file': ('diff_edit', 'show_diff', False),
+    'table_filter': ('table_edit', 'apply_table_filter', False),
+    'table_sort': ('table_edit', 'apply_table_sort', False),
+    'bulk_edit': ('bulk_edit_edit', 'apply_bulk_edit', True),
+    'paste': ('paste_edit', 'apply_paste', True),
+}
+
+class TimedMainLoop(urwid.MainLoop):
+    # Records how long each key and each redraw takes (see instrument.py);
+    # `classify` names the action a key is recorded under.
+    #
+    # When keys arrive faster than they are handled (a held arrow key, a
+    # paste, a slow SSH link) the terminal delivers them in batches. A run of
+    # the same JUMP_KEYS key in a batch is offered to `jump(key, count)`,
+    # which moves the focus once instead of `count` times; and the screen is
+    # redrawn at most `max_fps` times a second: input arriving sooner after
+    # the last frame only schedules one more, from an alarm.
+    def __init__(self, widget, palette, classify, jump=None, max_fps=MAX_FPS, **kwargs):
+        super().__init__(widget, palette, **kwargs)
+        self.classify = classify
+        self.jump = jump
+        self.frame_interval = 1.0 / max_fps if max_fps > 0 else 0.0
+        self.last_frame = 0.0
+        self.frame_alarm = None
+
+    def process_input(self, keys):
+        handled = False
+        for key, run in groupby(keys):
+            count = len(list(run))
+            if count > 1 and key in JUMP_KEYS and self.jump is not None:
+                with recorder.timed('navigate'):
+                    if self.jump(key, count):
+                        handled = True
+                        continue
+            for _ in range(count):
+                with recorder.timed(self.classify(key) if isinstance(key, str) else 'navigate'):
+                    handled = super().process_input([key]) or handled
+        return handled
+
+    def entering_idle(self):
+        if self.frame_alarm is not None:
+            return  # A frame is already scheduled
+        wait = self.last_frame + self.frame_interval - time.monotonic()
+        if wait > 0:
+            self.frame_alarm = self.set_alarm_in(wait, self._frame_due)
+        else:
+            super().entering_idle()
 
-logging.basicConfig(
-    filename='app_debug.log',  # Log file name
-    filemode='w',               # Append mode
-    level=logging.DEBUG,        # Log level
-    format='%(asctime)s - %(levelname)s - %(message)s'  # Log format
-)
+    def _frame_due(self, loop=None, user_data=None):
+        # The event loop goes idle right after an alarm, which draws the frame
+        self.frame_alarm = None
 
-def load_directory_tree(json_file):
-    with open(json_file, 'r') as f:
-        return json.load(f)
+    def draw_screen(self):
+        with recorder.timed('render'):
+            super().draw_screen()
+        self.last_frame = time.monotonic()
 
-def save_directory_tree(json_file, directory_tree):
-    with open(json_file, 'w') as f:
-        json.dump(directory_tree, f, indent=4)
 
 class CircularListBox(urwid.ListBox):
     def keypress(self, size, key):
@@ -35,270 +131,844 @@ class CircularListBox(urwid.ListBox):
         # For other keys or non-edge cases, use the default behavior
         return super().keypress(size, key)
 
+def make_row(label, attr, node=None):
+    # Each row carries the node it shows, so key handlers never parse labels
+    row = urwid.AttrMap(urwid.SelectableIcon(label, 0), attr, focus_map='reversed')
+    row.node = node
+    return row
+
+def is_empty_directory(value):
+    # A directory with no entries; an ensemble that is not open, or a
+    # subtree not parsed yet, is never asked (that would load it)
+    return isinstance(value, Mapping) and not isinstance(value, EnsembleRef) and not value
+
+def row_label(name, value, summary=None):
+    # Returns the label and palette attribute for one directory entry, with
+    # the aggregates of a directory (see aggregates.py) when known
+    if is_directory(value):
+        icon = "[ ] " if is_empty_directory(value) else "[D] "
+        return icon + name + directory_note(value, summary), 'dir'
+    return "[F] " + name + f" = {value}", 'file'
+
+def directory_note(value, summary):
+    # What follows a directory's name
+    if is_empty_directory(value):
+        return "  (empty)"
+    if isinstance(value, LazyObject):
+        return "  (not loaded)"
+    if summary is None:
+        return ""
+    parts = [f"{summary.leaves} leaves" if summary.leaves != 1 else "1 leaf"]
+    if summary.fits:
+        parts.append(f"{summary.fits} fits" if summary.fits != 1 else "1 fit")
+    for key in ('tmin', 'tmax'):
+        spread = summary.spread(key)
+        if spread is not None:
+            low, high = spread
+            parts.append(f"{key} {low}" if low == high else f"{key} {low}..{high}")
+    if summary.unset:
+        parts.append(f"{summary.unset} unset")
+    if summary.pending:
+        parts.append(f"{summary.pending} not loaded")
+    return "  (" + ", ".join(parts) + ")"
+
+class DirectoryWalker(urwid.ListWalker):
+    # Lazy walker over the keys of one directory. Row widgets are only built
+    # for positions the ListBox actually asks for (the visible window plus a
+    # row or two around it) and kept in a bounded LRU cache, so opening a
+    # directory costs the same whether it holds 10 or 100k entries.
+    # Rows are cached by key name so single-entry edits can be patched in
+    # place (see refresh_key/insert_key/remove_key/rename_key).
+    CACHE_SIZE = 512
+
+    def __init__(self, node, problems=None, summaries=None):
+        self.node = node
+        self.directory = node.directory
+        self.problems = problems  # name -> validation messages for that leaf
+        self.summaries = summaries  # name -> aggregates of that directory, or None
+        self.keys = list(self.directory.keys())
+        self.focus = 0
+        self._rows = OrderedDict()
+
+    def __len__(self):
+        return len(self.keys) or 1  # An empty directory shows a single "(Empty)" row
+
+    def positions(self, reverse=False):
+        if reverse:
+            return range(len(self) - 1, -1, -1)
+        return range(len(self))
+
+    def get_row(self, position):
+        name = self.keys[position] if self.keys else None
+        row = self._rows.get(name)
+        if row is not None:
+            self._rows.move_to_end(name)
+            return row
+        if name is None:
+            row = make_row("(Empty)", None)
+        else:
+            row = self.build_row(name)
+        self._rows[name] = row
+        if len(self._rows) > self.CACHE_SIZE:
+            self._rows.popitem(last=False)
+        return row
+
+    def build_row(self, name):
+        value = self.directory[name]
+        summary = self.summaries(name) if self.summaries is not None and is_directory(value) else None
+        label, attr = row_label(name, value, summary)
+        problems = self.problems(name) if self.problems is not None and attr == 'file' else None
+        if problems:
+            label, attr = label + "  ! " + "; ".join(problems), 'invalid'
+        return make_row(label, attr, node=self.node.child(name))
+
+    def __getitem__(self, position):
+        if not 0 <= position < len(self):
+            raise IndexError(position)
+        return self.get_row(position)
+
+    def get_focus(self):
+        return self.get_row(self.focus), self.focus
+
+    def set_focus(self, position):
+        self.focus = max(0, min(position, len(self) - 1))
+        self._modified()
+
+    def get_next(self, position):
+        if position + 1 >= len(self):
+            return None, None
+        return self.get_row(position + 1), position + 1
+
+    def get_prev(self, position):
+        if position <= 0:
+            return None, None
+        return self.get_row(position - 1), position - 1
+
+    def index(self, name):
+        # The edited entry is almost always the focused one
+        if self.focus < len(self.keys) and self.keys[self.focus] == name:
+            return self.focus
+        return self.keys.index(name)
+
+    def refresh_all(self):
+        # Values changed in place (e.g. a bulk edit); keys and focus are unchanged
+        self._rows.clear()
+        self._modified()
+
+    def refresh_key(self, name):
+        # Value changed: rebuild just that row on its next render
+        self._rows.pop(name, None)
+        self._modified()
+
+    def insert_key(self, name):
+        # New keys are appended by dict insertion order
+        self._rows.pop(None, None)
+        self.keys.append(name)
+        self.set_focus(len(self.keys) - 1)
+
+    def remove_key(self, name):
+        position = self.index(name)
+        del self.keys[position]
+        self._rows.pop(name, None)
+        self.set_focus(min(self.focus, len(self) - 1))
+
+    def rename_key(self, old_name, new_name):
+        # A rename pops and reinserts the key, so it moves to the end
+        del self.keys[self.index(old_name)]
+        self._rows.pop(old_name, None)
+        self.keys.append(new_name)
+        self.set_focus(len(self.keys) - 1)
+
+class TableWalker(DirectoryWalker):
+    # Rows of a FitTable in filter/sort order, built lazily and cached like
+    # directory rows; the "keys" are row indices into the table
+    def __init__(self, table, widths):
+        self.table = table
+        self.widths = widths
+        self.keys = table.order.tolist()
+        self.focus = 0
+        self._rows = OrderedDict()
+
+    def build_row(self, index):
+        cells = self.table.row(index)
+        label = "  ".join(cell.ljust(width) for cell, width in zip(cells, self.widths))
+        return make_row(label, 'table_bad' if self.table.is_inconsistent(index) else 'file')
+
+def diff_value(value):
+    return "{...}" if is_directory(value) else f"{value}"
+
+class DiffWalker(DirectoryWalker):
+    # Rows of a structural diff (see merkle.diff_trees), built lazily and
+    # cached like directory rows; the "keys" are indices into the change list
+    SYMBOLS = {'changed': '~', 'added': '+', 'removed': '-', 'reordered': '='}
+
+    def __init__(self, changes, base):
+        self.changes = changes
+        self.base = base  # Number of leading path keys not shown
+        self.keys = list(range(len(changes)))
+        self.focus = 0
+        self._rows = OrderedDict()
+
+    def build_row(self, index):
+        kind, path, old, new = self.changes[index]
+        label = self.SYMBOLS[kind] + " " + "/".join(path[self.base:])
+        if kind == 'changed':
+            label += f": {diff_value(old)} -> {diff_value(new)}"
+        elif kind == 'added':
+            label += f" = {diff_value(new)}"
+        elif kind == 'removed':
+            label += f" (was {diff_value(old)})"
+        else:
+            label += " (keys reordered)"
+        return make_row(label, 'diff_' + kind)
+
+class ProblemWalker(DirectoryWalker):
+    # Rows of the validation summary; the "keys" are indices into a list of
+    # (path of the fit directory, Violation)
+    def __init__(self, problems):
+        self.entries = problems
+        self.keys = list(range(len(problems)))
+        self.focus = 0
+        self._rows = OrderedDict()
+
+    def build_row(self, index):
+        path, violation = self.entries[index]
+        return make_row(f"! /{'/'.join(path)}: {violation.message}", 'invalid')
+
+class OutlineWalker(urwid.ListWalker):
+    # The tree below `root` as an indented outline. A position is the tuple
+    # of child indices from the root, so expanding or collapsing a node
+    # leaves the position of every other row alone. A node's keys are only
+    # listed when it is expanded (and forgotten when it is collapsed), and,
+    # as in DirectoryWalker, rows are built only for the positions the
+    # ListBox asks for and kept in a bounded LRU cache, so expanding a node
+    # with 100k children costs one list of its keys.
+    CACHE_SIZE = 512
+    INDENT = 2
+
+    def __init__(self, root, problems=None, summaries=None):
+        self.root = root
+        self.problems = problems  # Node -> validation messages for that leaf
+        self.summaries = summaries  # Node -> aggregates of that directory, or None
+        self.expanded = {root: list(root.directory.keys())}  # Node -> its keys, per expanded node
+        self.focus = (0,) if self.expanded[root] else ()  # () is the "(Empty)" row
+        self._rows = OrderedDict()
+
+    def node_at(self, position):
+        node = self.root
+        for i in position:
+            node = node.child(self.expanded[node][i])
+        return node
+
+    def get_row(self, position):
+        row = self._rows.get(position)
+        if row is not None:
+            self._rows.move_to_end(position)
+            return row
+        if position == ():
+            row = make_row("(Empty)", None)
+        else:
+            row = self.build_row(self.node_at(position), len(position) - 1)
+        self._rows[position] = row
+        if len(self._rows) > self.CACHE_SIZE:
+            self._rows.popitem(last=False)
+        return row
+
+    def build_row(self, node, depth):
+        indent = " " * (self.INDENT * depth)
+        value = node.value()
+        if is_directory(value):
+            # Nothing to expand in an empty directory: no marker, as for a leaf
+            marker = "  " if is_empty_directory(value) else "- " if node in self.expanded else "+ "
+            summary = self.summaries(node) if self.summaries is not None else None
+            return make_row(indent + marker + node.name + directory_note(value, summary), 'dir', node=node)
+        label, attr = indent + "  " + node.name + f" = {value}", 'file'
+        problems = self.problems(node) if self.problems is not None else None
+        if problems:
+            label, attr = label + "  ! " + "; ".join(problems), 'invalid'
+        return make_row(label, attr, node=node)
+
+    def get_focus(self):
+        return self.get_row(self.focus), self.focus
+
+    def set_focus(self, position):
+        self.focus = position
+        self._modified()
+
+    def get_next(self, position):
+        position = self.next_position(position)
+        return (None, None) if position is None else (self.get_row(position), position)
+
+    def get_prev(self, position):
+        position = self.prev_position(position)
+        return (None, None) if position is None else (self.get_row(position), position)
+
+    def next_position(self, position):
+        # The row after `position`, without building any row widgets
+        if position == ():
+            return None
+        if self.expanded.get(self.node_at(position)):
+            return position + (0,)
+        while position:
+            parent, i = position[:-1], position[-1]
+            if i + 1 < len(self.expanded[self.node_at(parent)]):
+                return parent + (i + 1,)
+            position = parent
+        return None
+
+    def prev_position(self, position):
+        if not position or position == (0,):
+            return None
+        if position[-1] == 0:
+            return position[:-1]
+        return self.last_below(position[:-1] + (position[-1] - 1,))
+
+    def last_below(self, position):
+        # The last visible row at or below `position`
+        node = self.node_at(position)
+        while self.expanded.get(node):
+            position += (len(self.expanded[node]) - 1,)
+            node = node.child(self.expanded[node][-1])
+        return position
+
+    def positions(self, reverse=False):
+        # Lazily, in display order (the ListBox only takes the first for Home/End)
+        if not self.expanded[self.root]:
+            yield ()
+            return
+        position = self.last_below((len(self.expanded[self.root]) - 1,)) if reverse else (0,)
+        step = self.prev_position if reverse else self.next_position
+        while position is not None:
+            yield position
+            position = step(position)
+
+    def is_expanded(self, position):
+        return position != () and self.node_at(position) in self.expanded
+
+    def expand(self, position):
+        node = self.node_at(position)
+        if node not in self.expanded and node.is_directory():
+            self.expanded[node] = list(node.directory.keys())
+            self._rows.pop(position, None)
+            self._modified()
+
+    def collapse(self, position):
+        # Forget the keys of the node and of everything expanded below it
+        node = self.node_at(position)
+        for other in list(self.expanded):
+            ancestor = other
+            while ancestor is not None and ancestor is not node:
+                ancestor = ancestor.parent
+            if ancestor is node:
+                del self.expanded[other]
+        for cached in [p for p in self._rows if p[:len(position)] == position]:
+            del self._rows[cached]
+        self._modified()
+
+    def refresh_all(self):
+        # After edits: list the keys of the expanded nodes again, drop the
+        # ones that are gone and keep the focus on a row that still exists
+        for node in list(self.expanded):
+            if node is not self.root and not node.alive():
+                del self.expanded[node]
+            else:
+                self.expanded[node] = list(node.directory.keys())
+        focus, node = (), self.root
+        for i in self.focus:
+            keys = self.expanded.get(node)
+            if not keys:
+                break
+            i = min(i, len(keys) - 1)
+            focus += (i,)
+            node = node.child(keys[i])
+        self.focus = focus
+        self._rows.clear()
+        self._modified()
+
+class SearchWalker(DirectoryWalker):
+    # Rows of the search view, best match first; the "keys" are indices into
+    # a list of (score, path)
+    def __init__(self, nodes, results):
+        self.nodes = nodes
+        self.results = results
+        self.keys = list(range(len(results)))
+        self.focus = 0
+        self._rows = OrderedDict()
+
+    def build_row(self, index):
+        score, path = self.results[index]
+        try:
+            node = self.nodes.lookup(path)
+        except KeyError:
+            return make_row("/" + "/".join(path) + " (gone)", None)
+        label, attr = row_label("/" + "/".join(path), node.value())
+        return make_row(label, attr, node=node)
+
 class DirectoryExplorer:
     def __init__(self, directory_tree, json_file):
         self.directory_tree = directory_tree
         self.json_file = json_file  # To save changes
-        self.current_path = ['fit_ranges']
+        self.nodes = NodeTable(directory_tree)
+        # Set before any session exists: its threads call back into these
+        self.loop = None
+        self.save_status_pipe = None
+        self.index_pipe = None
+        if isinstance(directory_tree, Workspace):
+            # One session per ensemble, opened on demand by the workspace
+            self.session = directory_tree
+            self.session.notify = self.notify_save_status
+            self.session.on_indexed = self.notify_indexed
+            self.session.on_evict = lambda name: self.nodes.forget([name])
+            self.current_node = self.nodes.root
+        else:
+            self.session = TreeSession(json_file, directory_tree, notify=self.notify_save_status,
+                                       on_indexed=self.notify_indexed)
+            try:
+                self.current_node = self.nodes.lookup(['fit_ranges'])
+            except KeyError:
+                self.current_node = self.nodes.root
+        self.watcher = None  # Polls the open files for changes made by others
+        self.path_index = None  # Leaf path index for bulk edits, built on first use
+        self.path_index_tree = None  # The tree path_index was built over
         self.current_dir = self.get_current_dir()
-        self.history = []  # To keep track of navigation history
+        self.history = []  # Nodes of the directories visited before, for backspace
+        self.undo = UndoHistory()  # Inverse ops of every edit, for undo/redo
+        self.table = None  # FitTable while the table view is open
+        self.diff = None  # Changes shown while the diff view is open
+        self.problem_list = None  # Violations shown while the validation summary is open
+        self.found = None  # Matches shown while the search view is open
+        self.outline = None  # OutlineWalker while the outline view is open
+        self.outline_box = None
+        self.search_edit = None
+        self.search_status = None
         self.editing = False  # Flag to indicate if editing is active
         self.adding = False  # Flag to indicate if adding is active
         self.adding_type = None  # Type of item being added ('d' or 'f')
+        self.clipboard = None  # (node, True if it was cut) for 'p'
 
         # Initialize UI components with CircularListBox
-        self.listbox = CircularListBox(urwid.SimpleFocusListWalker([]))
+        self.listbox = CircularListBox(DirectoryWalker(self.current_node))
+
+        # Footer: key help on the left, save status of the background saver on the right
+        self.save_status = urwid.Text("", align='right')
+        self.footer = urwid.Columns([
+            urwid.Text("Use Arrow Keys to navigate, Enter to enter, 'r' to rename, 'e' to edit data, 'a' to add, 'd' to delete, 'c'/'x'/'p' to copy/cut/paste, ':' for bulk edit, 'u'/Ctrl-R to undo/redo, 't' for a table of fits, 'D' to diff, 'v' for validation problems, '/' to search, 'o' for an outline, 'L' for latency, Backspace to go back."),
+            (16, self.save_status),
+        ])
+        self.update_save_status()
 
         # Create a frame to hold the listbox and a footer
         self.frame = urwid.Frame(
             header=urwid.Text("Directory Explorer - Current Path: /" + "/".join(self.current_path) + " (Press 'q' to quit)"),
             body=self.listbox,
-            footer=urwid.Text("Use Arrow Keys to navigate, Enter to enter, 'r' to rename, 'e' to edit data, 'a' to add, 'd' to delete, Backspace to go back.")
+            footer=self.footer
         )
         # after frame, then you can update_directory_view
         self.update_directory_view()
 
+    @property
+    def current_path(self):
+        return self.current_node.path()
+
     def get_current_dir(self):
-        dir_ref = self.directory_tree
-        for folder in self.current_path:
-            dir_ref = dir_ref.get(folder, {})
-        return dir_ref
+        # The current node keeps a reference to its directory (parsing a
+        # lazily loaded subtree the first time we enter it)
+        return self.current_node.directory
+
+    def focused_node(self):
+        # The node behind the focused row; None on an empty directory's placeholder
+        focus_widget, focus_position = self.listbox.get_focus()
+        if focus_widget is None:
+            return None
+        return focus_widget.node
+
+    def commit(self, op):
+        # Apply a mutation to the tree and append it to the edit journal;
+        # the full JSON is rewritten later by the saver thread
+        self.commit_many([op])
+        return op
+
+    def commit_many(self, ops, record=True):
+        # Apply a batch of mutations with a single journal write and a single
+        # save (or a single SQLite transaction); the batch is one undo step
+        if self.path_index is not None and any(changes_structure(self.directory_tree, op) for op in ops):
+            self.path_index = None
+        inverses = self.session.commit_many(ops)
+        for op in ops:
+            self.nodes.apply(op)
+        if record:
+            self.undo.record(ops, inverses)
+        return ops
+
+    def undo_last(self):
+        if not self.undo.can_undo():
+            self.show_message("Nothing to undo.")
+            return
+        ops = self.commit_many(self.undo.pop_undo(), record=False)
+        self.refresh_after_history(ops)
+
+    def redo_last(self):
+        if not self.undo.can_redo():
+            self.show_message("Nothing to redo.")
+            return
+        ops = self.commit_many(self.undo.pop_redo(), record=False)
+        self.refresh_after_history(ops)
+
+    def refresh_after_history(self, ops):
+        # Stay in the current directory unless the step removed it, and focus
+        # the entry it touched if that entry is in view
+        self.update_directory_view()
+        walker = self.listbox.body
+        for op in reversed(ops):
+            *parent, name = op['path']
+            name = op['to'] if op['op'] == 'rename' else name
+            if parent == self.current_path and name in self.current_dir:
+                walker.set_focus(walker.keys.index(name))
+                break
+
+    def session_at(self, path):
+        # The session holding `path` and the path within it; (None, None) for
+        # the workspace root
+        if isinstance(self.directory_tree, Workspace):
+            if not path:
+                return None, None
+            return self.directory_tree.session(path[0]), path[1:]
+        return self.session, path
+
+    def open_sessions(self):
+        # (path prefix, session) of every file currently loaded
+        if isinstance(self.directory_tree, Workspace):
+            return [([name], session) for name, session in list(self.directory_tree.sessions.items())]
+        return [([], self.session)]
+
+    def at_workspace_root(self):
+        return isinstance(self.directory_tree, Workspace) and self.current_node is self.nodes.root
+
+    def notify_save_status(self, status):
+        # Called from the saver thread: wake the UI thread through the pipe
+        if self.save_status_pipe is not None:
+            os.write(self.save_status_pipe, b'.')
+
+    def notify_indexed(self):
+        # Called from a session's indexer thread once its index is built
+        if self.index_pipe is not None:
+            os.write(self.index_pipe, b'.')
+
+    def index_built(self, data=None):
+        # Searches made while indexing only had the files indexed so far
+        if self.search_edit is not None:
+            self.update_search()
+        return True
+
+    def update_save_status(self, data=None):
+        status = self.session.status
+        attr = 'save_error' if status == 'error' else 'save_status'
+        self.save_status.set_text((attr, "[%s]" % status))
+        return True  # Keep the watch_pipe callback registered
+
+    def on_external_change(self, prefix, session, signature, result):
+        # Another program rewrote an open file: merge its changes into the
+        # tree and refresh the view only if they touch what is shown
+        name = os.path.basename(session.json_file)
+        if result is None:
+            self.show_message(f"{name} changed on disk but could not be read.")
+            return
+        if prefix and self.directory_tree.sessions.get(prefix[0]) is not session:
+            return  # Evicted from the workspace since; reloaded from disk on demand
+        ops, conflicts = result
+        applied, skipped = session.merge_external(ops, signature)
+        applied = [dict(op, path=prefix + op['path']) for op in applied]
+        self.path_index = None
+        for op in applied:
+            self.nodes.apply(op)
+        conflicts = [(kind, prefix + path, ours, theirs) for kind, path, ours, theirs in conflicts]
+        conflicts += [('changed', prefix + op['path'], None, op.get('value')) for op in skipped]
+        if self.outline is not None and applied:
+            self.outline.refresh_all()
+        elif self.table is None and self.diff is None and self.problem_list is None and self.found is None \
+                and self.outline is None and not self.editing:
+            if not self.current_node.alive():
+                self.update_directory_view()
+            elif any(op['path'][:-1] == self.current_path for op in applied):
+                # Rebuild the rows of this directory, keeping the focused key
+                walker = self.listbox.body
+                focus = walker.keys[walker.focus] if walker.keys else None
+                self.update_directory_view()
+                walker = self.listbox.body
+                if focus in walker.keys:
+                    walker.set_focus(walker.keys.index(focus))
+        if not applied and not conflicts:
+            return
+        message = f"{name} changed on disk: merged {len(applied)} change(s)."
+        if conflicts:
+            message += f" {len(conflicts)} conflict(s) with unsaved edits kept local (see app_debug.log)."
+            for kind, path, ours, theirs in conflicts:
+                logging.warning("Conflict in %s at /%s: kept %r, file has %r", name, "/".join(path), ours, theirs)
+        if not self.editing:
+            self.show_message(message)
+
+    def jump(self, key, count):
+        # `count` presses of a JUMP_KEYS key as a single focus move, for
+        # TimedMainLoop; False leaves them to be handled one at a time
+        size = self.loop.screen_size
+        if self.editing or size is None or self.loop.widget is not self.frame \
+                or self.frame.focus_position != 'body':
+            return False
+        listbox = self.frame.body
+        walker = listbox.body
+        forward = key in ('down', 'page down')
+        if key in ('page up', 'page down'):
+            (top, bottom), _ = self.frame.frame_top_bottom(size, True)
+            count *= max(1, size[1] - top - bottom - 1)  # A page moves by about a screenful
+        if isinstance(walker, DirectoryWalker) and listbox is self.listbox:
+            if not walker.keys:
+                return True
+            focus = walker.focus + (count if forward else -count)
+            if key in ('up', 'down'):
+                focus %= len(walker.keys)  # CircularListBox wraps around at either end
+            else:
+                focus = min(max(focus, 0), len(walker.keys) - 1)
+        elif isinstance(walker, OutlineWalker):
+            step = walker.next_position if forward else walker.prev_position
+            focus = walker.focus
+            for _ in range(count):
+                position = step(focus)
+                if position is None:
+                    break
+                focus = position
+        else:
+            return False
+        listbox.set_focus(focus, 'above' if forward else 'below')
+        return True
+
+    def input_action(self, key):
+        # Latency histogram a key is recorded under
+        if self.editing:
+            return 'edit'
+        return 'navigate' if key in NAVIGATION_KEYS else 'command'
+
+    def item_path(self, name):
+        return self.current_path + [name]
 
     def update_directory_view(self):
+        # Fall back to the closest surviving directory if an edit removed ours
+        self.current_node = self.nodes.nearest(self.current_node)
         self.current_dir = self.get_current_dir()
-        contents = list(self.current_dir.keys())
-        if not contents:
-            contents = ["(Empty)"]
 
         # Update header with current path
         path = "/" + "/".join(self.current_path)
         self.frame.header = urwid.Text(f"FitParams Explorer - Current Path: {path} (Press 'q' to quit)")
 
-        # Create a list of selectable items with icons and color coding
-        items = []
-        for folder in contents:
-            if folder == "(Empty)":
-                text = folder
-                items.append(urwid.AttrMap(urwid.SelectableIcon(text, 0), None, focus_map='reversed'))
-            else:
-                value = self.current_dir[folder]
-                if isinstance(value, dict):
-                    if value:
-                        # Directory with contents
-                        icon = "[D] "
-                    else:
-                        # Empty Directory
-                        icon = "[D] "
-                    text = icon + folder
-                    attr = 'dir'
-                else:
-                    # Data node
-                    icon = "[F] "
-                    text = icon + folder + f" = {value}"
-                    attr = 'file'
-
-                items.append(urwid.AttrMap(urwid.SelectableIcon(text, 0), attr, focus_map='reversed'))
+        # Rows are built lazily by the walker as they scroll into view, with
+        # the validation problems of each leaf next to it
+        session, path = self.session_at(self.current_path)
+        problems = summaries = None
+        if session is not None:
+            session.validator.visit(path)
+            session.aggregates.visit(path)
+            problems = lambda name: session.validator.problems(path, name)
+            summaries = lambda name: session.aggregates.summary(path + [name])
+        elif isinstance(self.directory_tree, Workspace):
+            # Totals of the ensembles already open; none is opened for a label
+            sessions = self.directory_tree.sessions
+            summaries = lambda name: sessions[name].aggregates.summary([]) if name in sessions else None
+        self.listbox.body = DirectoryWalker(self.current_node, problems, summaries)
+
+    def patch_directory_view(self, op):
+        # Incremental counterpart of update_directory_view for a single
+        # committed op: touch only the affected row and keep the focus put
+        if self.outline is not None:
+            self.outline.refresh_all()
+            return
+        self.current_dir = self.get_current_dir()  # A private copy now, if it was shared (see cow.py)
+        *parent, name = op['path']
+        walker = self.listbox.body
+        if parent != self.current_path or not isinstance(walker, DirectoryWalker) \
+                or walker.directory is not self.current_dir:
+            self.update_directory_view()
+            return
+        if op['op'] == 'delete':
+            walker.remove_key(name)
+        elif op['op'] == 'rename':
+            walker.rename_key(name, op['to'])
+        elif len(walker.keys) < len(self.current_dir):
+            # A 'set' that grew the directory added a new key
+            walker.insert_key(name)
+        # Rules compare sibling keys (tmin < tmax), so the validation marks of
+        # the other rows may change with any op here; rows are rebuilt as
+        # they are drawn, so this costs the visible ones
+        walker.refresh_all()
+
+    def prompt_keypress(self, key):
+        # Enter closes the prompt and hands its text to the handler PROMPTS
+        # names for the edit mode, Esc closes it, and the prompt's Edit gets
+        # every other key
+        field, handler, skip_empty = PROMPTS[self.edit_type]
+        edit = getattr(self, field)
+        if key == 'enter':
+            text = edit.get_edit_text().strip()
+            self.close_prompt()
+            if text or not skip_empty:
+                getattr(self, handler)(text)
+        elif key == 'esc':
+            self.close_prompt()
+        else:
+            edit.keypress((0,), key)
 
-        # Update the listbox
-        self.listbox.body = urwid.SimpleFocusListWalker(items)
-    def keypress(self, key):
-        logging.debug("Key pressed: %s"%(key))
-        if self.editing:
-            logging.debug("Currently editing: %s"%(self.edit_type))
-            if self.edit_type == 'add_choice':
-                if key == 'enter':
-                    choice = self.add_choice_edit.get_edit_text().strip().lower()
-                    if choice in ('d', 'f'):
-                        self.initiate_add_name(choice)
-                    else:
-                        self.show_message("Invalid choice. Press 'd' for directory or 'f' for file.")
-                    # self.editing = False
-                    # self.edit_type = None
-                    return  # Prevent further processing
-                elif key == 'esc':
-                    # Cancel adding
-                    self.editing = False
-                    self.edit_type = None
-                    self.loop.widget = self.frame
-                    return  # Prevent further processing
-                else:
-                    # Let the Edit widget handle other keys
-                    self.add_choice_edit.keypress((0,), key)
-                    return  # Prevent further processing
+    def close_prompt(self):
+        self.editing = False
+        self.edit_type = None
+        self.loop.widget = self.frame
 
-            elif self.edit_type == 'add_name':
-                logging.debug("Currently editing: %s"%(self.edit_type))
-                if key == 'enter':
-                    new_name = self.add_edit.get_edit_text().strip()
-                    if new_name:
-                        self.apply_add_key(new_name, self.adding_type)
-                    self.editing = False
-                    self.edit_type = None
-                    self.loop.widget = self.frame
-                    return  # Prevent further processing
-                elif key == 'esc':
-                    # Cancel adding
-                    self.editing = False
-                    self.edit_type = None
-                    self.loop.widget = self.frame
-                    return  # Prevent further processing
-                else:
-                    # Let the Edit widget handle other keys
-                    self.add_edit.keypress((0,), key)
-                    return  # Prevent further processing
+    def choose_add_type(self, choice):
+        choice = choice.lower()
+        if choice in ('d', 'f'):
+            self.initiate_add_name(choice)
+        else:
+            self.show_message("Invalid choice. Press 'd' for directory or 'f' for file.")
 
-            elif self.edit_type == 'rename':
-                if key == 'enter':
-                    new_name = self.edit_edit.get_edit_text().strip()
-                    if new_name:
-                        self.apply_rename(new_name)
-                    self.editing = False
-                    self.edit_type = None
-                    self.loop.widget = self.frame
-                    return  # Prevent further processing
-                elif key == 'esc':
-                    # Cancel renaming
-                    self.editing = False
-                    self.edit_type = None
-                    self.loop.widget = self.frame
-                    return  # Prevent further processing
-                else:
-                    # Let the Edit widget handle other keys
-                    self.edit_edit.keypress((0,), key)
-                    return  # Prevent further processing
+    def apply_add_name(self, new_name):
+        self.apply_add_key(new_name, self.adding_type)
 
-            elif self.edit_type == 'edit_data':
-                if key == 'enter':
-                    new_data = self.edit_edit.get_edit_text().strip()
-                    if new_data:
-                        self.apply_edit_data(new_data)
-                    self.editing = False
-                    self.edit_type = None
-                    self.loop.widget = self.frame
-                    return  # Prevent further processing
-                elif key == 'esc':
-                    # Cancel editing data
-                    self.editing = False
-                    self.edit_type = None
-                    self.loop.widget = self.frame
-                    return  # Prevent further processing
-                else:
-                    # Let the Edit widget handle other keys
-                    self.edit_edit.keypress((0,), key)
-                    return  # Prevent further processing
-            elif self.edit_type == 'add_data':
-                if key == 'enter':
-                    new_data = self.edit_edit.get_edit_text().strip()
-                    if new_data:
-                        self.apply_add_data(new_data)
-                    self.editing = False
-                    self.loop.widget = self.frame
-                elif key == 'esc':
-                    self.editing = False
-                    self.loop.widget = self.frame
-                else:
-                    self.edit_edit.keypress((0,), key)
+    def apply_table_filter(self, text):
+        self.apply_table_prompt('table_filter', text)
 
-            elif self.edit_type == 'delete_confirm':
-                if key == 'enter':
-                    confirmation = self.delete_confirm_edit.get_edit_text().strip()
-                    self.apply_delete_key(confirmation)
-                    self.editing = False
-                    self.edit_type = None
-                    self.loop.widget = self.frame
-                    return  # Prevent further processing
-                elif key == 'esc':
-                    # Cancel deletion
-                    self.editing = False
-                    self.edit_type = None
-                    self.loop.widget = self.frame
-                    return  # Prevent further processing
-                else:
-                    # Let the Edit widget handle other keys
-                    self.delete_confirm_edit.keypress((0,), key)
-                    return  # Prevent further processing
+    def apply_table_sort(self, text):
+        self.apply_table_prompt('table_sort', text)
 
-            elif self.edit_type == 'delete_data_confirm':
-                if key == 'enter':
-                    confirmation = self.delete_data_confirm_edit.get_edit_text().strip()
-                    self.apply_delete_data(confirmation)
-                    self.editing = False
-                    self.edit_type = None
-                    self.loop.widget = self.frame
-                    return  # Prevent further processing
-                elif key == 'esc':
-                    # Cancel data deletion
-                    self.editing = False
-                    self.edit_type = None
-                    self.loop.widget = self.frame
-                    return  # Prevent further processing
-                else:
-                    # Let the Edit widget handle other keys
-                    self.delete_data_confirm_edit.keypress((0,), key)
-                    return  # Prevent further processing
+    def keypress(self, key):
+        logging.debug("Key pressed: %s", key)
+        if self.editing:
+            self.prompt_keypress(key)
+        elif self.table is not None:
+            self.table_keypress(key)
+        elif self.diff is not None:
+            self.diff_keypress(key)
+        elif self.problem_list is not None:
+            self.problems_keypress(key)
+        elif self.found is not None:
+            self.search_keypress(key)
+        elif self.outline is not None:
+            self.outline_keypress(key)
         else:
             # Handle main navigation keypresses
             if key in ('q', 'Q', 'esc'):
                 raise urwid.ExitMainLoop()
 
             elif key == 'enter':
-                logging.debug("Currently main: %s, %r"%(key, self.editing))
-                focus_widget, focus_position = self.listbox.get_focus()
-                if focus_widget is None:
+                logging.debug("Currently main: %s, %r", key, self.editing)
+                node = self.focused_node()
+                if node is None:
                     return
-                selected = focus_widget.original_widget.get_text()[0]
-                if selected.startswith("[D] "):
-                    folder = selected[4:]
-                    if folder == "(Empty)":
-                        return
+                if node.is_directory():
                     # Enter the selected directory
-                    self.history.append(list(self.current_path))
-                    self.current_path.append(folder)
+                    self.history.append(self.current_node)
+                    self.current_node = node
                     self.update_directory_view()
-                elif selected.startswith("[F] "):
+                else:
                     # Optionally handle file/data node selection
                     pass
 
             elif key == 'r':
                 # Initiate renaming
-                focus_widget, focus_position = self.listbox.get_focus()
-                if focus_widget is None:
+                if self.at_workspace_root():
+                    self.show_message("Ensembles cannot be changed from the workspace view.")
                     return
-                selected = focus_widget.original_widget.get_text()[0]
-                if selected.startswith("[D] ") or selected.startswith("[F] "):
-                    self.initiate_rename(selected)
+                node = self.focused_node()
+                if node is not None:
+                    self.initiate_rename(node)
                 return
 
             elif key == 'e':
                 # Initiate editing data node
-                focus_widget, focus_position = self.listbox.get_focus()
-                if focus_widget is None:
-                    return
-                selected = focus_widget.original_widget.get_text()[0]
-                if selected.startswith("[F] "):
-                    self.initiate_edit_data(selected)
+                node = self.focused_node()
+                if node is not None and not node.is_directory():
+                    self.initiate_edit_data(node)
                 else:
                     self.show_message("Selected item is not a data node.")
                 return
 
             elif key == 'a':
                 # Initiate adding a new key
+                if self.at_workspace_root():
+                    self.show_message("Ensembles cannot be changed from the workspace view.")
+                    return
                 self.initiate_add_key()
                 return
 
             elif key == 'd':
                 # Initiate deleting a key
-                focus_widget, focus_position = self.listbox.get_focus()
-                if focus_widget is None:
+                if self.at_workspace_root():
+                    self.show_message("Ensembles cannot be changed from the workspace view.")
+                    return
+                node = self.focused_node()
+                if node is not None:
+                    self.initiate_delete_key(node)
+                return
+
+            elif key in ('c', 'x'):
+                # Copy or cut the focused entry, for 'p'
+                node = self.focused_node()
+                if node is None or self.at_workspace_root():
+                    self.show_message("Nothing to copy here.")
                     return
-                selected = focus_widget.original_widget.get_text()[0]
-                if selected.startswith("[D] ") or selected.startswith("[F] "):
-                    self.initiate_delete_key(selected)
+                self.clipboard = (node, key == 'x')
+                self.show_message(f"{'Cut' if key == 'x' else 'Copied'} '{node.name}': press 'p' in the directory to paste it into.")
+                return
+
+            elif key == 'p':
+                # Paste what 'c' or 'x' picked into this directory
+                self.initiate_paste()
+                return
+
+            elif key == ':':
+                # Initiate a pattern-based bulk edit
+                self.initiate_bulk_edit()
+                return
+
+            elif key == 't':
+                # Open the table view of the fits below this directory
+                self.show_table()
+                return
+
+            elif key == 'v':
+                # List every validation problem in the open files
+                self.show_problems()
+                return
+
+            elif key == 'D':
+                # Diff this directory against the saved file or another file
+                self.initiate_diff()
+                return
+
+            elif key == 'L':
+                # Latency histograms of this session
+                self.show_latency()
+                return
+
+            elif key == '/':
+                # Search every key and value and jump to a match
+                self.show_search()
+                return
+
+            elif key == 'o':
+                # Outline of everything below this directory
+                self.show_outline()
+                return
+
+            elif key == 'u':
+                # Undo the last edit
+                self.undo_last()
+                return
+
+            elif key == 'ctrl r':
+                # Redo the last undone edit
+                self.redo_last()
                 return
 
             elif key == 'backspace':
                 if self.history:
-                    self.current_path = self.history.pop()
+                    self.current_node = self.history.pop()
                     self.update_directory_view()
             elif key in ['up','down']:
                 # Handle navigation keys (up/down)
@@ -309,24 +979,17 @@ class DirectoryExplorer:
                 self.show_message(f"Unexpected key: {key}")
                 logging.warning("Unexpected key pressed: %s", key)
 
-    def initiate_delete_key(self, selected):
+    def initiate_delete_key(self, node):
         # Determine if the selected item is a directory or data node
-        if selected.startswith("[D] "):
-            item_type = 'directory'
-            current_name = selected[4:]
-        elif selected.startswith("[F] "):
-            item_type = 'file'
-            current_name = selected[4:].split('=')[0].strip()
-        else:
-            item_type = 'unknown'
-            current_name = selected
-
-        if item_type == 'unknown':
-            self.show_message("Selected item cannot be deleted.")
-            return
+        item_type = 'directory' if node.is_directory() else 'file'
+        current_name = node.name
 
-        # Create a confirmation prompt
+        # Create a confirmation prompt, saying what goes with a directory
         confirm_text = f"Are you sure you want to delete '{current_name}' ({item_type})? (y/n)"
+        value = node.value()
+        if item_type == 'directory' and not is_empty_directory(value):
+            contents = directory_note(value, self.directory_summary(node)).strip() or "(not counted)"
+            confirm_text = f"Delete '{current_name}' and everything in it {contents}? (y/n)"
         self.delete_confirm_edit = urwid.Edit(confirm_text)
         fill = urwid.Filler(self.delete_confirm_edit, valign='top')
         overlay = urwid.Overlay(
@@ -341,45 +1004,97 @@ class DirectoryExplorer:
         self.editing = True
         self.edit_type = 'delete_confirm'
         self.delete_item_type = item_type
-        self.delete_item_name = current_name
+        self.delete_item = node
 
     def apply_delete_key(self, confirmation):
         if confirmation.lower() == 'y':
             # Perform deletion
-            if self.delete_item_type == 'directory':
-                # Ensure the directory is empty
-                if isinstance(self.current_dir[self.delete_item_name], dict) and self.current_dir[self.delete_item_name]:
-                    self.show_message(f"Error: Directory '{self.delete_item_name}' is not empty.")
-                    return
-                else:
-                    del self.current_dir[self.delete_item_name]
-            elif self.delete_item_type == 'file':
-                del self.current_dir[self.delete_item_name]
+            if self.delete_item_type in ('directory', 'file'):
+                # One op for a directory too, however much is below it
+                op = self.commit({'op': 'delete', 'path': self.delete_item.path()})
             else:
                 self.show_message("Error: Unknown item type.")
                 return
 
-            # Save changes to JSON (optional)
-            save_directory_tree(self.json_file, self.directory_tree)
-
             # Refresh the UI
-            self.update_directory_view()
-            self.show_message(f"Deleted '{self.delete_item_name}' successfully.")
+            self.patch_directory_view(op)
+            self.show_message(f"Deleted '{self.delete_item.name}' successfully.")
         else:
             # Cancel deletion
             self.show_message("Deletion cancelled.")
-    def initiate_add_data(self, selected):
-        # Ensure the selected item is a data node
-        if selected.startswith("[F] "):
-            parts = selected[4:].split('=')
-            if len(parts) != 2:
-                self.show_message("Invalid data node format.")
-                return
-            current_name = parts[0].strip()
-            current_data = parts[1].strip()
+
+    def initiate_paste(self):
+        if self.clipboard is None:
+            self.show_message("Nothing to paste: 'c' copies and 'x' cuts the focused entry.")
+            return
+        if self.at_workspace_root():
+            self.show_message("Ensembles cannot be changed from the workspace view.")
+            return
+        node, cut = self.clipboard
+        if not node.alive():
+            self.clipboard = None
+            self.show_message(f"'{node.name}' no longer exists.")
+            return
+        name, n = node.name, 1
+        while name in self.current_dir:
+            name = f"{node.name}_copy" if n == 1 else f"{node.name}_copy{n}"
+            n += 1
+        self.paste_edit = urwid.Edit(('reversed', f"Paste '{node.name}' as: "), edit_text=name)
+        fill = urwid.Filler(self.paste_edit, valign='top')
+        overlay = urwid.Overlay(
+            urwid.LineBox(fill),
+            self.frame,
+            align='center',
+            width=('relative', 60),
+            valign='middle',
+            height=3
+        )
+        self.loop.widget = overlay
+        self.editing = True
+        self.edit_type = 'paste'
+
+    def apply_paste(self, new_name):
+        # A copy is a single 'copy' op that shares the subtree until either
+        # side is edited (see cow.py); a move adds the delete of the source.
+        # Both are one commit: one journal write, one save, one undo step.
+        node, cut = self.clipboard
+        if not node.alive():
+            self.clipboard = None
+            self.show_message(f"'{node.name}' no longer exists.")
+            return
+        source, target = node.path(), self.item_path(new_name)
+        if target == source:
+            return
+        if cut and target[:len(source)] == source:
+            self.show_message(f"Error: cannot move '{node.name}' into itself.")
+            return
+        existing = self.current_dir[new_name] if new_name in self.current_dir else None
+        if new_name in self.current_dir and not (isinstance(existing, Mapping) and not existing):
+            # Only an empty directory (a channel not filled in yet) is replaced
+            self.show_message(f"Error: '{new_name}' already exists.")
+            return
+        if isinstance(self.directory_tree, Workspace) and source[0] != target[0]:
+            # Another file: a plain copy of the value
+            value = json.loads(json.dumps(node.value(), default=encode_value))
+            ops = [{'op': 'set', 'path': target, 'value': value}]
         else:
+            ops = [{'op': 'copy', 'path': target, 'from': source}]
+        if cut:
+            ops.append({'op': 'delete', 'path': source})
+            self.clipboard = None
+        self.commit_many(ops)
+        self.update_directory_view()
+        walker = self.listbox.body
+        if new_name in walker.keys:
+            walker.set_focus(walker.keys.index(new_name))
+
+    def initiate_add_data(self, node):
+        # Ensure the selected item is a data node
+        if node.is_directory():
             self.show_message("Selected item is not a data node.")
             return
+        current_name = node.name
+        current_data = str(node.value())
 
         # Create an Edit widget for adding data
         self.edit_edit = urwid.Edit(('reversed', f"Set data for '{current_name}': "), edit_text=current_data)
@@ -397,7 +1112,7 @@ class DirectoryExplorer:
         self.edit_type = 'add_data'
 
         # Store the item being edited
-        self.item_to_edit = current_name
+        self.item_to_edit = node
 
     def apply_add_data(self, new_data):
         # Attempt to convert new_data to int, float, or keep as string
@@ -411,25 +1126,17 @@ class DirectoryExplorer:
             converted_data = new_data
 
         # Update the data node in the directory tree
-        self.current_dir[self.item_to_edit] = converted_data
-
-        # Save changes to JSON (optional)
-        save_directory_tree(self.json_file, self.directory_tree)
+        op = self.commit({'op': 'set', 'path': self.item_to_edit.path(), 'value': converted_data})
 
         # Refresh the UI
-        self.update_directory_view()
-    def initiate_delete_data(self, selected):
+        self.patch_directory_view(op)
+    def initiate_delete_data(self, node):
         # Ensure the selected item is a data node
-        if selected.startswith("[F] "):
-            parts = selected[4:].split('=')
-            if len(parts) != 2:
-                self.show_message("Invalid data node format.")
-                return
-            current_name = parts[0].strip()
-            current_data = parts[1].strip()
-        else:
+        if node.is_directory():
             self.show_message("Selected item is not a data node.")
             return
+        current_name = node.name
+        current_data = str(node.value())
 
         # Create a confirmation prompt
         confirm_text = f"Are you sure you want to delete data for '{current_name}'? (y/n)"
@@ -446,31 +1153,22 @@ class DirectoryExplorer:
         self.loop.widget = overlay
         self.editing = True
         self.edit_type = 'delete_data_confirm'
-        self.delete_data_item_name = current_name
+        self.delete_data_item = node
 
     def apply_delete_data(self, confirmation):
         if confirmation.lower() == 'y':
             # Delete data (set to None or another default)
-            self.current_dir[self.delete_data_item_name] = None  # Or use del self.current_dir[self.delete_data_item_name]
-
-            # Save changes to JSON (optional)
-            save_directory_tree(self.json_file, self.directory_tree)
+            op = self.commit({'op': 'set', 'path': self.delete_data_item.path(), 'value': None})  # Or use a 'delete' op
 
             # Refresh the UI
-            self.update_directory_view()
-            self.show_message(f"Deleted data for '{self.delete_data_item_name}' successfully.")
+            self.patch_directory_view(op)
+            self.show_message(f"Deleted data for '{self.delete_data_item.name}' successfully.")
         else:
             # Cancel deletion
             self.show_message("Data deletion cancelled.")
 
-    def initiate_rename(self, selected):
-        # Extract the current name without the icon
-        if selected.startswith("[D] "):
-            current_name = selected[4:]
-        elif selected.startswith("[F] "):
-            current_name = selected[4:].split('=')[0].strip()
-        else:
-            current_name = selected
+    def initiate_rename(self, node):
+        current_name = node.name
 
         # Create an Edit widget for renaming
         self.edit_edit = urwid.Edit(('reversed', f"Renaming '{current_name}' to: "))
@@ -488,7 +1186,7 @@ class DirectoryExplorer:
         self.edit_type = 'rename'
 
         # Store the item being renamed
-        self.item_to_rename = current_name
+        self.item_to_rename = node
     def initiate_add_key(self):
         # Prompt user to choose between directory or data node
         logging.debug("Initiate Add Key called")
@@ -507,10 +1205,10 @@ class DirectoryExplorer:
         self.loop.widget = overlay
         self.editing = True
         self.edit_type = 'add_choice'
-        logging.debug("Set edit_type to %s"%(self.edit_type))
+        logging.debug("Set edit_type to %s", self.edit_type)
     def initiate_add_name(self, choice):
         # Prompt for the new key name based on choice
-        logging.debug("Initiate Add Name called with choice: %s"%(choice))
+        logging.debug("Initiate Add Name called with choice: %s", choice)
         if choice == 'd':
             prompt = "Enter the name of the new directory: "
         elif choice == 'f':
@@ -532,32 +1230,29 @@ class DirectoryExplorer:
         self.editing = True
         self.edit_type = 'add_name'
         self.adding_type = choice  # Store the type ('d' or 'f')
-        logging.debug("Set edit_type to %s and adding_type to %s"%(self.edit_type, self.adding_type))
-        logging.debug("Overlay set; editing should still be True: %s" % self.editing)
+        logging.debug("Set edit_type to %s and adding_type to %s", self.edit_type, self.adding_type)
+        logging.debug("Overlay set; editing should still be True: %s", self.editing)
 
 
     def apply_add_key(self, new_name, item_type):
         # Validate the new name
-        logging.debug("Apply Add Key called with name: %s, type: %s"%(new_name, item_type))
+        logging.debug("Apply Add Key called with name: %s, type: %s", new_name, item_type)
         if new_name in self.current_dir:
             self.show_message(f"Error: '{new_name}' already exists.")
             return
 
         if item_type == 'd':
             # Add a new directory
-            self.current_dir[new_name] = {}
+            op = self.commit({'op': 'set', 'path': self.item_path(new_name), 'value': {}})
         elif item_type == 'f':
             # Add a new data node with a default value (e.g., 0)
-            self.current_dir[new_name] = 0  # Customize default value as needed
+            op = self.commit({'op': 'set', 'path': self.item_path(new_name), 'value': 0})  # Customize default value as needed
         else:
             self.show_message("Error: Unknown item type.")
             return
 
-        # Save changes to JSON (optional)
-        save_directory_tree(self.json_file, self.directory_tree)
-
         # Refresh the UI
-        self.update_directory_view()
+        self.patch_directory_view(op)
         self.show_message(f"Added '{new_name}' successfully.")
 
         # Reset state variables
@@ -572,26 +1267,18 @@ class DirectoryExplorer:
             return
 
         # Rename in the directory tree
-        self.current_dir[new_name] = self.current_dir.pop(self.item_to_rename)
-
-        # Save changes to JSON (optional)
-        save_directory_tree(self.json_file, self.directory_tree)
+        op = self.commit({'op': 'rename', 'path': self.item_to_rename.path(), 'to': new_name})
 
         # Update the view
-        self.update_directory_view()
+        self.patch_directory_view(op)
 
-    def initiate_edit_data(self, selected):
-        # Extract the current name and data
-        if selected.startswith("[F] "):
-            parts = selected[4:].split('=')
-            if len(parts) != 2:
-                self.show_message("Invalid data node format.")
-                return
-            current_name = parts[0].strip()
-            current_data = parts[1].strip()
-        else:
+    def initiate_edit_data(self, node):
+        # Current name and data straight from the node
+        if node.is_directory():
             self.show_message("Selected item is not a data node.")
             return
+        current_name = node.name
+        current_data = str(node.value())
 
         # Create an Edit widget for editing data
         self.edit_edit = urwid.Edit(('reversed', f"Editing '{current_name}' data: "), edit_text=current_data)
@@ -609,7 +1296,7 @@ class DirectoryExplorer:
         self.edit_type = 'edit_data'
 
         # Store the item being edited
-        self.item_to_edit = current_name
+        self.item_to_edit = node
 
     def apply_edit_data(self, new_data):
         # Attempt to convert new_data to int, float, or keep as string
@@ -623,14 +1310,465 @@ class DirectoryExplorer:
             converted_data = new_data
 
         # Update the data node in the directory tree
-        self.current_dir[self.item_to_edit] = converted_data
-
-        # Save changes to JSON (optional)
-        save_directory_tree(self.json_file, self.directory_tree)
+        op = self.commit({'op': 'set', 'path': self.item_to_edit.path(), 'value': converted_data})
 
         # Update the view
+        self.patch_directory_view(op)
+
+    def initiate_bulk_edit(self):
+        # Prompt for a command such as 'Pion/*/S?/**/2state/tmin = 6' or
+        # '**/tmin += 1'; patterns are relative to the current directory
+        # unless they start with '/'
+        question = urwid.Text("Bulk edit: <pattern> = value, or += / -= / *= number")
+        self.bulk_edit_edit = urwid.Edit(('reversed', ":"))
+        pile = urwid.Pile([question, self.bulk_edit_edit])
+        fill = urwid.Filler(pile, valign='top')
+        overlay = urwid.Overlay(
+            urwid.LineBox(fill),
+            self.frame,
+            align='center',
+            width=('relative', 70),
+            valign='middle',
+            height=4
+        )
+        self.loop.widget = overlay
+        self.editing = True
+        self.edit_type = 'bulk_edit'
+
+    def apply_bulk_edit(self, command):
+        # Resolve matches through the cached leaf index, apply them all in
+        # memory and persist them with a single commit
+        if isinstance(self.directory_tree, Workspace):
+            # Scoped to the current ensemble so one command never loads them all
+            if not self.current_path:
+                self.show_message("Enter an ensemble before running a bulk edit.")
+                return
+            scope = self.current_path[:1]
+            tree = self.directory_tree.session(scope[0]).directory_tree
+        else:
+            scope = []
+            tree = self.directory_tree
+        if self.path_index is None or self.path_index_tree is not tree:
+            self.path_index = PathIndex(tree)
+            self.path_index_tree = tree
+        try:
+            ops, skipped = plan_bulk_edit(self.path_index, command, base=tuple(self.current_path[len(scope):]))
+        except (BulkEditError, re.error) as exc:
+            self.show_message(f"Error: {exc}")
+            return
+        for op in ops:
+            op['path'] = scope + op['path']
+        if ops:
+            self.commit_many(ops)
+            self.listbox.body.refresh_all()
+        message = f"Updated {len(ops)} data node(s)."
+        if skipped:
+            message += f" Skipped {skipped} non-numeric node(s)."
+        self.show_message(message)
+
+    def show_table(self):
+        # Flatten the fits below the current directory into NumPy columns
+        # (see fittable.py); rows are rendered lazily by a TableWalker
+        try:
+            table = FitTable.from_tree(self.current_dir, self.current_path)
+        except TableError as exc:
+            self.show_message(f"Error: {exc}")
+            return
+        if not table.size:
+            self.show_message("No tmin/tmax values below this directory.")
+            return
+        self.table = table
+        self.update_table_view()
+
+    def update_table_view(self):
+        table = self.table
+        widths = table.column_widths()
+        columns = "  ".join(name.ljust(width) for name, width in zip(table.column_names(), widths))
+        status = f"{len(table.order)}/{table.size} fits"
+        if table.filter_text:
+            status += f" where {table.filter_text}"
+        if table.sort_text:
+            status += f" sorted by {table.sort_text}"
+        path = "/" + "/".join(self.current_path)
+        self.frame.header = urwid.Pile([
+            urwid.Text(f"FitParams Table - {path} - {status} ('f' filter, 's' sort, Enter to open, Esc to close)"),
+            urwid.Text(('dir', columns)),
+        ])
+        self.listbox.body = TableWalker(table, widths)
+
+    def close_table(self):
+        self.table = None
         self.update_directory_view()
 
+    def table_keypress(self, key):
+        if key in ('q', 'Q'):
+            raise urwid.ExitMainLoop()
+        elif key in ('esc', 't', 'backspace'):
+            self.close_table()
+        elif key == 'f':
+            self.initiate_table_prompt('table_filter', "Filter (e.g. tmin > tmax, tmax != 31): ",
+                                       self.table.filter_text)
+        elif key == 's':
+            self.initiate_table_prompt('table_sort', "Sort by (e.g. p0, -tmax): ", self.table.sort_text)
+        elif key == 'enter':
+            # Open the directory holding the focused fit
+            walker = self.listbox.body
+            if not walker.keys:
+                return
+            path = self.table.path(walker.keys[walker.focus])
+            try:
+                node = self.nodes.lookup(path)
+            except KeyError:
+                self.show_message("That fit no longer exists.")
+                return
+            self.history.append(self.current_node)
+            self.current_node = node
+            self.close_table()
+        elif key in ['up', 'down']:
+            self.listbox.keypress((0,), key)
+        else:
+            self.show_message(f"Unexpected key: {key}")
+
+    def initiate_table_prompt(self, edit_type, prompt, text):
+        self.table_edit = urwid.Edit(('reversed', prompt), edit_text=text)
+        fill = urwid.Filler(self.table_edit, valign='top')
+        overlay = urwid.Overlay(
+            urwid.LineBox(fill),
+            self.frame,
+            align='center',
+            width=('relative', 70),
+            valign='middle',
+            height=3
+        )
+        self.loop.widget = overlay
+        self.editing = True
+        self.edit_type = edit_type
+
+    def apply_table_prompt(self, edit_type, text):
+        try:
+            if edit_type == 'table_filter':
+                self.table.set_filter(text)
+            else:
+                self.table.set_sort(text)
+        except TableError as exc:
+            self.show_message(f"Error: {exc}")
+            return
+        self.update_table_view()
+
+    def initiate_diff(self):
+        if isinstance(self.directory_tree, Workspace) and not self.current_path:
+            self.show_message("Enter an ensemble before diffing.")
+            return
+        self.diff_edit = urwid.Edit(('reversed', "Diff against file (empty for the saved file): "))
+        fill = urwid.Filler(self.diff_edit, valign='top')
+        overlay = urwid.Overlay(
+            urwid.LineBox(fill),
+            self.frame,
+            align='center',
+            width=('relative', 70),
+            valign='middle',
+            height=3
+        )
+        self.loop.widget = overlay
+        self.editing = True
+        self.edit_type = 'diff_file'
+
+    def show_diff(self, other_file):
+        # Compare the current directory in memory with the same path in the
+        # saved JSON (without the journaled edits) or in another file. Both
+        # sides are hashed (see merkle.py), so only differing subtrees are
+        # walked; the in-memory hashes are the session's, kept up to date by
+        # every edit.
+        if isinstance(self.directory_tree, Workspace):
+            scope = self.current_path[:1]
+            session = self.directory_tree.session(scope[0])
+        else:
+            scope = []
+            session = self.session
+        if not other_file:
+            if session.journal is None:
+                self.show_message("SQLite databases are saved on every edit.")
+                return
+            other_file = session.json_file
+            label = "saved file"
+            replay = False
+        else:
+            if isinstance(self.directory_tree, Workspace) and not os.path.exists(other_file):
+                # A bare name refers to another ensemble of the workspace
+                other_file = os.path.join(self.directory_tree.directory, other_file)
+            label = os.path.basename(other_file)
+            replay = True
+        try:
+            other_tree = load_directory_tree(other_file, replay=replay)
+        except (OSError, ValueError) as exc:
+            self.show_message(f"Error: {exc}")
+            return
+        try:
+            with session.lock:
+                changes = diff_trees(MerkleTree(other_tree), session.merkle, self.current_path[len(scope):])
+        except KeyError:
+            self.show_message(f"/{'/'.join(self.current_path)} does not exist in {label}.")
+            return
+        if not changes:
+            self.show_message(f"No differences from {label}.")
+            return
+        for change in changes:
+            change[1][:0] = scope
+        self.diff = changes
+        path = "/" + "/".join(self.current_path)
+        self.frame.header = urwid.Text(
+            f"FitParams Diff - {path} - {len(changes)} difference(s), {label} -> memory (Enter to open, Esc to close)")
+        self.listbox.body = DiffWalker(changes, len(self.current_path))
+
+    def close_diff(self):
+        self.diff = None
+        self.update_directory_view()
+
+    def diff_keypress(self, key):
+        if key in ('q', 'Q'):
+            raise urwid.ExitMainLoop()
+        elif key in ('esc', 'D', 'backspace'):
+            self.close_diff()
+        elif key == 'enter':
+            # Open the directory holding the focused change
+            walker = self.listbox.body
+            kind, path, old, new = self.diff[walker.keys[walker.focus]]
+            path = list(path) if kind == 'reordered' else path[:-1]
+            while True:
+                try:
+                    node = self.nodes.lookup(path)
+                    if node.is_directory():
+                        break
+                except KeyError:
+                    pass
+                path.pop()
+            self.history.append(self.current_node)
+            self.current_node = node
+            self.close_diff()
+        elif key in ['up', 'down']:
+            self.listbox.keypress((0,), key)
+        else:
+            self.show_message(f"Unexpected key: {key}")
+
+    def show_problems(self):
+        # Summary of the validation problems of every loaded file; entries
+        # come from each session's validator, which keeps them current
+        problems = []
+        for prefix, session in self.open_sessions():
+            for path, violations in session.validator.items():
+                problems.extend((prefix + list(path), violation) for violation in violations)
+        if not problems:
+            self.show_message("No validation problems.")
+            return
+        self.problem_list = problems
+        self.frame.header = urwid.Text(
+            f"FitParams Validation - {len(problems)} problem(s) (Enter to open, Esc to close)")
+        self.listbox.body = ProblemWalker(problems)
+
+    def close_problems(self):
+        self.problem_list = None
+        self.update_directory_view()
+
+    def problems_keypress(self, key):
+        if key in ('q', 'Q'):
+            raise urwid.ExitMainLoop()
+        elif key in ('esc', 'v', 'backspace'):
+            self.close_problems()
+        elif key == 'enter':
+            # Open the fit directory with the focused problem on its first key
+            walker = self.listbox.body
+            path, violation = self.problem_list[walker.keys[walker.focus]]
+            try:
+                node = self.nodes.lookup(path)
+            except KeyError:
+                self.show_message("That directory no longer exists.")
+                return
+            self.history.append(self.current_node)
+            self.current_node = node
+            self.close_problems()
+            walker = self.listbox.body
+            for name in violation.keys:
+                if name in walker.keys:
+                    walker.set_focus(walker.keys.index(name))
+                    break
+        elif key in ['up', 'down']:
+            self.listbox.keypress((0,), key)
+        else:
+            self.show_message(f"Unexpected key: {key}")
+
+    def show_search(self):
+        # Matches are listed as the query is typed, see search.py
+        self.search_edit = urwid.Edit(('reversed', "Search: "))
+        self.search_status = urwid.Text("Type keys or values, e.g. 'pion sp 2state tmin' (Enter to jump, Esc to close)")
+        self.frame.header = urwid.Pile([self.search_edit, self.search_status])
+        self.found = []
+        self.listbox.body = SearchWalker(self.nodes, self.found)
+
+    def update_search(self):
+        query = self.search_edit.get_edit_text()
+        results = []
+        truncated = False
+        indexing = False
+        for prefix, session in self.open_sessions():
+            found = session.find(query)
+            if found is None:
+                indexing = True  # Searched again once the index is built, see index_built
+                continue
+            ranked, cut = found
+            results.extend((score, prefix + list(path)) for score, path in ranked)
+            truncated = truncated or cut
+        results.sort(key=lambda result: -result[0])
+        self.found = results
+        self.listbox.body = SearchWalker(self.nodes, results)
+        count = f"{len(results)}+" if truncated else f"{len(results)}"
+        if indexing:
+            count += " match(es) so far, still indexing..."
+        else:
+            count += " match(es)"
+        self.search_status.set_text(f"{count} (Enter to jump, Esc to close)")
+
+    def close_search(self):
+        self.found = None
+        self.search_edit = None
+        self.search_status = None
+        self.update_directory_view()
+
+    def search_keypress(self, key):
+        if key == 'esc':
+            self.close_search()
+        elif key == 'enter':
+            walker = self.listbox.body
+            if not self.found:
+                return
+            score, path = self.found[walker.keys[walker.focus]]
+            self.close_search()
+            self.jump_to(path)
+        elif key in ['up', 'down']:
+            self.listbox.keypress((0,), key)
+        elif self.search_edit.keypress((80,), key) is None:
+            # The query changed
+            self.update_search()
+
+    def jump_to(self, path):
+        # Open the directory holding `path`, with `path` focused
+        try:
+            parent = self.nodes.lookup(path[:-1])
+        except KeyError:
+            self.show_message("That entry no longer exists.")
+            return
+        self.history.append(self.current_node)
+        self.current_node = parent
+        self.update_directory_view()
+        walker = self.listbox.body
+        if path[-1] in walker.keys:
+            walker.set_focus(walker.keys.index(path[-1]))
+
+    def leaf_problems(self, node):
+        # Validation messages for a leaf anywhere in the tree
+        session, path = self.session_at(node.parent.path())
+        if session is None:
+            return []
+        return session.validator.problems(path, node.name)
+
+    def directory_summary(self, node):
+        # Aggregates of a directory anywhere in the tree; None in an ensemble
+        # that is not open, rather than opening it
+        path = node.path()
+        if isinstance(self.directory_tree, Workspace) and path and path[0] not in self.directory_tree.sessions:
+            return None
+        session, path = self.session_at(path)
+        if session is None:
+            return None
+        return session.aggregates.summary(path)
+
+    def show_outline(self):
+        # Start from the focused entry of this directory
+        self.outline = OutlineWalker(self.current_node, self.leaf_problems, self.directory_summary)
+        walker = self.listbox.body
+        if walker.keys and walker.focus < len(walker.keys):
+            self.outline.focus = (walker.focus,)
+        self.outline_box = urwid.ListBox(self.outline)
+        path = "/" + "/".join(self.current_path)
+        self.frame.header = urwid.Text(
+            f"FitParams Outline - {path} (Enter/Right to expand or collapse, Left for the parent, "
+            f"'e' to edit, 'o'/Esc to open the focused entry's directory)")
+        self.frame.body = self.outline_box
+
+    def close_outline(self):
+        # Back to the directory view, in the directory of the focused row
+        position = self.outline.focus
+        node = self.outline.node_at(position) if position else None
+        self.outline = None
+        self.outline_box = None
+        self.frame.body = self.listbox
+        if node is not None and node.parent is not self.current_node:
+            self.history.append(self.current_node)
+            self.current_node = node.parent
+        self.update_directory_view()
+        walker = self.listbox.body
+        if node is not None and node.name in walker.keys:
+            walker.set_focus(walker.keys.index(node.name))
+
+    def expand_outline(self, position):
+        # Expanding parses a lazily loaded subtree; check and count it after
+        node = self.outline.node_at(position)
+        self.outline.expand(position)
+        session, path = self.session_at(node.path())
+        if session is not None:
+            session.validator.visit(path)
+            session.aggregates.visit(path)
+
+    def outline_keypress(self, key):
+        walker = self.outline
+        position = walker.focus
+        if key in ('q', 'Q'):
+            raise urwid.ExitMainLoop()
+        elif key in ('o', 'esc'):
+            self.close_outline()
+        elif position == ():
+            return  # Nothing but the "(Empty)" row
+        elif key in ('enter', 'right', '+'):
+            if walker.is_expanded(position):
+                if key == 'enter':
+                    walker.collapse(position)
+            elif walker.node_at(position).is_directory():
+                self.expand_outline(position)
+        elif key in ('left', '-'):
+            if walker.is_expanded(position):
+                walker.collapse(position)
+            elif len(position) > 1:
+                walker.set_focus(position[:-1])
+        elif key == 'e':
+            node = walker.node_at(position)
+            if node.is_directory():
+                self.show_message("Selected item is not a data node.")
+            else:
+                self.initiate_edit_data(node)
+        else:
+            self.show_message(f"Unexpected key in the outline: {key}")
+
+    def show_latency(self):
+        # Overlay with the latency histograms recorded so far; 'L' again,
+        # Enter or Esc closes it
+        lines = recorder.format_lines()
+        text = urwid.Text('\n'.join(lines))
+        overlay = urwid.Overlay(
+            urwid.LineBox(urwid.Filler(text, valign='top'), title="Latency (press L to close)"),
+            self.frame,
+            align='center',
+            width=max(len(line) for line in lines) + 2,
+            valign='middle',
+            height=len(lines) + 2
+        )
+        self.loop.widget = overlay
+
+        def dismiss(key):
+            if key in ('L', 'enter', 'esc'):
+                self.loop.widget = self.frame
+                self.loop.unhandled_input = self.keypress  # Restore keypress handler
+
+        self.loop.unhandled_input = dismiss
+
     def show_message(self, message):
         # Display a popup message
         text = urwid.Text(message)
@@ -653,19 +1791,52 @@ class DirectoryExplorer:
 
         self.loop.unhandled_input = dismiss
 
-    def run(self):
-        palette = [
-            ('dir', 'dark green', ''),
-            ('file', 'dark cyan', ''),
-            ('reversed', 'standout', ''),
-        ]
-        self.loop = urwid.MainLoop(self.frame, palette, unhandled_input=self.keypress)
-        self.loop.run()
+    def run(self, max_fps=MAX_FPS):
+        self.loop = TimedMainLoop(self.frame, PALETTE, self.input_action, jump=self.jump, max_fps=max_fps,
+                                  unhandled_input=self.keypress)
+        self.save_status_pipe = self.loop.watch_pipe(self.update_save_status)
+        self.index_pipe = self.loop.watch_pipe(self.index_built)
+        self.watcher = FileWatcher(self.loop, self.open_sessions, self.on_external_change)
+        self.watcher.start()
+        try:
+            self.loop.run()
+        finally:
+            # Fold any journaled edits back into the canonical JSON on quit
+            self.watcher.stop()
+            self.session.close()
+            self.loop.remove_watch_pipe(self.save_status_pipe)
+            self.save_status_pipe = None
+            self.loop.remove_watch_pipe(self.index_pipe)
+            self.index_pipe = None
 
 def main():
-    directory_tree = load_directory_tree('a09m135.json')
-    explorer = DirectoryExplorer(directory_tree, 'a09m135.json')
-    explorer.run()
+    parser = argparse.ArgumentParser(description="Browse and edit fit-parameter files")
+    parser.add_argument('json_file', nargs='?', default='a09m135.json',
+                        help="JSON or SQLite file; a directory opens every ensemble file in it as a workspace")
+    parser.add_argument('--log-level', default=os.environ.get('FITPARAMS_LOG_LEVEL', 'INFO'),
+                        choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'), help="level of app_debug.log")
+    parser.add_argument('--max-fps', type=float, default=float(os.environ.get('FITPARAMS_MAX_FPS', MAX_FPS)),
+                        help="cap on screen redraws per second (0 for no cap)")
+    parser.add_argument('--latency-dump', metavar='FILE', help="write the latency histograms here as JSON on exit")
+    args = parser.parse_args()
+
+    listener = start_logging(level=args.log_level)
+    try:
+        json_file = args.json_file
+        if os.path.isdir(json_file):
+            directory_tree = Workspace(json_file)
+        else:
+            directory_tree = load_directory_tree(json_file)
+        explorer = DirectoryExplorer(directory_tree, json_file)
+        try:
+            explorer.run(max_fps=args.max_fps)
+        finally:
+            for line in recorder.format_lines():
+                logging.info("Latency: %s", line)
+            if args.latency_dump:
+                recorder.dump(args.latency_dump)
+    finally:
+        stop_logging(listener)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,152 @@
+import argparse
+import bisect
+import json
+import logging
+import os
+
+from fittable import FIT_KEYS, collect_fits
+
+try:
+    import numpy as np
+except ImportError:  # Only compiling and reading lookups needs NumPy
+    np = None
+
+# Compiled fit-range lookup for analysis jobs.
+#
+# '<json_file>.lookup.npy' is a plain .npy file holding one structured array
+# with a row per fit ('path', 'tmin', 'tmax'), sorted by path. Paths are the
+# '/'-joined keys from the root of the file (e.g.
+# b'fit_ranges/Pion/_1/SS/HPo/1state') and missing values are NaN. Workers
+# open it with np.load(..., mmap_mode='r'), so any number of processes share
+# the page cache instead of each parsing the JSON, and FitLookup finds a path
+# by binary search over the mapped array.
+#
+# Once a lookup file exists next to a JSON file, every save rewrites it (see
+# EditJournal.finish_compaction); otherwise it is only built on demand:
+#
+#   python fitlookup.py compile a09m135.json
+#   python fitlookup.py get a09m135.json fit_ranges/Pion/_1/SS/HPo/1state
+
+LOOKUP_SUFFIX = '.lookup.npy'
+
+
+def lookup_path(json_file):
+    return json_file + LOOKUP_SUFFIX
+
+
+def compile_lookup(directory_tree):
+    # The sorted structured array for every fit in the tree
+    if np is None:
+        raise RuntimeError("Compiling a fit lookup needs NumPy")
+    paths, values = collect_fits(directory_tree)
+    keys = ['/'.join(path).encode('utf-8') for path in paths]
+    width = max((len(key) for key in keys), default=1)
+    table = np.empty(len(keys), dtype=[('path', 'S%d' % width)] + [(key, 'f8') for key in FIT_KEYS])
+    table['path'] = keys
+    for key in FIT_KEYS:
+        table[key] = values[key]
+    table.sort(order='path')
+    return table
+
+
+def write_lookup(json_file, directory_tree):
+    # Atomically replace the lookup, so mapped readers keep a consistent
+    # (if older) file until they reopen
+    out_file = lookup_path(json_file)
+    tmp_file = out_file + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        np.save(f, compile_lookup(directory_tree))
+    os.replace(tmp_file, out_file)
+    return out_file
+
+
+def refresh_lookup(json_file, directory_tree):
+    # Best effort, after a save: keep an existing lookup in step with the JSON
+    if np is None or not os.path.exists(lookup_path(json_file)):
+        return False
+    try:
+        write_lookup(json_file, directory_tree)
+    except OSError:
+        logging.warning("Could not update fit lookup %s", lookup_path(json_file))
+        return False
+    return True
+
+
+def _value(x):
+    x = float(x)
+    if x != x:  # NaN
+        return None
+    return int(x) if x.is_integer() else x
+
+
+class FitLookup:
+    def __init__(self, lookup_file):
+        if np is None:
+            raise RuntimeError("Reading a fit lookup needs NumPy")
+        self.table = np.load(lookup_file, mmap_mode='r')
+        self.paths = self.table['path']  # A view into the mapped file
+
+    def __len__(self):
+        return len(self.table)
+
+    def _key(self, path):
+        if not isinstance(path, str):
+            path = '/'.join(path)
+        return path.strip('/').encode('utf-8')
+
+    def _find(self, path):
+        key = self._key(path)
+        i = bisect.bisect_left(self.paths, key)
+        if i < len(self.paths) and self.paths[i] == key:
+            return i
+        return None
+
+    def __contains__(self, path):
+        return self._find(path) is not None
+
+    def __getitem__(self, path):
+        # (tmin, tmax) of the fit at `path`; None for a missing value
+        i = self._find(path)
+        if i is None:
+            raise KeyError(path)
+        row = self.table[i]
+        return tuple(_value(row[key]) for key in FIT_KEYS)
+
+    def get(self, path, default=None):
+        try:
+            return self[path]
+        except KeyError:
+            return default
+
+    def items(self, prefix=''):
+        # (path, (tmin, tmax)) for every fit below `prefix`, in path order
+        key = self._key(prefix)
+        if key:
+            low = bisect.bisect_left(self.paths, key + b'/')
+            high = bisect.bisect_left(self.paths, key + b'0')  # '0' sorts right after '/'
+        else:
+            low, high = 0, len(self.paths)
+        for i in range(low, high):
+            row = self.table[i]
+            yield row['path'].decode('utf-8'), tuple(_value(row[k]) for k in FIT_KEYS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile or query memory-mappable fit-range lookups")
+    sub = parser.add_subparsers(dest='command', required=True)
+    comp = sub.add_parser('compile', help="write <json_file>%s" % LOOKUP_SUFFIX)
+    comp.add_argument('json_files', nargs='+')
+    get = sub.add_parser('get', help="print (tmin, tmax) for a path from a compiled lookup")
+    get.add_argument('json_file')
+    get.add_argument('path')
+    args = parser.parse_args()
+    if args.command == 'compile':
+        from fittree import load_directory_tree
+        for json_file in args.json_files:
+            print(write_lookup(json_file, load_directory_tree(json_file)))
+    else:
+        print(json.dumps(FitLookup(lookup_path(args.json_file))[args.path]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from bulk_edit import BulkEditError, apply_bulk_edit, parse_value
+from fittree import (get_node, is_directory, load_directory_tree, persist_directory_tree,
+                     split_path, to_plain)
+from journal import apply_op
+
+# Headless batch interface to fit-parameter files, for scripts that touch many
+# ensembles at once. Uses the same tree code as the explorer but never
+# imports urwid. Each file is handled by its own worker process.
+#
+#   python fitparams_cli.py get fit_ranges/Pion/_1/SS/HPo/1state/tmin a09m135.json a12m130.json
+#   python fitparams_cli.py set fit_ranges/Pion/_1/SS/HPo/1state/tmin 14 ensembles/*.json
+#   python fitparams_cli.py ls fit_ranges/Pion ensembles/*.json
+#   python fitparams_cli.py dump --path fit_ranges/Kaon a09m135.json
+#   python fitparams_cli.py apply-patch fix_2state.txt ensembles/*.json
+#
+# A patch is either a JSON list of journal ops ({"op": "set", "path": [...],
+# "value": ...}, see journal.py) or a text file of bulk-edit commands
+# (see bulk_edit.py), one per line, '#' starting a comment.
+
+
+def read_patch(patch_file):
+    with open(patch_file, 'r') as f:
+        text = f.read()
+    try:
+        ops = json.loads(text)
+    except ValueError:
+        return 'commands', [line.strip() for line in text.splitlines()
+                            if line.strip() and not line.strip().startswith('#')]
+    if not isinstance(ops, list):
+        raise ValueError("JSON patch must be a list of ops")
+    return 'ops', ops
+
+
+def run_get(directory_tree, args):
+    return json.dumps(to_plain(get_node(directory_tree, split_path(args.path))))
+
+
+def run_ls(directory_tree, args):
+    node = get_node(directory_tree, split_path(args.path))
+    if not is_directory(node):
+        raise KeyError("%s is not a directory" % args.path)
+    lines = []
+    for name in list(node.keys()):
+        value = node[name]
+        lines.append(("[D] " + name) if is_directory(value) else ("[F] %s = %s" % (name, value)))
+    return "\n".join(lines)
+
+
+def run_dump(directory_tree, args):
+    return json.dumps(to_plain(get_node(directory_tree, split_path(args.path))), indent=4)
+
+
+def run_set(directory_tree, args):
+    path = split_path(args.path)
+    parent = get_node(directory_tree, path[:-1])
+    if not is_directory(parent):
+        raise KeyError("%s is not a directory" % "/".join(path[:-1]))
+    apply_op(directory_tree, {'op': 'set', 'path': path, 'value': parse_value(args.value)})
+    return "set %s = %s" % (args.path, args.value)
+
+
+def run_apply_patch(directory_tree, args):
+    kind, entries = read_patch(args.patch)
+    if kind == 'ops':
+        for op in entries:
+            apply_op(directory_tree, op)
+        return "applied %d op(s)" % len(entries)
+    changed = 0
+    for command in entries:
+        ops, _ = apply_bulk_edit(directory_tree, command)
+        changed += len(ops)
+    return "applied %d command(s), %d node(s) changed" % (len(entries), changed)
+
+
+COMMANDS = {
+    'get': (run_get, False),
+    'ls': (run_ls, False),
+    'dump': (run_dump, False),
+    'set': (run_set, True),
+    'apply-patch': (run_apply_patch, True),
+}
+
+
+def process_file(args, json_file):
+    # One unit of work: load, run the command, save once if it modifies
+    run, modifies = COMMANDS[args.command]
+    try:
+        directory_tree = load_directory_tree(json_file)
+        output = run(directory_tree, args)
+        if modifies:
+            persist_directory_tree(json_file, directory_tree)
+        return json_file, output, None
+    except (OSError, ValueError, KeyError, TypeError, BulkEditError) as exc:
+        return json_file, None, "%s: %s" % (type(exc).__name__, exc)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Headless access to fit-parameter files")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help="worker processes (default: number of cores)")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    get = sub.add_parser('get', help="print the value at a path as JSON")
+    get.add_argument('path')
+    get.add_argument('files', nargs='+')
+
+    ls = sub.add_parser('ls', help="list a directory")
+    ls.add_argument('path')
+    ls.add_argument('files', nargs='+')
+
+    dump = sub.add_parser('dump', help="print a subtree (default: everything) as indented JSON")
+    dump.add_argument('--path', default='')
+    dump.add_argument('files', nargs='+')
+
+    set_ = sub.add_parser('set', help="set the value at a path and save")
+    set_.add_argument('path')
+    set_.add_argument('value')
+    set_.add_argument('files', nargs='+')
+
+    patch = sub.add_parser('apply-patch', help="apply a JSON op list or bulk-edit commands and save")
+    patch.add_argument('patch')
+    patch.add_argument('files', nargs='+')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    files = args.files
+    jobs = max(1, min(args.jobs or 1, len(files)))
+    if jobs == 1:
+        results = [process_file(args, json_file) for json_file in files]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(process_file, [args] * len(files), files))
+
+    failed = 0
+    for json_file, output, error in results:
+        if error is not None:
+            failed += 1
+            print("%s: error: %s" % (json_file, error), file=sys.stderr)
+        elif len(files) == 1:
+            print(output)
+        else:
+            prefix = json_file + ": "
+            print(prefix + output.replace("\n", "\n" + prefix))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
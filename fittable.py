@@ -0,0 +1,209 @@
+import ast
+import operator
+from collections.abc import Mapping
+
+from lazy_json import resolve
+
+try:
+    import numpy as np
+except ImportError:  # Only the table view needs NumPy
+    np = None
+
+# Columnar view of the fit windows below a directory.
+#
+# Every directory holding a 'tmin' or 'tmax' leaf is one row. The row's path
+# (relative to the table's base directory) is split into string columns p0,
+# p1, ... and tmin/tmax become float columns (NaN where missing or not a
+# number), so filters such as 'tmin > tmax' or 'p2 == "SS" and tmax != 31'
+# and multi-column sorts are evaluated as whole-array NumPy operations.
+# Filter expressions are parsed with ast and only comparisons, boolean
+# operators, arithmetic, column names and constants are allowed.
+
+FIT_KEYS = ('tmin', 'tmax')
+
+
+class TableError(ValueError):
+    pass
+
+
+_COMPARE = {
+    ast.Eq: operator.eq, ast.NotEq: operator.ne,
+    ast.Lt: operator.lt, ast.LtE: operator.le,
+    ast.Gt: operator.gt, ast.GtE: operator.ge,
+}
+_BINARY = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+    ast.Div: operator.truediv, ast.Mod: operator.mod,
+}
+
+
+def collect_fits(directory):
+    # (paths, {key: values}) for every directory below `directory` holding a fit key
+    paths = []
+    values = {key: [] for key in FIT_KEYS}
+    stack = [(directory, ())]
+    while stack:
+        node, path = stack.pop()
+        keys = list(node.keys())
+        if any(key in FIT_KEYS for key in keys):
+            paths.append(path)
+            for key in FIT_KEYS:
+                value = node[key] if key in node else None
+                numeric = isinstance(value, (int, float)) and not isinstance(value, bool)
+                values[key].append(value if numeric else float('nan'))
+        for key in reversed(keys):
+            if key not in FIT_KEYS:
+                child = resolve(node, key)
+                if isinstance(child, Mapping):
+                    stack.append((child, path + (key,)))
+    return paths, values
+
+
+class FitTable:
+    def __init__(self, paths, values, base=()):
+        if np is None:
+            raise TableError("The table view needs NumPy")
+        self.base = list(base)
+        self.paths = paths
+        self.size = len(paths)
+        depth = max((len(path) for path in paths), default=0)
+        self.path_columns = ['p%d' % i for i in range(depth)]
+        self.columns = {}
+        for i, name in enumerate(self.path_columns):
+            self.columns[name] = np.array([path[i] if i < len(path) else '' for path in paths], dtype=str)
+        for key in FIT_KEYS:
+            self.columns[key] = np.array(values[key], dtype=float)
+        self.mask = np.ones(self.size, dtype=bool)
+        self.sort_keys = []
+        self.order = np.arange(self.size)
+        self.filter_text = ''
+        self.sort_text = ''
+
+    @classmethod
+    def from_tree(cls, directory, base=()):
+        paths, values = collect_fits(directory)
+        return cls(paths, values, base)
+
+    def column_names(self):
+        return self.path_columns + list(FIT_KEYS)
+
+    def set_filter(self, expression):
+        # An empty expression shows every row
+        if expression.strip():
+            mask = self.evaluate(expression)
+        else:
+            mask = np.ones(self.size, dtype=bool)
+        self.mask = mask
+        self.filter_text = expression.strip()
+        self._update_order()
+
+    def set_sort(self, spec):
+        # 'tmax, -tmin': comma-separated columns, '-' for descending
+        keys = []
+        for item in spec.split(','):
+            item = item.strip()
+            if not item:
+                continue
+            descending = item.startswith('-')
+            name = item.lstrip('-').strip()
+            if name not in self.columns:
+                raise TableError("Unknown column '%s'" % name)
+            keys.append((name, descending))
+        self.sort_keys = keys
+        self.sort_text = spec.strip()
+        self._update_order()
+
+    def _update_order(self):
+        order = np.flatnonzero(self.mask)
+        if self.sort_keys and len(order):
+            sort_by = []
+            for name, descending in self.sort_keys:
+                column = self.columns[name][order]
+                if column.dtype.kind == 'U':
+                    column = np.unique(column, return_inverse=True)[1]
+                sort_by.append(-column if descending else column)
+            # lexsort treats its last key as the primary one
+            order = order[np.lexsort(sort_by[::-1])]
+        self.order = order
+
+    def evaluate(self, expression):
+        try:
+            tree = ast.parse(expression, mode='eval')
+        except SyntaxError as exc:
+            raise TableError("Invalid filter: %s" % exc.msg)
+        try:
+            result = self._eval(tree.body)
+        except TableError:
+            raise
+        except (TypeError, ValueError) as exc:
+            raise TableError("Invalid filter: %s" % exc)
+        result = np.asarray(result)
+        if result.dtype != bool:
+            raise TableError("Filter must be a comparison")
+        return np.broadcast_to(result, (self.size,))
+
+    def _eval(self, node):
+        if isinstance(node, ast.BoolOp):
+            values = [self._eval(value) for value in node.values]
+            combine = operator.and_ if isinstance(node.op, ast.And) else operator.or_
+            result = values[0]
+            for value in values[1:]:
+                result = combine(result, value)
+            return result
+        if isinstance(node, ast.UnaryOp):
+            operand = self._eval(node.operand)
+            if isinstance(node.op, ast.Not):
+                return np.logical_not(operand)
+            if isinstance(node.op, ast.USub):
+                return -operand
+        if isinstance(node, ast.Compare):
+            # a < b <= c  ->  (a < b) & (b <= c)
+            result = None
+            left = self._eval(node.left)
+            for op, comparator in zip(node.ops, node.comparators):
+                if type(op) not in _COMPARE:
+                    raise TableError("Unsupported comparison")
+                right = self._eval(comparator)
+                part = _COMPARE[type(op)](left, right)
+                result = part if result is None else result & part
+                left = right
+            return result
+        if isinstance(node, ast.BinOp) and type(node.op) in _BINARY:
+            return _BINARY[type(node.op)](self._eval(node.left), self._eval(node.right))
+        if isinstance(node, ast.Name):
+            if node.id not in self.columns:
+                raise TableError("Unknown column '%s'" % node.id)
+            return self.columns[node.id]
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float, str)):
+            return node.value
+        raise TableError("Unsupported filter syntax")
+
+    def column_widths(self):
+        widths = []
+        for name in self.column_names():
+            column = self.columns[name]
+            if column.dtype.kind == 'U':
+                width = int(np.char.str_len(column).max()) if self.size else 0
+            else:
+                width = max((len(format_number(value)) for value in np.unique(column)), default=0)
+            widths.append(max(width, len(name)))
+        return widths
+
+    def row(self, index):
+        # The cells of row `index` (an index into the unfiltered table)
+        return [str(self.columns[name][index]) for name in self.path_columns] + \
+               [format_number(self.columns[key][index]) for key in FIT_KEYS]
+
+    def is_inconsistent(self, index):
+        return bool(self.columns['tmin'][index] >= self.columns['tmax'][index])
+
+    def path(self, index):
+        return self.base + list(self.paths[index])
+
+
+def format_number(value):
+    if value != value:  # NaN
+        return '-'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
@@ -0,0 +1,120 @@
+import json
+import os
+from collections.abc import Mapping
+
+from compact import compact_pairs
+from journal import EditJournal, replay_journal, write_json_atomic
+from lazy_json import LazyJSONFile, LazyObject, resolve
+from snapshot import load_snapshot, write_snapshot
+from sqlite_backend import SQLiteDirectory, is_sqlite_file, load_sqlite_tree, save_sqlite_tree
+
+# Tree loading, saving and lookup shared by the urwid explorer
+# (edit_fitparams.py) and the headless tools; nothing here imports urwid.
+
+LAZY_LOAD_SIZE = 64 * 1024 * 1024  # Files at least this big are loaded lazily by default
+COMPACT_LOAD_SIZE = 16 * 1024 * 1024  # ... and at least this big as compact Records
+
+
+def load_directory_tree(json_file, lazy=None, compact=None, replay=True):
+    # '.sqlite'/'.db' files are opened as a SQLiteDirectory that reads nodes on demand
+    if is_sqlite_file(json_file):
+        return load_sqlite_tree(json_file)
+    # In lazy mode only the top of the tree is parsed; large subtrees stay
+    # LazyObject placeholders until get_current_dir descends into them.
+    # Compact mode parses small directories into Records (see compact.py),
+    # trading a slower parse for a much smaller tree.
+    lazy, compact = _load_modes(json_file, lazy, compact)
+    if lazy:
+        directory_tree = LazyJSONFile(json_file, compact=compact).load_root()
+    elif compact:
+        # Snapshots hold plain dicts, so a compact tree is always parsed
+        with open(json_file, 'r') as f:
+            directory_tree = json.load(f, object_pairs_hook=compact_pairs)
+    else:
+        # Use the binary snapshot if it still matches the JSON, else reparse
+        directory_tree = load_snapshot(json_file)
+        if directory_tree is None:
+            with open(json_file, 'r') as f:
+                directory_tree = json.load(f)
+            write_snapshot(json_file, directory_tree)
+    # Bring the tree up to date with edits journaled since the last compaction
+    # (without `replay` the tree is the JSON as saved, e.g. to diff against)
+    if replay:
+        replay_journal(json_file, directory_tree)
+    return directory_tree
+
+
+def read_directory_tree(json_file, lazy=None, compact=None):
+    # The JSON as saved, loaded like load_directory_tree but without touching
+    # anything on disk: no journal replay and no snapshot or offset index
+    # written, for reading a file another program is changing. Returns
+    # (tree, source), source being the LazyJSONFile a lazy tree reads from
+    # (close it once done with the tree) or None.
+    lazy, compact = _load_modes(json_file, lazy, compact)
+    if lazy:
+        source = LazyJSONFile(json_file, compact=compact, cache=False)
+        return source.load_root(), source
+    directory_tree = None if compact else load_snapshot(json_file)
+    if directory_tree is None:
+        with open(json_file, 'r') as f:
+            directory_tree = json.load(f, object_pairs_hook=compact_pairs if compact else None)
+    return directory_tree, None
+
+
+def _load_modes(json_file, lazy, compact):
+    # Size-based defaults for the lazy and compact flags
+    size = os.path.getsize(json_file)
+    if lazy is None:
+        lazy = size >= LAZY_LOAD_SIZE
+    if compact is None:
+        compact = size >= COMPACT_LOAD_SIZE
+    return lazy, compact
+
+
+def save_directory_tree(json_file, directory_tree):
+    if is_sqlite_file(json_file):
+        save_sqlite_tree(json_file, directory_tree)
+        return
+    if isinstance(directory_tree, SQLiteDirectory):
+        directory_tree = directory_tree.to_dict()
+    # Write to a temp file and os.replace it so a crash never truncates the JSON
+    write_json_atomic(json_file, directory_tree)
+
+
+def persist_directory_tree(json_file, directory_tree):
+    # Full save of a tree that was loaded with load_directory_tree: any
+    # journaled edits were replayed into it, so the journal is retired too
+    if is_sqlite_file(json_file):
+        save_directory_tree(json_file, directory_tree)
+        return
+    EditJournal(json_file).compact(directory_tree, force=True)
+
+
+def is_directory(value):
+    return isinstance(value, (Mapping, LazyObject))
+
+
+def split_path(path):
+    # 'fit_ranges/Pion/_1' -> ['fit_ranges', 'Pion', '_1']
+    return [key for key in path.split('/') if key]
+
+
+def get_node(directory_tree, path):
+    # The node at `path` (a list of keys); raises KeyError if it is missing
+    node = directory_tree
+    for key in path:
+        if not isinstance(node, Mapping):
+            raise KeyError('/'.join(path))
+        node = resolve(node, key)
+    return node
+
+
+def to_plain(value):
+    # Plain dicts for json.dumps, whatever backend or laziness the tree uses
+    if isinstance(value, LazyObject):
+        value = value.load()
+    if isinstance(value, SQLiteDirectory):
+        return value.to_dict()
+    if isinstance(value, Mapping):
+        return {key: to_plain(resolve(value, key)) for key in list(value.keys())}
+    return value
@@ -0,0 +1,160 @@
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+# Logging and latency instrumentation for the explorer.
+#
+# start_logging routes every record through a QueueHandler: the UI thread
+# only puts the record on a queue, and a QueueListener thread formats it and
+# writes the file. Records below the configured level are dropped before any
+# formatting, so calls like logging.debug("Key pressed: %s", key) on the
+# input path cost a level check.
+#
+# LatencyRecorder keeps a histogram per action ('navigate', 'edit', 'command'
+# for keys, 'render' for redraws, 'save' for the saver's writes) in
+# power-of-two microsecond buckets: recording is a bucket increment, memory
+# is fixed however long the session runs, and percentiles are accurate to
+# within a factor of two, which is enough to tell a slow key from a fast one.
+# `recorder` is the one the explorer and the saver report to.
+
+LOG_FILE = 'app_debug.log'
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(threadName)s - %(message)s'
+BUCKETS = 32  # Bucket i holds durations below 2**i microseconds (the last one, everything)
+BARS = ' ▁▂▃▄▅▆▇█'
+
+
+def start_logging(filename=LOG_FILE, level=logging.INFO):
+    # Replace the root handlers with a queue; returns the listener to stop at exit
+    records = queue.SimpleQueue()
+    handler = logging.FileHandler(filename, mode='w')
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+    root = logging.getLogger()
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.setLevel(level)
+    listener.start()
+    return listener
+
+
+def stop_logging(listener):
+    # Write out whatever is still queued
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+
+
+def bucket_bound(i):
+    # Upper bound of bucket i, in seconds
+    return (1 << i) / 1e6
+
+
+def format_duration(seconds):
+    if seconds < 1e-3:
+        return '%.0fus' % (seconds * 1e6)
+    if seconds < 1:
+        return '%.1fms' % (seconds * 1e3)
+    return '%.2fs' % seconds
+
+
+class Histogram:
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.counts[min(int(seconds * 1e6).bit_length(), BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction):
+        # Upper bound of the bucket holding that fraction of the samples
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bucket_bound(i), self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            'max': self.max,
+            'buckets_us': {str(1 << i): n for i, n in enumerate(self.counts) if n},
+        }
+
+
+class LatencyRecorder:
+    def __init__(self):
+        self.lock = threading.Lock()  # The saver thread records too
+        self.histograms = {}
+
+    def record(self, action, seconds):
+        with self.lock:
+            histogram = self.histograms.get(action)
+            if histogram is None:
+                histogram = self.histograms[action] = Histogram()
+            histogram.add(seconds)
+
+    def timed(self, action):
+        return _Timer(self, action)
+
+    def summary(self):
+        with self.lock:
+            return {action: h.summary() for action, h in sorted(self.histograms.items())}
+
+    def format_lines(self, low=4, high=21):
+        # A table of percentiles plus one bar per bucket from 2**low to 2**high us
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+        lines = ['%-9s %7s %8s %8s %8s %8s  %s..%s' % ('action', 'count', 'p50', 'p90', 'p99', 'max',
+                                                        format_duration(bucket_bound(low)),
+                                                        format_duration(bucket_bound(high)))]
+        for action, h in histograms:
+            counts = [sum(h.counts[:low + 1])] + h.counts[low + 1:high] + [sum(h.counts[high:])]
+            peak = max(counts) or 1
+            bars = ''.join(BARS[-(-n * (len(BARS) - 1) // peak)] for n in counts)
+            lines.append('%-9s %7d %8s %8s %8s %8s  %s' % (
+                action, h.count, format_duration(h.percentile(0.5)), format_duration(h.percentile(0.9)),
+                format_duration(h.percentile(0.99)), format_duration(h.max), bars))
+        return lines
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+
+class _Timer:
+    __slots__ = ('recorder', 'action', 'start')
+
+    def __init__(self, recorder, action):
+        self.recorder = recorder
+        self.action = action
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.recorder.record(self.action, time.perf_counter() - self.start)
+        return False
+
+
+recorder = LatencyRecorder()
@@ -0,0 +1,384 @@
+import json
+import logging
+import os
+from collections.abc import Mapping
+from itertools import islice
+
+from compact import Record
+from cow import SharedObject, share
+from lazy_json import LazyObject, ParsedObject, dump_tree, resolve, touch
+from snapshot import write_snapshot
+
+# Write-ahead journal for the fit-parameter JSON files.
+#
+# Every mutation made by the explorer is appended to '<json_file>.journal' as
+# one small JSON record per line, so committing an edit costs O(size of the
+# edit) instead of re-serializing the whole tree. The journal is replayed on
+# top of the canonical JSON by load_directory_tree and folded back into it
+# ("compacted") by the background saver (see saver.py) once edits go quiet,
+# once it grows past a threshold, or when the app quits.
+#
+# Record formats:
+#   {"op": "set", "path": [...], "value": ...}     add a key or replace a value
+#   {"op": "delete", "path": [...]}                remove a key
+#   {"op": "rename", "path": [...], "to": "name"}  rename the last path component
+#   {"op": "copy", "path": [...], "from": [...]}   add or replace a key with a copy of
+#                                                  another (shared until edited, see cow.py)
+#
+# 'set' and 'rename' records may carry an "index": the position the key ends
+# up at in its directory (undo uses it to put deleted or renamed keys back
+# where they were). Without it a new or renamed key goes last.
+
+JOURNAL_SUFFIX = '.journal'
+COMPACTING_SUFFIX = '.journal.compacting'
+COMPACT_THRESHOLD = 500  # Number of records before compacting without waiting for a quiet period
+
+
+def journal_path(json_file):
+    return json_file + JOURNAL_SUFFIX
+
+
+def compacting_path(json_file):
+    return json_file + COMPACTING_SUFFIX
+
+
+def file_signature(path):
+    # Cheap identity of a file on disk, used to tell whether a compaction landed
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def freeze_tree(directory_tree):
+    # A snapshot of the tree that later edits leave alone, without copying
+    # it: from now on the tree and the snapshot share each top-level
+    # directory (see cow.py), so an edit below one copies the directories on
+    # its way down instead of changing them. O(top-level keys), and the
+    # first edit below a directory afterwards pays O(width) for each one it
+    # copies.
+    snapshot = {}
+    for key in list(directory_tree.keys()):
+        value = directory_tree[key]
+        if isinstance(value, Mapping):
+            if type(value) is not SharedObject:
+                directory_tree[key] = share(value)
+            value = value.data if type(value) is SharedObject else value
+        snapshot[key] = value
+    return snapshot
+
+
+def _spans(value):
+    # `value` for saving: unedited parsed spans go back to the (immutable)
+    # span they came from, so the save writes them back without
+    # re-encoding. Parsed spans are only ever held by other parsed spans
+    # (or by SharedObject views, which dump_tree resolves), so nothing else
+    # needs looking into, and trees that were not loaded lazily hold none.
+    if type(value) is not ParsedObject:
+        return value
+    if value.origin is not None:
+        return value.origin
+    return {key: _spans(child) for key, child in value.items()}
+
+
+def _refresh_lookup(json_file, directory_tree):
+    # Imported here: fitlookup pulls in NumPy, which processes that only
+    # replay or append journals (fitparams_cli workers) never need
+    from fitlookup import refresh_lookup
+    return refresh_lookup(json_file, directory_tree)
+
+
+def lookup_parent(directory_tree, path):
+    # The directory holding the node at `path`
+    node = directory_tree
+    for key in path[:-1]:
+        node = resolve(node, key)
+    return node
+
+
+def changes_structure(directory_tree, op):
+    # True unless the op only replaces the value of an existing data node
+    if op['op'] != 'set' or isinstance(op['value'], Mapping):
+        return True
+    parent = lookup_parent(directory_tree, op['path'])
+    name = op['path'][-1]
+    return name not in parent or isinstance(parent[name], (Mapping, LazyObject))
+
+
+def move_key(node, name, index):
+    # Move an existing key to position `index` of its directory
+    if hasattr(node, 'move_key'):
+        node.move_key(name, index)  # Backends that keep their own ordering
+        return
+    if isinstance(node, dict):
+        if index >= len(node) - 1 and next(reversed(node)) == name:
+            return  # Already last: no need to look at the other keys
+        # Re-append the key and everything that should follow it
+        value = node.pop(name)
+        tail = [(key, node.pop(key)) for key in list(islice(node, index, None))]
+        node[name] = value
+        node.update(tail)
+        return
+    keys = list(node)
+    if keys.index(name) == min(index, len(keys) - 1):
+        return
+    others = [key for key in keys if key != name]
+    value = node.pop(name)
+    tail = [(key, node.pop(key)) for key in others[index:]]
+    node[name] = value
+    node.update(tail)
+
+
+def shared_value(directory_tree, path):
+    # The value at `path`, to be held in a second place too: a directory
+    # stays where it is as a SharedObject view, and the copy gets the same
+    # view (see cow.py)
+    parent = lookup_parent(directory_tree, path)
+    value = parent[path[-1]]
+    if hasattr(parent, 'rename_key'):
+        # Backends that keep their own storage (SQLite) copy it outright
+        return value.to_dict() if hasattr(value, 'to_dict') else value
+    if isinstance(value, Mapping) and type(value) is not SharedObject:
+        value = parent[path[-1]] = share(value)
+    return value
+
+
+def writable(parent, key):
+    # parent[key] for an edit below it: resolved, and private if it was shared
+    node = resolve(parent, key)
+    if type(node) is SharedObject:
+        node = parent[key] = node.thaw()
+    return node
+
+
+def apply_op(directory_tree, op):
+    # Apply a single journal record to the tree in place
+    name = op['path'][-1]
+    kind = op['op']
+    if kind == 'copy':
+        # Before walking down: the copy may land inside what it copies
+        value = shared_value(directory_tree, op['from'])
+    node = directory_tree
+    touch(node)
+    for key in op['path'][:-1]:
+        node = writable(node, key)
+        touch(node)
+    if kind == 'set':
+        # Held by the op too (undo history): shared, so edits below it copy
+        # it rather than change it, unless the backend copies it anyway
+        node[name] = op['value'] if hasattr(node, 'rename_key') else share(op['value'])
+    elif kind == 'copy':
+        node[name] = value
+    elif kind == 'delete':
+        del node[name]
+    elif kind == 'rename':
+        if hasattr(node, 'rename_key'):
+            node.rename_key(name, op['to'])  # Backends that can rename in place
+        else:
+            node[op['to']] = node.pop(name)
+        name = op['to']
+    else:
+        raise ValueError("Unknown journal op: %r" % (kind,))
+    if op.get('index') is not None:
+        move_key(node, name, op['index'])
+
+
+def encode_value(o):
+    # json.dumps default for records whose values still hold unparsed or
+    # shared subtrees
+    if isinstance(o, LazyObject):
+        return json.loads(o.raw())
+    if isinstance(o, Record):
+        return o.to_dict()
+    if isinstance(o, SharedObject):
+        return o.data
+    raise TypeError(f'Object of type {o.__class__.__name__} is not JSON serializable')
+
+
+def read_records(path):
+    # Yield the records of a journal file, stopping at a torn trailing line
+    # (a crash in the middle of an append leaves at most one partial record)
+    with open(path, 'r') as f:
+        for line in f:
+            if not line.endswith('\n'):
+                logging.warning("Ignoring truncated journal record in %s", path)
+                break
+            yield json.loads(line)
+
+
+def replay_records(directory_tree, records, source):
+    # Returns (records applied, records skipped because they no longer apply)
+    applied = skipped = 0
+    for op in records:
+        if 'base' in op:
+            continue
+        try:
+            apply_op(directory_tree, op)
+        except (KeyError, TypeError, ValueError) as exc:
+            logging.warning("Skipping journal record %r from %s: %s", op, source, exc)
+            skipped += 1
+        else:
+            applied += 1
+    return applied, skipped
+
+
+def replay_journal(json_file, directory_tree):
+    # Bring a freshly loaded tree up to date with any journaled edits.
+    # A leftover '.journal.compacting' means the app stopped during a
+    # compaction; it is only replayed if the JSON on disk is still the one the
+    # compaction started from (otherwise its records are already in the JSON).
+    # Returns the number of records applied.
+    replayed = skipped = 0
+    pending = compacting_path(json_file)
+    if os.path.exists(pending):
+        records = read_records(pending)
+        header = next(records, None)
+        if header is not None and header.get('base') == file_signature(json_file):
+            applied, failed = replay_records(directory_tree, records, pending)
+            replayed += applied
+            skipped += failed
+        else:
+            logging.debug("Discarding stale compaction journal %s", pending)
+        records.close()
+    current = journal_path(json_file)
+    if os.path.exists(current):
+        applied, failed = replay_records(directory_tree, read_records(current), current)
+        replayed += applied
+        skipped += failed
+    if replayed:
+        logging.debug("Replayed %d journal records into %s", replayed, json_file)
+    if skipped:
+        logging.warning("Skipped %d journal records that no longer apply to %s", skipped, json_file)
+    return replayed
+
+
+def write_json_atomic(json_file, directory_tree):
+    tmp_file = json_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        dump_tree(directory_tree, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, json_file)
+
+
+class EditJournal:
+    def __init__(self, json_file, threshold=COMPACT_THRESHOLD):
+        self.json_file = json_file
+        self.path = journal_path(json_file)
+        self.threshold = threshold
+        self.count = 0
+        self._file = None
+        # Signature of the JSON our tree is based on; None while we rewrite it
+        self.signature = file_signature(json_file) if os.path.exists(json_file) else None
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                self.count = sum(1 for _ in f)
+
+    def append(self, op):
+        self.append_many([op])
+
+    def append_many(self, ops):
+        # One write for a whole batch (e.g. a bulk edit)
+        if self._file is None:
+            self._file = open(self.path, 'a')
+        self._file.write(''.join(json.dumps(op, separators=(',', ':'), default=encode_value) + '\n'
+                                 for op in ops))
+        self._file.flush()
+        self.count += len(ops)
+
+    def changed_on_disk(self):
+        # True if something else rewrote the JSON since we loaded or saved it
+        signature = self.signature
+        try:
+            return signature is not None and file_signature(self.json_file) != signature
+        except OSError:
+            return False
+
+    def _write_json(self, directory_tree):
+        signature, self.signature = self.signature, None
+        try:
+            write_json_atomic(self.json_file, directory_tree)
+        except BaseException:
+            self.signature = signature  # The file on disk is untouched
+            raise
+        self.signature = file_signature(self.json_file)
+
+    def needs_compaction(self):
+        return self.count >= self.threshold
+
+    def has_pending(self):
+        return self.count > 0 or os.path.exists(compacting_path(self.json_file))
+
+    def _rotate(self):
+        # Move the live journal aside (prefixed with the signature of the JSON
+        # it applies to) so new edits can keep appending while we compact
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        pending = compacting_path(self.json_file)
+        base = file_signature(self.json_file)
+        carried = ''
+        if os.path.exists(pending):
+            # A previous compaction never landed; keep its records in front
+            with open(pending, 'r') as f:
+                header = f.readline()
+                if header and json.loads(header).get('base') == base:
+                    carried = f.read()
+        with open(pending, 'w') as out:
+            out.write(json.dumps({'base': base}) + '\n')
+            out.write(carried)
+            if os.path.exists(self.path):
+                with open(self.path, 'r') as f:
+                    out.write(f.read())
+            out.flush()
+            os.fsync(out.fileno())
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.count = 0
+        return pending
+
+    def begin_compaction(self, directory_tree):
+        # Snapshot the tree and move the live journal aside. Callers must hold
+        # whatever lock guards mutations so both reflect the same edits; the
+        # snapshot is frozen (see freeze_tree), so this costs O(top-level
+        # keys) and not a copy of the tree.
+        snapshot = freeze_tree(directory_tree)
+        pending = self._rotate()
+        return snapshot, pending
+
+    def finish_compaction(self, snapshot, pending):
+        # Safe to run off the UI thread: only touches the snapshot, which no
+        # edit changes, and files no longer being appended to
+        for key, value in snapshot.items():
+            snapshot[key] = _spans(value)
+        self._write_json(snapshot)
+        os.remove(pending)
+        write_snapshot(self.json_file, snapshot)
+        _refresh_lookup(self.json_file, snapshot)
+        logging.debug("Compacted journal into %s", self.json_file)
+
+    def discard(self):
+        # Drop journaled edits without rewriting the JSON, for when they
+        # cancel out and the file on disk already matches the tree
+        self.close()
+        for path in (self.path, compacting_path(self.json_file)):
+            if os.path.exists(path):
+                os.remove(path)
+        self.count = 0
+        logging.debug("Discarded journal for unchanged %s", self.json_file)
+
+    def compact(self, directory_tree, force=False):
+        # Synchronous compaction, used when the app quits; `force` rewrites
+        # the JSON even if nothing was journaled
+        if not force and not self.has_pending():
+            self.close()
+            return
+        pending = self._rotate()
+        self._write_json(directory_tree)
+        os.remove(pending)
+        write_snapshot(self.json_file, directory_tree)
+        _refresh_lookup(self.json_file, directory_tree)
+        self.close()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
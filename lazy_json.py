@@ -0,0 +1,229 @@
+import json
+import logging
+import mmap
+import os
+import re
+
+from compact import Record, compact_pairs
+from cow import SharedObject
+
+# Lazy loading of very large fit-parameter files.
+#
+# The file is scanned once to find the byte span of every JSON object that is
+# at least MIN_SPAN bytes long; that offset index is cached next to the file
+# ('<json_file>.index') and reused while the file's size and mtime match.
+# Loading then parses only the top-level object with its big children cut
+# out: each of those is left in the tree as a LazyObject placeholder pointing
+# into a read-only mmap of the file, and is parsed the first time something
+# descends into it (see resolve). Saving splices unparsed spans back in as raw
+# bytes, so untouched subtrees are never parsed at all; a span that a move
+# (see cow.py) took to another depth has its lines re-indented to match.
+#
+# A span that was parsed is held as a ParsedObject, which remembers the span
+# it came from until an edit passes through it (see touch). Until then a save
+# writes it back as its raw bytes too (see clean_span), so only the subtrees
+# that were actually edited are ever re-encoded.
+
+INDEX_SUFFIX = '.index'
+MIN_SPAN = 256 * 1024  # Objects smaller than this are parsed with their parent
+
+# Keys ("..." followed by ':'), other strings (consumed so brackets inside
+# them are skipped) and container brackets
+_TOKEN = re.compile(rb'"((?:[^"\\]|\\.)*)"(\s*:)?|[{}\[\]]')
+
+
+def index_path(json_file):
+    return json_file + INDEX_SUFFIX
+
+
+def file_signature(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def build_offset_index(data, min_span=MIN_SPAN):
+    # Returns {parent_path: [(key, start, end), ...]} for every object span of
+    # at least min_span bytes, in document order, by tokenizing keys, strings
+    # and brackets. Objects inside arrays are never split out.
+    children = {}
+    stack = []  # (start, path of the container or None inside arrays, is_object)
+    pending_key = None
+    for m in _TOKEN.finditer(data):
+        tok = data[m.start()]
+        if tok == 0x22:  # '"'
+            if m.group(2):
+                pending_key = m.group(1)
+            continue
+        if tok == 0x7b or tok == 0x5b:  # '{' or '['
+            if not stack:
+                path = ()
+            elif stack[-1][2] and stack[-1][1] is not None and pending_key is not None:
+                path = stack[-1][1] + (json.loads(b'"' + pending_key + b'"'),)
+            else:
+                path = None
+            stack.append((m.start(), path if tok == 0x7b else None, tok == 0x7b))
+            pending_key = None
+            continue
+        start, path, is_object = stack.pop()
+        if is_object and path and m.end() - start >= min_span:
+            children.setdefault(path[:-1], []).append((path[-1], start, m.end()))
+        pending_key = None
+    return children
+
+
+class LazyObject:
+    # Placeholder for an unparsed JSON object inside a LazyJSONFile
+    __slots__ = ('source', 'path', 'start', 'end')
+
+    def __init__(self, source, path, start, end):
+        self.source = source
+        self.path = path  # Path of the object in the file, kept across renames
+        self.start = start
+        self.end = end
+
+    def load(self):
+        return self.source.parse(self.path, self.start, self.end)
+
+    def raw(self):
+        return self.source.data[self.start:self.end].decode('utf-8')
+
+    def __repr__(self):
+        return "<LazyObject /%s (%d bytes)>" % ("/".join(self.path), self.end - self.start)
+
+
+class ParsedObject(dict):
+    # A parsed span; `origin` is the LazyObject it was parsed from, or None
+    # once anything below it has been edited
+    __slots__ = ('origin',)
+
+
+def touch(node):
+    # Called for every directory an edit passes through on its way down
+    if type(node) is ParsedObject:
+        node.origin = None
+
+
+def clean_span(value):
+    # The unparsed span behind `value` if it is still unedited, else `value`
+    if type(value) is ParsedObject and value.origin is not None:
+        return value.origin
+    return value
+
+
+def resolve(parent, key):
+    # parent[key], parsing (and caching in place) a LazyObject on first access
+    value = parent[key]
+    if isinstance(value, LazyObject):
+        value = value.load()
+        parent[key] = value
+    return value
+
+
+class LazyJSONFile:
+    def __init__(self, json_file, min_span=MIN_SPAN, compact=False, cache=True):
+        self.json_file = json_file
+        self.object_pairs_hook = compact_pairs if compact else None  # See compact.py
+        self._file = open(json_file, 'rb')
+        self.data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.children = self._load_index(min_span, cache)
+
+    def _load_index(self, min_span, cache_index):
+        # Without `cache_index` a missing or stale index is not written back
+        signature = file_signature(self.json_file)
+        cache = index_path(self.json_file)
+        if os.path.exists(cache):
+            try:
+                with open(cache, 'r') as f:
+                    cached = json.load(f)
+                if cached['signature'] == signature and cached['min_span'] == min_span:
+                    return {tuple(path): [tuple(c) for c in entries]
+                            for path, entries in cached['children']}
+            except (OSError, ValueError, KeyError):
+                logging.warning("Ignoring unreadable offset index %s", cache)
+        children = build_offset_index(self.data, min_span)
+        if not cache_index:
+            return children
+        try:
+            with open(cache, 'w') as f:
+                json.dump({
+                    'signature': signature,
+                    'min_span': min_span,
+                    'children': [[list(path), entries] for path, entries in children.items()],
+                }, f)
+        except OSError:
+            logging.warning("Could not write offset index %s", cache)
+        return children
+
+    def parse(self, path, start, end):
+        # Parse one object span with its large children replaced by placeholders
+        big = self.children.get(path, ())
+        pieces = []
+        pos = start
+        for key, child_start, child_end in big:
+            pieces.append(self.data[pos:child_start])
+            pieces.append(b'null')
+            pos = child_end
+        pieces.append(self.data[pos:end])
+        obj = json.loads(b''.join(pieces), object_pairs_hook=self.object_pairs_hook)
+        for key, child_start, child_end in big:
+            obj[key] = LazyObject(self, path + (key,), child_start, child_end)
+        if type(obj) is dict:
+            obj = ParsedObject(obj)
+            obj.origin = LazyObject(self, path, start, end)
+        return obj
+
+    def load_root(self):
+        return self.parse((), 0, len(self.data))
+
+    def close(self):
+        self.data.close()
+        self._file.close()
+
+
+def reindent(raw, indent):
+    # An object span written at one depth, for splicing in at another: the
+    # line of its closing brace, and every line above it, shifted so the
+    # brace is at `indent` spaces. JSON strings hold no raw newlines, so
+    # every newline in the span starts an indented line.
+    last = raw.rfind('\n')
+    if last < 0:
+        return raw  # All on one line
+    shift = indent - (len(raw) - last - 2)  # The last line is the indent and '}'
+    if shift > 0:
+        return raw.replace('\n', '\n' + ' ' * shift)
+    if shift < 0:
+        return raw.replace('\n' + ' ' * -shift, '\n')
+    return raw
+
+
+def dump_tree(directory_tree, f):
+    # json.dump(directory_tree, f, indent=4) that also accepts LazyObjects.
+    # With indent set, json.dump already encodes chunk by chunk in Python, so
+    # this costs the same and only differs by the splicing below.
+    markers = {}
+
+    def default(o):
+        if isinstance(o, Record):
+            return o.to_dict()
+        if isinstance(o, SharedObject):
+            return clean_span(o.data)  # An unedited parsed span is spliced in raw, below
+        if not isinstance(o, LazyObject):
+            raise TypeError(f'Object of type {o.__class__.__name__} is not JSON serializable')
+        # Encoded as a single chunk by iterencode, swapped below for the raw
+        # bytes of the unparsed span
+        marker = '\0lazy:%d\0' % id(o)
+        markers[json.dumps(marker)] = o
+        return marker
+
+    encoder = json.JSONEncoder(indent=4, default=default)
+    indent = 0  # Leading spaces of the line being written
+    for chunk in encoder.iterencode(directory_tree):
+        lazy = markers.pop(chunk, None) if chunk.startswith('"\\u0000lazy:') else None
+        if lazy is not None:
+            chunk = reindent(lazy.raw(), indent)
+        else:
+            newline = chunk.rfind('\n')
+            if newline >= 0:
+                line = chunk[newline + 1:]
+                indent = len(line) - len(line.lstrip(' '))
+        f.write(chunk)
@@ -0,0 +1,237 @@
+import hashlib
+import json
+from collections.abc import Mapping
+
+from journal import encode_value
+from lazy_json import LazyObject, clean_span
+
+# Content hashes of subtrees, for change detection and diffs.
+#
+# The digest of a leaf hashes its value; the digest of a directory hashes its
+# keys, in order, together with the digests of their values, so two subtrees
+# with the same digest hold the same JSON. An unparsed LazyObject is hashed
+# from its raw bytes rather than parsed: equal bytes are still equal content,
+# and the same content hashed both ways only ever compares as different,
+# which costs a needless save or diff step but never hides a change.
+#
+# MerkleTree caches directory digests in a shadow tree of _Entry objects
+# (directories holding only leaves are cheap to rehash and are not kept).
+# apply(op) clears the cached digests along the op's path and nothing else,
+# so after an edit the root digest is recomputed from the edited directory
+# upwards.
+#
+# It also answers "has anything changed since the last save?" without hashing
+# the whole tree: before the first op inside a directory, before(op) records
+# that directory's digest, and changed() compares the recorded digests with
+# the current ones. Edits that cancel out (an edit and its undo) leave
+# nothing to save.
+#
+# diff_trees compares two files span by span: a subtree that is still the
+# unedited span it was loaded from (see lazy_json.clean_span) is skipped when
+# the other side's span has the same bytes, parsed or not, so only spans
+# that differ are ever parsed.
+
+DIGEST_SIZE = 16
+
+
+def _hasher(data):
+    return hashlib.blake2b(data, digest_size=DIGEST_SIZE)
+
+
+def leaf_digest(value):
+    kind = type(value)
+    if kind is int or kind is float:
+        text = repr(value)  # Same spelling as the JSON encoder, much faster
+    else:
+        text = json.dumps(value, default=encode_value)
+    return _hasher(b'L' + text.encode('utf-8')).digest()
+
+
+def _key_bytes(key):
+    return json.dumps(key).encode('utf-8')
+
+
+class _Entry:
+    __slots__ = ('digest', 'children')
+
+    def __init__(self):
+        self.digest = None
+        self.children = {}  # key -> _Entry of a directory value
+
+
+def _is_directory(value):
+    return isinstance(value, (Mapping, LazyObject))
+
+
+def _load(value):
+    # Unparsed subtrees are parsed for a look inside but not cached in the tree
+    return value.load() if isinstance(value, LazyObject) else value
+
+
+def _child(entry, key):
+    return entry.children.get(key) or _Entry()
+
+
+def _digest(value, entry):
+    if entry.digest is not None:
+        return entry.digest
+    if isinstance(value, LazyObject):
+        h = _hasher(b'R')
+        h.update(value.source.data[value.start:value.end])
+    else:
+        h = _hasher(b'D')
+        for key in list(value.keys()):
+            child = value[key]
+            if _is_directory(child):
+                child_entry = entry.children.get(key)
+                if child_entry is None:
+                    child_entry = _Entry()
+                    digest = _digest(child, child_entry)
+                    if child_entry.children or isinstance(child, LazyObject):
+                        entry.children[key] = child_entry
+                else:
+                    digest = _digest(child, child_entry)
+            else:
+                digest = leaf_digest(child)
+            h.update(_key_bytes(key))
+            h.update(digest)
+    entry.digest = h.digest()
+    return entry.digest
+
+
+def value_digest(value, entry=None):
+    # The digest of any value, optionally through a cache entry
+    if not _is_directory(value):
+        return leaf_digest(value)
+    return _digest(value, entry if entry is not None else _Entry())
+
+
+class MerkleTree:
+    def __init__(self, directory_tree):
+        self.directory_tree = directory_tree
+        self.root = _Entry()
+        self.saved = {}  # Directory path -> its digest as of the last mark()
+        self.touched = set()  # Paths edited since the last mark()
+
+    def locate(self, path):
+        # (value, cache entry) at `path`; KeyError if it is missing
+        value, entry = self.directory_tree, self.root
+        for key in path:
+            if not _is_directory(value):
+                raise KeyError('/'.join(path))
+            value = _load(value)[key]
+            entry = _child(entry, key)
+        return value, entry
+
+    def digest(self, path=()):
+        value, entry = self.locate(path)
+        return value_digest(value, entry)
+
+    def apply(self, op):
+        # Call after a journal op was applied: forget what it invalidated
+        *parent, name = op['path']
+        entry = self.root
+        entry.digest = None
+        for key in parent:
+            entry = entry.children.get(key)
+            if entry is None:
+                return  # Nothing cached below here
+            entry.digest = None
+        moved = entry.children.pop(name, None)
+        if op['op'] == 'rename':
+            entry.children.pop(op['to'], None)
+            if moved is not None:
+                entry.children[op['to']] = moved  # Same content, new name
+
+    def before(self, op):
+        # Call before a journal op is applied: remember the digest of the
+        # directory it changes, unless that directory is already tracked
+        parent = tuple(op['path'][:-1])
+        self.touched.add(tuple(op['path']))
+        if op['op'] == 'rename':
+            self.touched.add(parent + (op['to'],))
+        saved = self.saved
+        if any(parent[:i] in saved for i in range(len(parent) + 1)):
+            return
+        below = {path: digest for path, digest in saved.items() if path[:len(parent)] == parent}
+        value, entry = self.locate(parent)
+        if below:
+            # Tracked directories inside this one already changed; rebuild
+            # its saved digest from theirs
+            saved[parent] = self._saved_digest(value, entry, parent, below)
+            for path in below:
+                del saved[path]
+        else:
+            saved[parent] = value_digest(value, entry)
+
+    def _saved_digest(self, value, entry, path, below):
+        if path in below:
+            return below[path]
+        if not _is_directory(value) or not any(p[:len(path)] == path for p in below):
+            return value_digest(value, entry)  # Unchanged since the mark
+        h = _hasher(b'D')
+        value = _load(value)
+        for key in list(value.keys()):
+            h.update(_key_bytes(key))
+            h.update(self._saved_digest(value[key], _child(entry, key), path + (key,), below))
+        return h.digest()
+
+    def changed(self):
+        # True if the tree differs from what it was at the last mark()
+        for path, digest in self.saved.items():
+            try:
+                value, entry = self.locate(path)
+            except KeyError:
+                return True
+            if value_digest(value, entry) != digest:
+                return True
+        return False
+
+    def mark(self):
+        # The tree as it is now has been saved
+        self.saved.clear()
+        self.touched.clear()
+
+    def overlaps(self, path):
+        # True if an edit since the last mark() was at, above or below `path`
+        path = tuple(path)
+        return any(t[:len(path)] == path or path[:len(t)] == t for t in self.touched)
+
+
+def diff_trees(old, new, path=()):
+    # Differences between the subtrees at `path` of two MerkleTrees as
+    # (kind, path, old value, new value), kind being 'changed', 'added',
+    # 'removed' or 'reordered' (same keys, different order). Subtrees with
+    # matching digests are skipped without looking inside.
+    old_value, old_entry = old.locate(path)
+    new_value, new_entry = new.locate(path)
+    changes = []
+    _diff(old_value, old_entry, new_value, new_entry, list(path), changes)
+    return changes
+
+
+def _diff(old, old_entry, new, new_entry, path, changes):
+    if not (_is_directory(old) and _is_directory(new)):
+        if _is_directory(old) or _is_directory(new) or leaf_digest(old) != leaf_digest(new):
+            changes.append(('changed', path, old, new))
+        return
+    old_span, new_span = clean_span(old), clean_span(new)
+    if isinstance(old_span, LazyObject) and isinstance(new_span, LazyObject):
+        # Unedited spans of two files: equal bytes, nothing to look at
+        old_bytes = old_span.source.data[old_span.start:old_span.end]
+        if old_bytes == new_span.source.data[new_span.start:new_span.end]:
+            return
+    if _digest(old, old_entry) == _digest(new, new_entry):
+        return
+    old, new = _load(old), _load(new)
+    old_keys, new_keys = list(old.keys()), list(new.keys())
+    for key in old_keys:
+        if key in new:
+            _diff(old[key], _child(old_entry, key), new[key], _child(new_entry, key), path + [key], changes)
+        else:
+            changes.append(('removed', path + [key], old[key], None))
+    for key in new_keys:
+        if key not in old:
+            changes.append(('added', path + [key], None, new[key]))
+    if [key for key in old_keys if key in new] != [key for key in new_keys if key in old]:
+        changes.append(('reordered', path, None, None))
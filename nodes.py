@@ -0,0 +1,172 @@
+import itertools
+from collections.abc import Mapping
+
+from fittree import is_directory
+from lazy_json import LazyObject, resolve
+
+# Node model for the explorer.
+#
+# A Node stands for one key of the tree as the UI sees it: it has a stable id
+# (kept across renames and value edits), a link to its parent node and, for
+# directories, a direct reference to the mapping behind it. Nodes are created
+# on demand as rows are rendered and directories entered, so a row widget can
+# carry the node it shows and key handlers never have to parse labels or
+# re-walk the path from the root. The tree itself stays plain dicts (or a
+# SQLite/lazy/workspace mapping); NodeTable.apply keeps the nodes in step
+# with the journal ops committed to it.
+
+_ids = itertools.count(1)
+
+
+class Node:
+    __slots__ = ('id', 'parent', 'name', 'children', '_directory', 'attached')
+
+    def __init__(self, parent, name, directory=None):
+        self.id = next(_ids)
+        self.parent = parent
+        self.name = name
+        self.children = {}  # name -> Node, for the children created so far
+        self._directory = directory
+        self.attached = True  # False once the key is deleted or replaced
+
+    @property
+    def directory(self):
+        # The mapping behind a directory node; lazily loaded subtrees are
+        # parsed the first time this is asked for
+        if self._directory is None:
+            self._directory = resolve(self.parent.directory, self.name)
+        return self._directory
+
+    def value(self):
+        # The raw value of the key (a LazyObject stays unparsed)
+        return self.parent.directory[self.name]
+
+    def is_directory(self):
+        return self._directory is not None or is_directory(self.value())
+
+    def child(self, name):
+        node = self.children.get(name)
+        if node is None:
+            if name not in self.directory:
+                raise KeyError(name)
+            node = self.children[name] = Node(self, name)
+        return node
+
+    def path(self):
+        names = []
+        node = self
+        while node.parent is not None:
+            names.append(node.name)
+            node = node.parent
+        return names[::-1]
+
+    def alive(self):
+        # True while neither this key nor any of its ancestors was removed
+        node = self
+        while node is not None:
+            if not node.attached:
+                return False
+            node = node.parent
+        return True
+
+    def __repr__(self):
+        return "<Node #%d /%s>" % (self.id, "/".join(self.path()))
+
+
+class NodeTable:
+    def __init__(self, directory_tree):
+        self.root = Node(None, None, directory_tree)
+
+    def lookup(self, path):
+        # The node at `path`, creating nodes along the way; KeyError if missing
+        node = self.root
+        for name in path:
+            node = node.child(name)
+        return node
+
+    def find(self, path):
+        # The node at `path` if it has been created, else None
+        node = self.root
+        for name in path:
+            node = node.children.get(name)
+            if node is None:
+                return None
+        return node
+
+    def nearest(self, node):
+        # `node` if it is still in the tree, else the same path looked up
+        # again, else its closest surviving ancestor
+        if node.alive():
+            return node
+        path = node.path()
+        while path:
+            try:
+                found = self.lookup(path)
+                if found.is_directory():
+                    return found
+            except KeyError:
+                pass
+            path.pop()
+        return self.root
+
+    def drop(self, parent, name):
+        node = parent.children.pop(name, None)
+        if node is not None:
+            node.attached = False
+
+    def forget(self, path):
+        # Detach everything created below `path`, e.g. when the tree behind it
+        # was reloaded
+        node = self.find(path)
+        if node is not None:
+            self._drop_children(node)
+
+    def _drop_children(self, node):
+        for name in list(node.children):
+            self.drop(node, name)
+
+    def _refresh(self, path):
+        # An edit through a directory shared by a copy swaps it for a private
+        # one (see cow.py); nodes on the edited path that still hold the
+        # shared one look it up again
+        node = self.root
+        for key in path:
+            child = node.children.get(key)
+            if child is None:
+                return
+            directory = child._directory
+            if hasattr(directory, 'rename_key'):
+                return  # Backends with directories as views by path (SQLite) never share
+            if directory is not None and directory is not node.directory[key]:
+                child._directory = None
+            node = child
+
+    def apply(self, op):
+        # Bring the nodes in line with a journal op that was just committed
+        *parent_path, name = op['path']
+        self._refresh(parent_path)
+        parent = self.find(parent_path)
+        if parent is None:
+            return  # Nothing created there yet
+        kind = op['op']
+        if kind == 'copy':
+            self.drop(parent, name)
+        elif kind == 'set':
+            node = parent.children.get(name)
+            if node is not None and (node._directory is not None or node.children
+                                     or isinstance(op['value'], (Mapping, LazyObject))):
+                # A directory was replaced; its nodes describe the old one
+                self.drop(parent, name)
+        elif kind == 'delete':
+            self.drop(parent, name)
+        elif kind == 'rename':
+            node = parent.children.pop(name, None)
+            self.drop(parent, op['to'])
+            if node is not None:
+                node.name = op['to']
+                parent.children[op['to']] = node
+                if node._directory is not None and node._directory is not parent.directory[op['to']]:
+                    # Backends whose directories are views by path (SQLite)
+                    # hand out a new one after a rename
+                    node._directory = None
+                    self._drop_children(node)
@@ -0,0 +1,146 @@
+import logging
+import threading
+import time
+
+from instrument import recorder
+
+# Background saver for the explorer.
+#
+# Edits are journaled synchronously (see journal.py); rewriting the canonical
+# JSON is left to a dedicated writer thread. Bursts of edits are coalesced
+# into a single write once no edit has arrived for `delay` seconds, and the
+# JSON is serialized on the writer thread and swapped in with os.replace, so
+# neither the size of the tree nor a crash mid-write can hurt the UI or the
+# file. Only the short snapshot+journal-rotation step runs under `lock`, the
+# same lock the explorer holds while it mutates the tree.
+#
+# With a `tracker` (a MerkleTree, see merkle.py) a save whose edits all
+# cancel out only drops the journal: the JSON on disk already matches.
+#
+# A JSON file rewritten by someone else is never overwritten: the save waits
+# in the EXTERNAL state until the change has been merged into the tree (see
+# watcher.py), and at quit the journal is left for the next load to replay
+# on top of the new file.
+#
+# Each write is timed into the 'save' latency histogram (see instrument.py).
+
+SAVE_DELAY = 0.5  # Seconds of quiet before a burst of edits is written out
+
+CLEAN = 'clean'
+PENDING = 'pending'
+SAVING = 'saving'
+ERROR = 'error'
+EXTERNAL = 'external'
+
+
+class AsyncSaver:
+    def __init__(self, journal, get_tree, lock, delay=SAVE_DELAY, notify=None, tracker=None):
+        self.journal = journal
+        self.get_tree = get_tree  # Returns the tree to save (read under lock)
+        self.lock = lock
+        self.delay = delay
+        self.notify = notify  # Called from the writer thread on status changes
+        self.tracker = tracker
+        self.status = PENDING if journal.has_pending() else CLEAN
+        self.error = None
+
+        self._cond = threading.Condition()
+        self._dirty = journal.has_pending()
+        # Edits replayed from the journal at load time are not in the JSON yet,
+        # whatever the tracker says; neither are those of a failed save
+        self._force = journal.has_pending()
+        self._immediate = False
+        self._deadline = time.monotonic() + delay
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='fitparams-saver', daemon=True)
+        self._thread.start()
+
+    def _set_status(self, status, error=None):
+        self.status = status
+        self.error = error
+        if self.notify is not None:
+            self.notify(status)
+
+    def schedule(self, immediate=False):
+        # Mark the tree dirty; the write happens after the quiet period, or
+        # right away when `immediate` (e.g. the journal hit its threshold)
+        with self._cond:
+            self._dirty = True
+            self._immediate = self._immediate or immediate
+            self._deadline = time.monotonic() + self.delay
+            self._cond.notify()
+        if self.status != PENDING:
+            self._set_status(PENDING)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._dirty and not self._stopping:
+                    self._cond.wait()
+                if self._stopping:
+                    return
+                # Debounce: keep waiting while edits keep pushing the deadline
+                while not self._immediate and not self._stopping:
+                    remaining = self._deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._stopping:
+                    return
+                self._dirty = False
+                self._immediate = False
+            self._save()
+
+    def _unchanged(self):
+        # Call under lock
+        return not self._force and self.tracker is not None and not self.tracker.changed()
+
+    def _save(self):
+        self._set_status(SAVING)
+        start = time.perf_counter()
+        try:
+            with self.lock:
+                if self.journal.changed_on_disk():
+                    # Saved again once the change has been merged
+                    self._set_status(EXTERNAL)
+                    return
+                if self._unchanged():
+                    self.journal.discard()
+                    snapshot = None
+                else:
+                    snapshot, pending = self.journal.begin_compaction(self.get_tree())
+                    if self.tracker is not None:
+                        self.tracker.mark()
+                    self._force = True  # Until the write below lands
+            if snapshot is not None:
+                self.journal.finish_compaction(snapshot, pending)
+                self._force = False
+                recorder.record('save', time.perf_counter() - start)
+        except Exception as exc:
+            # The journal still holds every edit, so nothing is lost; retry on
+            # the next edit or at shutdown
+            logging.exception("Saving %s failed", self.journal.json_file)
+            self._set_status(ERROR, exc)
+            return
+        with self._cond:
+            dirty = self._dirty
+        self._set_status(PENDING if dirty else CLEAN)
+
+    def flush(self):
+        # Stop the writer thread and write out anything still outstanding
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self._thread.join()
+        with self.lock:
+            if self.journal.changed_on_disk():
+                if self.journal.has_pending():
+                    logging.warning("%s changed on disk; leaving edits in %s", self.journal.json_file,
+                                    self.journal.path)
+                self.journal.close()
+                return
+            if self.journal.has_pending() and self._unchanged():
+                self.journal.discard()
+            else:
+                self.journal.compact(self.get_tree())
+        self.status = CLEAN
@@ -0,0 +1,381 @@
+import bisect
+import heapq
+import itertools
+import json
+import re
+from collections.abc import Mapping
+
+from cow import unshared
+from journal import encode_value
+from lazy_json import LazyObject, ParsedObject, resolve
+
+# Search over every key and leaf value of a tree, for jumping to a node.
+#
+# A query is a list of terms ('pion sp 2state tmin'). A node matches when
+# each term matches a key on its path or the node's own leaf value, and the
+# results are the shallowest matching nodes, best first. A term matches a
+# key or value that equals, starts with or contains it (ignoring case), or,
+# if nothing does, one that contains its characters in order ('hpo' -> 'HPo',
+# '2st' -> '2state').
+#
+# The index is inverted: for every distinct key, and every distinct leaf
+# value, the sorted list of the paths (tuples of keys) where it occurs.
+# Sorting keeps each subtree contiguous, so the occurrences of 'SP' below
+# fit_ranges/Pion are found with two bisects. A query starts from the
+# occurrences of its most selective term and only looks inside those
+# subtrees for the other terms, so its cost follows the number of results
+# rather than the size of the tree. Distinct keys are few next to nodes, and
+# each term is matched against all of them with one regex scan.
+#
+# before(op) and apply(op) keep the index in step with journal ops: removing
+# or inserting a subtree is one slice per distinct key in it, and a value
+# edit only swaps that leaf's value. Subtrees not parsed yet (lazily loaded
+# files) are indexed by the first search, and so are pasted ones (copy ops),
+# so that a paste costs O(1) here however large the subtree is. Building the
+# index costs a few seconds per million nodes, so TreeSession does it on a
+# thread of its own.
+
+LIMIT = 200  # Matches collected per query, before ranking
+MAX_VISITS = 20000  # Candidate nodes a query looks at before it gives up on the rest
+EXACT, PREFIX, SUBSTRING, FUZZY = 4, 3, 2, 1
+_LEAVES = frozenset((int, float, str, bool, type(None), list))
+_END = '\U0010ffff'  # Sorts after any key, so path + (_END,) bounds the subtree at path
+
+
+def value_token(value):
+    # The text a leaf value is matched by
+    kind = type(value)
+    if kind is str:
+        return value
+    if kind is int or kind is float:
+        return repr(value)  # Same spelling as the JSON encoder, much faster
+    return json.dumps(value, default=encode_value)
+
+
+def _span(postings, path):
+    # Range of the entries at or below `path` in a sorted postings list
+    return bisect.bisect_left(postings, path), bisect.bisect_left(postings, path + (_END,))
+
+
+class _Vocabulary:
+    # Distinct tokens of one kind (keys or leaf values), each with the sorted
+    # paths where it occurs
+    def __init__(self):
+        self.postings = {}
+        self.tokens = None  # Tokens in the order of `text`, None when stale
+        self.text = ''  # Lowercased tokens, one per line
+        self.starts = []  # Offset of each line in `text`
+        self.cache = {}  # term -> {token: quality}, valid while `tokens` is
+
+    def add(self, token, paths):
+        # `paths` are sorted and belong to a subtree with nothing indexed yet
+        postings = self.postings.get(token)
+        if postings is None:
+            self.postings[token] = paths
+            self.tokens = None
+        else:
+            i = bisect.bisect_left(postings, paths[0])
+            postings[i:i] = paths
+
+    def remove(self, token, path):
+        # Drop the occurrences at or below `path`
+        postings = self.postings.get(token)
+        if postings is None:
+            return
+        lo, hi = _span(postings, path)
+        del postings[lo:hi]
+        if not postings:
+            del self.postings[token]
+            self.tokens = None
+
+    def _refresh(self):
+        self.tokens = list(self.postings)
+        lines = [token.lower().replace('\n', ' ') for token in self.tokens]
+        self.text = '\n'.join(lines)
+        self.starts = list(itertools.accumulate((len(line) + 1 for line in lines[:-1]), initial=0))
+        self.cache = {}
+
+    def _lines(self, pattern):
+        tokens, starts = self.tokens, self.starts
+        return {tokens[bisect.bisect_right(starts, m.start()) - 1]
+                for m in re.finditer(pattern, self.text, re.M)}
+
+    def match(self, term):
+        # {token: quality} for a lowercased term
+        if self.tokens is None:
+            self._refresh()
+        found = self.cache.get(term)
+        if found is None:
+            found = {}
+            for token in self._lines(re.escape(term)):
+                low = token.lower()
+                found[token] = EXACT if low == term else PREFIX if low.startswith(term) else SUBSTRING
+            if not found and len(term) > 1:
+                for token in self._lines('^[^\n]*?' + '[^\n]*?'.join(re.escape(c) for c in term)):
+                    found[token] = FUZZY
+            self.cache[term] = found
+        return found
+
+    def occurrences(self, found, path):
+        # Sorted paths at or below `path` of any of the tokens in `found`
+        streams = []
+        for token in found:
+            postings = self.postings[token]
+            lo, hi = _span(postings, path) if path else (0, len(postings))
+            if lo < hi:
+                streams.append(map(postings.__getitem__, range(lo, hi)))
+        return streams
+
+    def count(self, found):
+        return sum(len(self.postings[token]) for token in found)
+
+
+class _Term:
+    __slots__ = ('keys', 'values', 'cost')
+
+    def __init__(self, keys, values, cost):
+        self.keys = keys  # {key: quality}
+        self.values = values  # {value token: quality}
+        self.cost = cost  # Occurrences of all of those
+
+
+class SearchIndex:
+    def __init__(self, directory_tree):
+        self.directory_tree = directory_tree
+        self.keys = _Vocabulary()
+        self.values = _Vocabulary()
+        self.pending = set()  # Paths of unparsed or pasted subtrees, indexed by the next search
+        self._value_edit = None  # Path of a leaf whose value before() dropped
+        self.built = False  # Edits before build() need no bookkeeping
+
+    def build(self):
+        self._insert((), self.directory_tree, own=False)
+        self.built = True
+
+    def __len__(self):
+        return sum(len(postings) for postings in self.keys.postings.values())
+
+    # -- Maintenance
+
+    def _collect(self, path, value, own=True):
+        # ({key: [path]}, {value token: [path]}) of the subtree at `path`, in
+        # sorted order: children are pushed in reverse sorted order
+        keys, values = {}, {}
+        stack = [(path, value)]
+        while stack:
+            path, value = stack.pop()
+            if own:
+                paths = keys.get(path[-1])
+                if paths is None:
+                    keys[path[-1]] = [path]
+                else:
+                    paths.append(path)
+            own = True
+            kind = type(value)
+            if kind is LazyObject:
+                self.pending.add(path)
+            elif kind is dict or kind is ParsedObject or (kind not in _LEAVES and isinstance(value, Mapping)):
+                stack.extend([(path + (key,), value[key]) for key in sorted(value.keys(), reverse=True)])
+            else:
+                token = value_token(value)
+                paths = values.get(token)
+                if paths is None:
+                    values[token] = [path]
+                else:
+                    paths.append(path)
+        return keys, values
+
+    def _insert(self, path, value, own=True):
+        keys, values = self._collect(path, value, own)
+        for token, paths in keys.items():
+            self.keys.add(token, paths)
+        for token, paths in values.items():
+            self.values.add(token, paths)
+
+    def _lookup(self, path):
+        # The raw value at `path` (unparsed subtrees stay unparsed); None if missing
+        value = self.directory_tree
+        for key in path:
+            if not isinstance(value, Mapping) or key not in value:
+                return None
+            value = value[key]
+        return value
+
+    def _is_pending(self, path):
+        # True if `path` is in or below an unparsed subtree
+        return bool(self.pending) and any(path[:i] in self.pending for i in range(1, len(path) + 1))
+
+    def _drop(self, path, value):
+        # Forget the subtree at `path`
+        keys, values = set(), set()
+        stack = [value]
+        while stack:
+            value = stack.pop()
+            if isinstance(value, Mapping):
+                keys.update(value.keys())
+                stack.extend(value[key] for key in list(value.keys()))
+            elif not isinstance(value, LazyObject):
+                values.add(value_token(value))
+        keys.add(path[-1])
+        for token in keys:
+            self.keys.remove(token, path)
+        for token in values:
+            self.values.remove(token, path)
+        if self.pending:
+            self.pending = {p for p in self.pending if p[:len(path)] != path}
+
+    def before(self, op):
+        # Call before a journal op is applied: drop what it replaces
+        path = tuple(op['path'])
+        self._value_edit = None
+        if not self.built or self._is_pending(path[:-1]):
+            return
+        parent = self._lookup(path[:-1])
+        if not isinstance(parent, Mapping):
+            return
+        if op['op'] == 'set' and path[-1] in parent:
+            old = parent[path[-1]]
+            if not isinstance(old, (Mapping, LazyObject)) and not isinstance(op['value'], (Mapping, LazyObject)):
+                # Same key, new value
+                self.values.remove(value_token(old), path)
+                self._value_edit = path
+                return
+        for name in (path[-1], op['to']) if op['op'] == 'rename' else (path[-1],):
+            if name in parent:
+                self._drop(path[:-1] + (name,), parent[name])
+
+    def apply(self, op):
+        # Call after a journal op was applied: index what it put in place
+        path = tuple(op['path'])
+        if not self.built or op['op'] == 'delete' or self._is_pending(path[:-1]):
+            return
+        if op['op'] == 'rename':
+            path = path[:-1] + (op['to'],)
+        value = self._lookup(path)
+        if path == self._value_edit:
+            self.values.add(value_token(value), [path])
+        elif op['op'] == 'copy' and isinstance(value, Mapping):
+            self.keys.add(path[-1], [path])
+            self.pending.add(path)
+        else:
+            self._insert(path, unshared(value))
+        self._value_edit = None
+
+    def reindex(self, path):
+        # Index the subtree at `path` again from the tree, whatever was
+        # indexed for it before (for edits made while build() was walking)
+        path = tuple(path)
+        for vocabulary in (self.keys, self.values):
+            for token in list(vocabulary.postings):
+                vocabulary.remove(token, path)
+        if self.pending:
+            self.pending = {p for p in self.pending if p[:len(path)] != path}
+        if self._is_pending(path[:-1]):
+            return
+        parent = self._lookup(path[:-1])
+        if isinstance(parent, Mapping) and path[-1] in parent:
+            self._insert(path, unshared(parent[path[-1]]))
+
+    def complete(self):
+        # Parse and index the subtrees that were unparsed or pasted so far
+        while self.pending:
+            path = self.pending.pop()
+            parent = self._lookup(path[:-1])
+            if not isinstance(parent, Mapping) or path[-1] not in parent:
+                continue
+            self._insert(path, unshared(resolve(parent, path[-1])), own=False)
+
+    # -- Queries
+
+    def search(self, query, limit=LIMIT):
+        # ([(score, path)] best first, True if the search stopped early)
+        if self.pending:
+            self.complete()
+        terms = []
+        for word in query.lower().split():
+            keys, values = self.keys.match(word), self.values.match(word)
+            if not keys and not values:
+                return [], False
+            terms.append(_Term(keys, values, self.keys.count(keys) + self.values.count(values)))
+        if not terms:
+            return [], False
+        state = _Search(self, terms, limit)
+        state.descend(self._occurrences(min(terms, key=lambda term: term.cost), ()))
+        ranked = sorted(((state.score(path), path) for path in state.results), key=lambda r: (-r[0], r[1]))
+        return ranked, state.truncated
+
+    def _occurrences(self, term, path):
+        streams = self.keys.occurrences(term.keys, path) + self.values.occurrences(term.values, path)
+        if len(streams) == 1:
+            return streams[0]
+        return heapq.merge(*streams)
+
+
+class _Search:
+    def __init__(self, index, terms, limit):
+        self.index = index
+        self.terms = terms
+        self.limit = limit
+        self.results = []
+        self.visits = 0
+        self.truncated = False
+        self.tokens = {}  # path -> value token of the leaf there (None for directories)
+
+    def value_token(self, path):
+        token = self.tokens.get(path, False)
+        if token is False:
+            value = self.index._lookup(path)
+            token = None if isinstance(value, (Mapping, LazyObject)) else value_token(value)
+            self.tokens[path] = token
+        return token
+
+    def covers(self, path, term):
+        keys = term.keys
+        for key in path:
+            if key in keys:
+                return True
+        return bool(term.values) and self.value_token(path) in term.values
+
+    def descend(self, candidates):
+        # Visit sorted candidate paths; a candidate matching every term is a
+        # result, otherwise look below it for the cheapest term it misses.
+        # Returns True once the search has to stop.
+        covered = None
+        for path in candidates:
+            if covered is not None and path[:len(covered)] == covered:
+                continue  # Already searched from an ancestor
+            covered = path
+            self.visits += 1
+            if self.visits > MAX_VISITS:
+                self.truncated = True
+                return True
+            missing = [term for term in self.terms if not self.covers(path, term)]
+            if not missing:
+                self.results.append(path)
+                if len(self.results) >= self.limit:
+                    self.truncated = True
+                    return True
+            elif self.descend(self.index._occurrences(min(missing, key=lambda term: term.cost), path)):
+                return True
+        return False
+
+    def score(self, path):
+        # Match quality of every term, a bonus when the terms match along the
+        # path in query order, and shallower nodes first
+        score = 0
+        last = -1
+        in_order = True
+        for term in self.terms:
+            best, depth = 0, 0
+            for i, key in enumerate(path):
+                quality = term.keys.get(key, 0)
+                if quality > best:
+                    best, depth = quality, i
+            if term.values:
+                quality = term.values.get(self.value_token(path), 0)
+                if quality > best:
+                    best, depth = quality, len(path)
+            score += 10 * best
+            in_order = in_order and depth >= last
+            last = depth
+        return score + (5 if in_order else 0) - len(path)
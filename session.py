@@ -0,0 +1,177 @@
+import gc
+import threading
+
+from aggregates import Aggregates
+from fittree import load_directory_tree
+from journal import EditJournal, apply_op
+from merkle import MerkleTree
+from saver import CLEAN, AsyncSaver
+from search import SearchIndex
+from sqlite_backend import SQLiteDirectory
+from undo import invert_op
+from validation import Validator, ensemble_extent
+
+# One open fit-parameter file: its tree plus whatever persists edits to it.
+# JSON files get an edit journal and a background saver; SQLite databases
+# commit every edit as its own transaction and need neither. The subtree
+# hashes in `merkle` (see merkle.py) follow every edit, so the saver can tell
+# when the edits since the last save cancel out, `validator` (see
+# validation.py) re-checks what each edit touched, `aggregates` (see
+# aggregates.py) keeps the per-directory counts shown next to directories,
+# and `search` (see search.py) indexes every key and value for find(),
+# built on a thread of its own; find() does not wait for it, and
+# `on_indexed` is called once it can answer.
+
+
+class TreeSession:
+    def __init__(self, json_file, directory_tree=None, notify=None, on_indexed=None):
+        self.json_file = json_file
+        if directory_tree is None:
+            directory_tree = load_directory_tree(json_file)
+        self.directory_tree = directory_tree
+        self.lock = threading.Lock()  # Guards the tree against the saver thread
+        self.merkle = MerkleTree(directory_tree)  # Subtree hashes, read under lock
+        self.validator = Validator(directory_tree, extent=ensemble_extent(json_file, directory_tree))
+        self.validator.validate()
+        self.aggregates = Aggregates(directory_tree)
+        self.aggregates.build()
+        self.search = SearchIndex(directory_tree)
+        self.indexer = None
+        self.indexing = False  # True until the indexer's index replaces `search`
+        self.on_indexed = on_indexed  # Called from the indexer thread once it has
+        self.edited = None  # Paths edited while the indexer walks the tree
+        if isinstance(directory_tree, SQLiteDirectory):
+            # SQLite connections stay on the thread that opened them; indexed
+            # by the first find() instead
+            self.journal = None
+            self.saver = None
+        else:
+            self.indexing = True
+            self.indexer = threading.Thread(target=self._build_index, name='fitparams-index', daemon=True)
+            self.indexer.start()
+            self.journal = EditJournal(json_file)  # Append-only log of edits
+            self.saver = AsyncSaver(self.journal, lambda: self.directory_tree, self.lock,
+                                    notify=notify, tracker=self.merkle)
+
+    @property
+    def status(self):
+        return self.saver.status if self.saver is not None else CLEAN
+
+    def dirty(self):
+        return self.status != CLEAN
+
+    def commit_many(self, ops):
+        # Apply a batch of mutations with a single journal write and a single
+        # save (or a single SQLite transaction). Returns the inverse ops of
+        # each op, for undo.
+        inverses = []
+        with self.lock:
+            if isinstance(self.directory_tree, SQLiteDirectory):
+                with self.directory_tree.store.batch():
+                    self._apply(ops, inverses)
+            else:
+                self._apply(ops, inverses)
+            if self.journal is not None:
+                self.journal.append_many(ops)
+        if self.saver is not None:
+            self.saver.schedule(immediate=self.journal.needs_compaction())
+        return inverses
+
+    def _apply(self, ops, inverses):
+        # Indexing a pasted subtree allocates an index entry per node in it;
+        # as when loading a snapshot, keep the GC from making full passes
+        # over the tree meanwhile
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for op in ops:
+                inverses.append(invert_op(self.directory_tree, op))
+                self.merkle.before(op)
+                self.aggregates.before(op)
+                self.search.before(op)
+                apply_op(self.directory_tree, op)
+                self.merkle.apply(op)
+                self.validator.apply(op)
+                self.aggregates.apply(op)
+                self.search.apply(op)
+                self._edited(op)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def _edited(self, op):
+        if self.edited is not None:
+            self.edited.append(op['path'])
+            if op['op'] == 'rename':
+                self.edited.append(op['path'][:-1] + [op['to']])
+
+    def _build_index(self):
+        # The tree is walked without the lock, so edits never wait for the
+        # walk; the subtrees they changed meanwhile are indexed again under
+        # the lock before the index replaces the unbuilt one
+        while True:
+            with self.lock:
+                self.edited = []
+            index = SearchIndex(self.directory_tree)
+            try:
+                index.build()
+            except (KeyError, RuntimeError):
+                continue  # A directory changed under the walk: start over
+            with self.lock:
+                for path in self.edited:
+                    index.reindex(path)
+                self.search = index
+                self.edited = None
+                self.indexing = False
+            if self.on_indexed is not None:
+                self.on_indexed()
+            return
+
+    def find(self, query):
+        # Search results for `query` as ([(score, path)], truncated), see
+        # search.py, or None while the index is still being built (without
+        # waiting for it: on_indexed is called once it is)
+        with self.lock:
+            if self.indexing:
+                return None
+            if not self.search.built:
+                self.search.build()
+            return self.search.search(query)
+
+    def merge_external(self, ops, signature):
+        # Apply changes read back from the JSON after someone else rewrote it
+        # (see watcher.py) and adopt that file as the one we are based on.
+        # Ops that overlap an edit made since they were planned are skipped.
+        # Returns (applied ops, skipped ops).
+        applied, skipped = [], []
+        with self.lock:
+            local = self.merkle.changed()
+            touched = set(self.merkle.touched)
+            for op in ops:
+                (skipped if self.merkle.overlaps(op['path']) else applied).append(op)
+            for op in applied:
+                self.merkle.before(op)
+                self.aggregates.before(op)
+                self.search.before(op)
+                apply_op(self.directory_tree, op)
+                self.merkle.apply(op)
+                self.validator.apply(op)
+                self.aggregates.apply(op)
+                self.search.apply(op)
+                self._edited(op)
+            self.journal.signature = signature
+            if not local and not skipped:
+                # Nothing of ours is unsaved: the tree now is the file on disk
+                self.merkle.mark()
+                self.journal.discard()
+            else:
+                # The merged ops are the file's, not local edits
+                self.merkle.touched = touched
+                self.journal.append_many(applied)
+        self.saver.schedule()  # Also lifts the saver's EXTERNAL hold
+        return applied, skipped
+
+    def close(self):
+        # Write out anything still pending and stop the saver thread
+        if self.saver is not None:
+            self.saver.flush()
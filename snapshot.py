@@ -0,0 +1,94 @@
+import gc
+import hashlib
+import json
+import logging
+import marshal
+import os
+
+# Binary snapshot cache for fit-parameter files.
+#
+# '<json_file>.snapshot' holds a marshal image of the parsed tree behind a
+# one-line JSON header recording the size, mtime and content hash of the JSON
+# it was made from. marshal.loads rebuilds the nested dicts several times
+# faster than json.load, so a warm start only pays for hashing the file.
+# The snapshot is refreshed whenever the JSON is parsed from text and after
+# every save.
+
+SNAPSHOT_SUFFIX = '.snapshot'
+SNAPSHOT_VERSION = 1
+
+
+def snapshot_path(json_file):
+    return json_file + SNAPSHOT_SUFFIX
+
+
+def content_hash(path):
+    # Only detects stale caches, so a fast hash is all we need
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_snapshot(json_file):
+    # Returns the cached tree, or None if there is no usable snapshot
+    cache = snapshot_path(json_file)
+    try:
+        with open(cache, 'rb') as f:
+            header = json.loads(f.readline())
+            st = os.stat(json_file)
+            if (header.get('version') != SNAPSHOT_VERSION
+                    or header.get('size') != st.st_size
+                    or header.get('mtime_ns') != st.st_mtime_ns
+                    or header.get('hash') != content_hash(json_file)):
+                logging.debug("Snapshot %s is stale", cache)
+                return None
+            image = f.read()
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        logging.warning("Ignoring unreadable snapshot %s", cache)
+        return None
+    # Millions of freshly allocated dicts would otherwise trigger repeated
+    # full GC passes while unmarshalling
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return marshal.loads(image)
+    except (ValueError, EOFError, TypeError):
+        logging.warning("Ignoring corrupt snapshot %s", cache)
+        return None
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def write_snapshot(json_file, directory_tree):
+    # Best effort: a missing or stale snapshot only costs a slower start
+    cache = snapshot_path(json_file)
+    try:
+        image = marshal.dumps(directory_tree)
+    except ValueError:
+        # Lazily loaded trees still hold LazyObject placeholders, compact
+        # trees hold Records and trees with pasted copies SharedObject views
+        # (see cow.py); all are loaded from the JSON instead
+        logging.debug("Not snapshotting lazy, compact or shared tree %s", json_file)
+        return False
+    try:
+        st = os.stat(json_file)
+        header = {
+            'version': SNAPSHOT_VERSION,
+            'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns,
+            'hash': content_hash(json_file),
+        }
+        tmp_file = cache + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            f.write(json.dumps(header).encode() + b'\n')
+            f.write(image)
+        os.replace(tmp_file, cache)
+    except OSError:
+        logging.warning("Could not write snapshot %s", cache)
+        return False
+    return True
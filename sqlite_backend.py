@@ -0,0 +1,309 @@
+import argparse
+import contextlib
+import json
+import sqlite3
+import weakref
+from collections.abc import MutableMapping
+
+# SQLite storage for fit-parameter trees.
+#
+# Each node of the tree is one row keyed by its full path; a directory
+# listing is an indexed range query on the parent path and editing a value is
+# a single-row UPDATE in its own transaction, so other jobs can read the
+# database while the explorer is editing it and nothing ever rewrites the
+# whole tree. SQLiteDirectory exposes a directory as a mutable mapping, which
+# is all DirectoryExplorer and apply_op need.
+#
+# Paths are the node names joined with SEP, with a leading SEP; the root is ''.
+# Leaf values are stored JSON-encoded so ints, floats, strings and None
+# round-trip exactly; 'pos' keeps the JSON key order.
+
+SEP = '\x1f'
+SQLITE_SUFFIXES = ('.sqlite', '.sqlite3', '.db')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    path   TEXT PRIMARY KEY,
+    parent TEXT NOT NULL,
+    name   TEXT NOT NULL,
+    pos    INTEGER NOT NULL,
+    kind   TEXT NOT NULL,   -- 'd' for directories, 'f' for data nodes
+    value  TEXT             -- JSON-encoded leaf value, NULL for directories
+);
+CREATE INDEX IF NOT EXISTS nodes_parent ON nodes (parent, pos);
+"""
+
+
+def is_sqlite_file(path):
+    return str(path).endswith(SQLITE_SUFFIXES)
+
+
+def child_path(parent, name):
+    return parent + SEP + name
+
+
+def subtree_bounds(path):
+    # Every descendant path lies in [path + SEP, path + chr(ord(SEP) + 1))
+    return path + SEP, path + chr(ord(SEP) + 1)
+
+
+class SQLiteStore:
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.conn = sqlite3.connect(db_file)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self._dirs = weakref.WeakValueDictionary()
+        self._batching = False
+
+    def _transaction(self):
+        # Each edit commits on its own unless it is part of a batch()
+        return contextlib.nullcontext() if self._batching else self.conn
+
+    @contextlib.contextmanager
+    def batch(self):
+        # Group many edits (e.g. a bulk edit) into a single transaction
+        self._batching = True
+        try:
+            with self.conn:
+                yield
+        finally:
+            self._batching = False
+
+    def directory(self, path=''):
+        # One SQLiteDirectory per path, so views can compare them by identity
+        node = self._dirs.get(path)
+        if node is None:
+            node = self._dirs[path] = SQLiteDirectory(self, path)
+        return node
+
+    def root(self):
+        return self.directory('')
+
+    def node(self, path):
+        return self.conn.execute(
+            "SELECT kind, value FROM nodes WHERE path = ?", (path,)).fetchone()
+
+    def value_of(self, path, kind, value):
+        return self.directory(path) if kind == 'd' else json.loads(value)
+
+    def listing(self, parent):
+        return self.conn.execute(
+            "SELECT name, kind, value FROM nodes WHERE parent = ? ORDER BY pos", (parent,))
+
+    def count(self, parent):
+        return self.conn.execute(
+            "SELECT count(*) FROM nodes WHERE parent = ?", (parent,)).fetchone()[0]
+
+    def _next_pos(self, parent):
+        return self.conn.execute(
+            "SELECT coalesce(max(pos) + 1, 0) FROM nodes WHERE parent = ?", (parent,)).fetchone()[0]
+
+    def _insert(self, parent, name, value, pos):
+        path = child_path(parent, name)
+        if isinstance(value, MutableMapping):
+            self.conn.execute("INSERT INTO nodes VALUES (?, ?, ?, ?, 'd', NULL)",
+                              (path, parent, name, pos))
+            self.conn.executemany(
+                "INSERT INTO nodes VALUES (?, ?, ?, ?, ?, ?)", self._rows(path, value))
+        else:
+            self.conn.execute("INSERT INTO nodes VALUES (?, ?, ?, ?, 'f', ?)",
+                              (path, parent, name, pos, json.dumps(value)))
+
+    def _rows(self, parent, directory):
+        # Flattened rows for everything below `directory`
+        for pos, (name, value) in enumerate(directory.items()):
+            path = child_path(parent, name)
+            if isinstance(value, MutableMapping):
+                yield path, parent, name, pos, 'd', None
+                yield from self._rows(path, value)
+            else:
+                yield path, parent, name, pos, 'f', json.dumps(value)
+
+    def _delete_subtree(self, path):
+        low, high = subtree_bounds(path)
+        self.conn.execute("DELETE FROM nodes WHERE path = ? OR (path >= ? AND path < ?)",
+                          (path, low, high))
+
+    def set(self, parent, name, value):
+        path = child_path(parent, name)
+        if isinstance(value, SQLiteDirectory):
+            value = value.to_dict()
+        with self._transaction():
+            existing = self.conn.execute(
+                "SELECT kind, pos FROM nodes WHERE path = ?", (path,)).fetchone()
+            if existing is None:
+                self._insert(parent, name, value, self._next_pos(parent))
+            elif existing[0] == 'f' and not isinstance(value, MutableMapping):
+                # The common case: one leaf changes, one row is updated
+                self.conn.execute("UPDATE nodes SET value = ? WHERE path = ?",
+                                  (json.dumps(value), path))
+            else:
+                self._delete_subtree(path)
+                self._insert(parent, name, value, existing[1])
+
+    def delete(self, parent, name):
+        path = child_path(parent, name)
+        with self._transaction():
+            if self.node(path) is None:
+                raise KeyError(name)
+            self._delete_subtree(path)
+
+    def rename(self, parent, old_name, new_name):
+        # Like dict pop+insert, the renamed key moves to the end
+        old_path = child_path(parent, old_name)
+        new_path = child_path(parent, new_name)
+        low, high = subtree_bounds(old_path)
+        cut = len(old_path) + 1
+        with self._transaction():
+            if self.node(old_path) is None:
+                raise KeyError(old_name)
+            if self.node(new_path) is not None:
+                self._delete_subtree(new_path)
+            self.conn.execute(
+                "UPDATE nodes SET path = ?, name = ?, pos = ? WHERE path = ?",
+                (new_path, new_name, self._next_pos(parent), old_path))
+            self.conn.execute(
+                "UPDATE nodes SET path = ? || substr(path, ?), parent = ? || substr(parent, ?) "
+                "WHERE path >= ? AND path < ?",
+                (new_path, cut, new_path, cut, low, high))
+
+    def move(self, parent, name, index):
+        # Give a key the position `index` among its siblings
+        path = child_path(parent, name)
+        with self._transaction():
+            row = self.conn.execute(
+                "SELECT pos FROM nodes WHERE parent = ? AND path != ? ORDER BY pos LIMIT 1 OFFSET ?",
+                (parent, path, index)).fetchone()
+            if row is None:
+                self.conn.execute("UPDATE nodes SET pos = ? WHERE path = ?",
+                                  (self._next_pos(parent), path))
+                return
+            self.conn.execute("UPDATE nodes SET pos = pos + 1 WHERE parent = ? AND pos >= ?",
+                              (parent, row[0]))
+            self.conn.execute("UPDATE nodes SET pos = ? WHERE path = ?", (row[0], path))
+
+    def import_tree(self, directory_tree):
+        # Replace the whole database with the contents of a dict tree
+        with self.conn:
+            self.conn.execute("DELETE FROM nodes")
+            self.conn.executemany(
+                "INSERT INTO nodes VALUES (?, ?, ?, ?, ?, ?)", self._rows('', directory_tree))
+
+    def export_tree(self, path=''):
+        # Rebuild nested dicts with a single scan of the subtree
+        low, high = subtree_bounds(path)
+        rows = self.conn.execute(
+            "SELECT path, parent, name, kind, value FROM nodes "
+            "WHERE path >= ? AND path < ? ORDER BY parent, pos", (low, high))
+        # A directory's row sorts before its children (its parent path is a
+        # prefix of theirs), so every parent exists by the time it is needed
+        dirs = {path: {}}
+        for node_path, parent, name, kind, value in rows:
+            if kind == 'd':
+                child = dirs[node_path] = {}
+            else:
+                child = json.loads(value)
+            dirs[parent][name] = child
+        return dirs[path]
+
+    def close(self):
+        self.conn.close()
+
+
+class SQLiteDirectory(MutableMapping):
+    def __init__(self, store, path):
+        self.store = store
+        self.path = path
+
+    def __getitem__(self, name):
+        path = child_path(self.path, name)
+        row = self.store.node(path)
+        if row is None:
+            raise KeyError(name)
+        return self.store.value_of(path, *row)
+
+    def __setitem__(self, name, value):
+        self.store.set(self.path, name, value)
+
+    def __delitem__(self, name):
+        self.store.delete(self.path, name)
+
+    def __contains__(self, name):
+        return self.store.node(child_path(self.path, name)) is not None
+
+    def __iter__(self):
+        return (name for name, _, _ in self.store.listing(self.path))
+
+    def __len__(self):
+        return self.store.count(self.path)
+
+    def keys(self):
+        return [name for name, _, _ in self.store.listing(self.path)]
+
+    def items(self):
+        return [(name, self.store.value_of(child_path(self.path, name), kind, value))
+                for name, kind, value in self.store.listing(self.path)]
+
+    def rename_key(self, old_name, new_name):
+        self.store.rename(self.path, old_name, new_name)
+
+    def move_key(self, name, index):
+        self.store.move(self.path, name, index)
+
+    def to_dict(self):
+        return self.store.export_tree(self.path)
+
+    def __repr__(self):
+        return "<SQLiteDirectory %s:%s>" % (self.store.db_file, self.path.replace(SEP, '/') or '/')
+
+
+def load_sqlite_tree(db_file):
+    return SQLiteStore(db_file).root()
+
+
+def save_sqlite_tree(db_file, directory_tree):
+    if isinstance(directory_tree, SQLiteDirectory) and directory_tree.store.db_file == db_file:
+        return  # Already persisted, one transaction per edit
+    if isinstance(directory_tree, SQLiteDirectory):
+        directory_tree = directory_tree.to_dict()
+    store = SQLiteStore(db_file)
+    try:
+        store.import_tree(directory_tree)
+    finally:
+        store.close()
+
+
+def import_json(json_file, db_file):
+    with open(json_file, 'r') as f:
+        save_sqlite_tree(db_file, json.load(f))
+
+
+def export_json(db_file, json_file):
+    store = SQLiteStore(db_file)
+    try:
+        directory_tree = store.export_tree()
+    finally:
+        store.close()
+    with open(json_file, 'w') as f:
+        json.dump(directory_tree, f, indent=4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert fit-parameter files between JSON and SQLite")
+    sub = parser.add_subparsers(dest='command', required=True)
+    imp = sub.add_parser('import', help="load a JSON file into a SQLite database")
+    imp.add_argument('json_file')
+    imp.add_argument('db_file')
+    exp = sub.add_parser('export', help="write a SQLite database back out as JSON")
+    exp.add_argument('db_file')
+    exp.add_argument('json_file')
+    args = parser.parse_args()
+    if args.command == 'import':
+        import_json(args.json_file, args.db_file)
+    else:
+        export_json(args.db_file, args.json_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+import copy
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from bench_explorer import HeadlessScreen, open_explorer  # noqa: E402
+from bulk_edit import BulkEditError, PathIndex, apply_bulk_edit, plan_bulk_edit  # noqa: E402
+from fittree import load_directory_tree, to_plain  # noqa: E402
+from journal import journal_path  # noqa: E402
+
+# Glob matching over leaf paths, the ops a command plans, and a bulk edit
+# in the explorer: one journal write and one undo step for the whole batch.
+
+
+def make_tree():
+    states = {'%dstate' % n: {'tmin': n + 2, 'tmax': 20 + n} for n in (1, 2, 3)}
+    return {'fit_ranges': {
+        'Pion': {'_1': {'SS': copy.deepcopy(states), 'SP': copy.deepcopy(states)},
+                 '_2': {'SS': {'1state': {'tmin': 'auto', 'tmax': None}}}},
+        'Kaon': {'_1': {'SS': copy.deepcopy(states)}},
+    }}
+
+
+def matched(index, pattern, base=()):
+    return ['/'.join(index.paths[i]) for i in index.match(pattern, base)]
+
+
+@pytest.mark.parametrize('pattern, expected', [
+    ('fit_ranges/Pion/_1/SS/1state/tmin', ['fit_ranges/Pion/_1/SS/1state/tmin']),
+    ('fit_ranges/*/_1/SS/1state/tmin', ['fit_ranges/Pion/_1/SS/1state/tmin', 'fit_ranges/Kaon/_1/SS/1state/tmin']),
+    ('fit_ranges/Pion/*/S?/2state/tmax', ['fit_ranges/Pion/_1/SS/2state/tmax', 'fit_ranges/Pion/_1/SP/2state/tmax']),
+    ('fit_ranges/Pion/_1/S[!S]/*/tmin', ['fit_ranges/Pion/_1/SP/%dstate/tmin' % n for n in (1, 2, 3)]),
+    ('fit_ranges/**/_2/**', ['fit_ranges/Pion/_2/SS/1state/tmin', 'fit_ranges/Pion/_2/SS/1state/tmax']),
+    ('**/1state/tmin', ['fit_ranges/Pion/_1/SS/1state/tmin', 'fit_ranges/Pion/_1/SP/1state/tmin',
+                        'fit_ranges/Pion/_2/SS/1state/tmin', 'fit_ranges/Kaon/_1/SS/1state/tmin']),
+    ('fit_ranges/Kaon/**/3state/*', ['fit_ranges/Kaon/_1/SS/3state/tmin', 'fit_ranges/Kaon/_1/SS/3state/tmax']),
+    ('fit_ranges/*/tmin', []),  # '*' stays within one component
+    ('fit_ranges/Pion/_1/SS/1state', []),  # Directories are not leaves
+])
+def test_glob_matching(pattern, expected):
+    assert matched(PathIndex(make_tree()), pattern) == expected
+
+
+def test_patterns_are_relative_to_base():
+    index = PathIndex(make_tree())
+    assert matched(index, '*/1state/tmin', base=('fit_ranges', 'Pion', '_1')) == [
+        'fit_ranges/Pion/_1/SS/1state/tmin', 'fit_ranges/Pion/_1/SP/1state/tmin']
+    assert matched(index, '/fit_ranges/Kaon/**/2state/tmin', base=('fit_ranges', 'Pion')) == [
+        'fit_ranges/Kaon/_1/SS/2state/tmin']
+
+
+def test_plan_skips_non_numeric_and_unchanged_leaves():
+    tree = make_tree()
+    ops, skipped = plan_bulk_edit(PathIndex(tree), 'fit_ranges/Pion/**/1state/tmin += 2')
+    assert ops == [{'op': 'set', 'path': ['fit_ranges', 'Pion', '_1', s, '1state', 'tmin'], 'value': 5}
+                   for s in ('SS', 'SP')]
+    assert skipped == 1  # 'auto'
+    ops, skipped = plan_bulk_edit(PathIndex(tree), 'fit_ranges/Pion/_1/SS/*/tmin = 4')
+    assert [op['path'][-2] for op in ops] == ['1state', '3state'] and not skipped
+    with pytest.raises(BulkEditError):
+        plan_bulk_edit(PathIndex(tree), '**/tmin *= x')
+
+    ops, _ = apply_bulk_edit(tree, 'fit_ranges/Kaon/**/tmax -= 10')
+    assert [state['tmax'] for state in tree['fit_ranges']['Kaon']['_1']['SS'].values()] == [11, 12, 13]
+    assert len(ops) == 3
+
+
+@pytest.fixture
+def explorer(tmp_path):
+    json_file = str(tmp_path / 'fits.json')
+    with open(json_file, 'w') as f:
+        json.dump(make_tree(), f, indent=4)
+    screen = HeadlessScreen()
+    explorer = open_explorer(load_directory_tree(json_file), json_file, screen)
+    explorer.session.saver.delay = 60  # Keep the journal until close()
+    yield explorer
+    explorer.session.close()
+    screen.close()
+
+
+def test_bulk_edit_is_one_batch_and_one_undo_step(explorer, monkeypatch):
+    before = to_plain(explorer.directory_tree)
+    journal = explorer.session.journal
+    batches = []
+    append_many = journal.append_many
+    monkeypatch.setattr(journal, 'append_many', lambda ops: (batches.append(len(ops)), append_many(ops)))
+
+    explorer.apply_bulk_edit('**/tmax += 1')  # Relative to /fit_ranges
+    assert batches == [9]
+    with open(journal_path(explorer.json_file)) as f:
+        assert len(f.read().splitlines()) == 9
+    assert len(explorer.undo.undo_steps) == 1
+    kaon = explorer.directory_tree['fit_ranges']['Kaon']['_1']['SS']
+    assert [state['tmax'] for state in kaon.values()] == [22, 23, 24]
+
+    explorer.undo_last()
+    assert to_plain(explorer.directory_tree) == before
+    assert not explorer.undo.can_undo() and len(batches) == 2
@@ -0,0 +1,147 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aggregates import Aggregates  # noqa: E402
+from fittree import to_plain  # noqa: E402
+from search import SearchIndex  # noqa: E402
+from session import TreeSession  # noqa: E402
+from undo import UndoHistory  # noqa: E402
+from validation import Validator  # noqa: E402
+
+# A pasted subtree shares its directories with its source (see cow.py), and
+# the aggregates and violations of it with theirs: an edit on either side
+# must not show through on the other, in the tree or in what is derived
+# from it, including after a move and after undo.
+
+PION = ['fit_ranges', 'Pion', '_1', 'SS']
+KAON = ['fit_ranges', 'Kaon', '_1', 'SS']
+
+
+def make_tree():
+    return {'fit_ranges': {
+        'Pion': {'_1': {'SS': {
+            '1state': {'tmin': 3, 'tmax': 21},
+            '2state': {'tmin': 4, 'tmax': 5},  # Window too short for 2 states
+            '3state': {'tmin': 5, 'tmax': None},
+        }}},
+        'Kaon': {'_1': {}},
+    }}
+
+
+@pytest.fixture
+def session(tmp_path):
+    json_file = str(tmp_path / 'fits.json')
+    with open(json_file, 'w') as f:
+        json.dump(make_tree(), f, indent=4)
+    session = TreeSession(json_file)
+    session.indexer.join()
+    yield session
+    session.close()
+
+
+def get(tree, path):
+    for key in path:
+        tree = tree[key]
+    return tree
+
+
+def summary(session, path):
+    s = session.aggregates.summary(path)
+    return s.leaves, s.fits, s.unset, dict(s.tmin), dict(s.tmax)
+
+
+def assert_consistent(session):
+    # Everything derived from the tree is what a fresh build would give
+    plain = to_plain(session.directory_tree)
+    aggregates = Aggregates(plain)
+    aggregates.build()
+    stack = [[]]
+    while stack:
+        path = stack.pop()
+        fresh, kept = aggregates.summary(path), session.aggregates.summary(path)
+        assert (kept.leaves, kept.fits, kept.unset, kept.tmin, kept.tmax) == \
+            (fresh.leaves, fresh.fits, fresh.unset, fresh.tmin, fresh.tmax), path
+        node = get(plain, path)
+        stack.extend(path + [key] for key in node if isinstance(node[key], dict))
+
+    validator = Validator(plain, extent=session.validator.extent)
+    validator.validate()
+    rules = lambda v: sorted((path, sorted(x.rule for x in violations)) for path, violations in v.items())
+    assert rules(session.validator) == rules(validator)
+    assert session.validator.count == validator.count
+
+    session.search.complete()
+    index = SearchIndex(plain)
+    index.build()
+    assert session.search.keys.postings == index.keys.postings
+    assert session.search.values.postings == index.values.postings
+
+
+def found(session, query):
+    return [list(path) for _, path in session.find(query)[0]]
+
+
+def test_editing_the_copy_leaves_the_source(session):
+    pion = summary(session, PION)
+    session.commit_many([{'op': 'copy', 'path': KAON, 'from': PION}])
+    assert summary(session, KAON) == pion
+    assert session.validator.problems(tuple(KAON + ['2state']), 'tmin')
+
+    session.commit_many([{'op': 'set', 'path': KAON + ['2state', 'tmax'], 'value': 12},
+                         {'op': 'delete', 'path': KAON + ['1state']}])
+    tree = session.directory_tree
+    assert get(tree, PION + ['2state', 'tmax']) == 5
+    assert '1state' in get(tree, PION)
+    assert summary(session, PION) == pion
+    assert session.validator.problems(tuple(PION + ['2state']), 'tmin')
+    assert not session.validator.problems(tuple(KAON + ['2state']), 'tmin')
+    assert found(session, 'tmax 12') == [KAON + ['2state', 'tmax']]
+    assert_consistent(session)
+
+
+def test_editing_the_source_leaves_the_copy(session):
+    session.commit_many([{'op': 'copy', 'path': KAON, 'from': PION}])
+    kaon = summary(session, KAON)
+    session.commit_many([{'op': 'set', 'path': PION + ['3state', 'tmax'], 'value': 30},
+                         {'op': 'rename', 'path': PION + ['1state'], 'to': 'one'}])
+    tree = session.directory_tree
+    assert get(tree, KAON + ['3state', 'tmax']) is None
+    assert list(get(tree, KAON)) == ['1state', '2state', '3state']
+    assert summary(session, KAON) == kaon
+    assert found(session, 'one') == [PION + ['one']]
+    assert_consistent(session)
+
+
+def test_move_and_undo(session):
+    before = to_plain(session.directory_tree)
+    history = UndoHistory()
+    for ops in ([{'op': 'copy', 'path': KAON, 'from': PION}, {'op': 'delete', 'path': PION}],
+                [{'op': 'set', 'path': KAON + ['1state', 'tmin'], 'value': 9}],
+                [{'op': 'copy', 'path': PION, 'from': KAON}]):
+        history.record(ops, session.commit_many(ops))
+        assert_consistent(session)
+    assert get(session.directory_tree, PION + ['1state', 'tmin']) == 9
+
+    session.commit_many([{'op': 'set', 'path': PION + ['1state', 'tmin'], 'value': 2}])
+    assert get(session.directory_tree, KAON + ['1state', 'tmin']) == 9
+    assert_consistent(session)
+
+    session.commit_many(history.pop_undo())
+    session.commit_many(history.pop_undo())
+    assert get(session.directory_tree, KAON + ['1state', 'tmin']) == 3
+    session.commit_many(history.pop_undo())
+    assert to_plain(session.directory_tree) == before
+    assert_consistent(session)
+
+
+def test_copy_into_its_own_source(session):
+    ops = [{'op': 'copy', 'path': PION + ['1state', 'again'], 'from': PION[:-1]}]
+    session.commit_many(ops)
+    session.commit_many([{'op': 'set', 'path': PION + ['1state', 'again', 'SS', '2state', 'tmax'], 'value': 40}])
+    assert get(session.directory_tree, PION + ['2state', 'tmax']) == 5
+    assert_consistent(session)
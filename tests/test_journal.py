@@ -0,0 +1,239 @@
+import copy
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fittree import get_node, load_directory_tree, save_directory_tree  # noqa: E402
+from journal import (EditJournal, apply_op, compacting_path, encode_value,  # noqa: E402
+                     journal_path, replay_journal)
+from lazy_json import LazyJSONFile  # noqa: E402
+
+# The edit journal against a plain reload of the JSON: replay after a crash
+# (with the live journal, and with one rotated aside by a compaction that
+# never landed), compaction, and the records themselves, checked against a
+# reference model of each op that keeps key order.
+
+OPS = [
+    {'op': 'set', 'path': ['fit_ranges', 'Pion', '_1', 'SS', '1state', 'tmin'], 'value': 4},
+    {'op': 'set', 'path': ['fit_ranges', 'Pion', '_1', 'SS', '4state'], 'value': {'tmin': 2, 'tmax': 9}},
+    {'op': 'set', 'path': ['fit_ranges', 'Pion', '_1', 'SS', '0state'], 'value': None, 'index': 0},
+    {'op': 'delete', 'path': ['fit_ranges', 'Pion', '_1', 'SS', '2state']},
+    {'op': 'rename', 'path': ['fit_ranges', 'Pion', '_1', 'SP'], 'to': 'PS'},
+    {'op': 'rename', 'path': ['fit_ranges', 'Pion', '_1', 'SS', '3state'], 'to': 'three', 'index': 1},
+    {'op': 'copy', 'path': ['fit_ranges', 'Kaon', '_1'], 'from': ['fit_ranges', 'Pion', '_1']},
+    {'op': 'set', 'path': ['fit_ranges', 'Kaon', '_1', 'SS', '1state', 'tmax'], 'value': 17},
+    {'op': 'copy', 'path': ['fit_ranges', 'Pion', '_2'], 'from': ['fit_ranges', 'Pion', '_1', 'PS'], 'index': 0},
+    {'op': 'delete', 'path': ['fit_ranges', 'Pion', '_1', 'PS', '1state']},
+]
+
+
+def make_tree():
+    states = {'%dstate' % n: {'tmin': n + 2, 'tmax': 20 + n} for n in (1, 2, 3)}
+    return {'fit_ranges': {
+        'Pion': {'_1': {'SS': copy.deepcopy(states), 'SP': copy.deepcopy(states)}},
+        'Kaon': {},
+    }}
+
+
+def reference(tree, op):
+    # What each record does, on plain dicts
+    *parent, name = op['path']
+    node = tree
+    for key in parent:
+        node = node[key]
+    if op['op'] == 'set':
+        node[name] = copy.deepcopy(op['value'])
+    elif op['op'] == 'copy':
+        source = tree
+        for key in op['from']:
+            source = source[key]
+        node[name] = copy.deepcopy(source)
+    elif op['op'] == 'delete':
+        del node[name]
+    elif op['op'] == 'rename':
+        node[op['to']] = node.pop(name)
+        name = op['to']
+    if op.get('index') is not None:
+        items = [(key, value) for key, value in node.items() if key != name]
+        items.insert(op['index'], (name, node[name]))
+        node.clear()
+        node.update(items)
+
+
+def expected_after(ops):
+    tree = make_tree()
+    for op in ops:
+        reference(tree, op)
+    return tree
+
+
+def text(tree):
+    # Key order matters, so trees are compared as their JSON
+    return json.dumps(tree, default=encode_value)
+
+
+def write(tmp_path, tree):
+    json_file = str(tmp_path / 'fits.json')
+    with open(json_file, 'w') as f:
+        json.dump(tree, f, indent=4)
+    return json_file
+
+
+def on_disk(json_file):
+    with open(json_file) as f:
+        return json.load(f)
+
+
+@pytest.fixture(params=['eager', 'lazy'])
+def load(request, monkeypatch):
+    # Lazily loaded trees split every fit channel out as its own span
+    if request.param == 'lazy':
+        monkeypatch.setattr(LazyJSONFile.__init__, '__defaults__', (64, False, True))
+    return lambda json_file: load_directory_tree(json_file, lazy=request.param == 'lazy')
+
+
+def test_records_match_reference(tmp_path, load):
+    json_file = write(tmp_path, make_tree())
+    tree = load(json_file)
+    for op in OPS:
+        apply_op(tree, op)
+    assert text(tree) == text(expected_after(OPS))
+
+
+def test_replay_after_crash(tmp_path, load):
+    json_file = write(tmp_path, make_tree())
+    journal = EditJournal(json_file)
+    journal.append_many(OPS[:4])
+    for op in OPS[4:]:
+        journal.append(op)
+    journal.close()  # Killed before any compaction
+
+    assert on_disk(json_file) == make_tree()
+    assert text(load(json_file)) == text(expected_after(OPS))
+
+
+def test_replay_after_crash_during_compaction(tmp_path, load):
+    json_file = write(tmp_path, make_tree())
+    tree = load(json_file)
+    journal = EditJournal(json_file)
+    for op in OPS[:6]:
+        apply_op(tree, op)
+    journal.append_many(OPS[:6])
+    snapshot, pending = journal.begin_compaction(tree)
+    assert os.path.exists(pending) and not os.path.exists(journal_path(json_file))
+    journal.append_many(OPS[6:])  # Edits keep coming while the JSON is written
+    journal.close()  # Killed before finish_compaction
+
+    assert text(load(json_file)) == text(expected_after(OPS))
+
+
+def test_stale_rotated_journal_is_ignored(tmp_path, load):
+    # The compacted JSON landed but the rotated journal was not removed yet:
+    # its records are in the JSON, and the base it names is no longer there
+    json_file = write(tmp_path, make_tree())
+    tree = load(json_file)
+    journal = EditJournal(json_file)
+    for op in OPS[:6]:
+        apply_op(tree, op)
+    journal.append_many(OPS[:6])
+    snapshot, pending = journal.begin_compaction(tree)
+    journal._write_json(snapshot)
+    journal.append_many(OPS[6:])
+    journal.close()
+
+    assert os.path.exists(compacting_path(json_file))
+    assert text(load(json_file)) == text(expected_after(OPS))
+
+
+def test_torn_last_record_is_dropped(tmp_path, load):
+    json_file = write(tmp_path, make_tree())
+    journal = EditJournal(json_file)
+    journal.append_many(OPS[:3])
+    journal.close()
+    with open(journal_path(json_file), 'a') as f:
+        f.write('{"op":"set","path":["fit_ranges","Ka')
+    assert text(load(json_file)) == text(expected_after(OPS[:3]))
+
+
+def test_skipped_records_are_not_counted(tmp_path):
+    json_file = write(tmp_path, make_tree())
+    journal = EditJournal(json_file)
+    journal.append_many([OPS[0], {'op': 'delete', 'path': ['fit_ranges', 'missing']}, OPS[1]])
+    journal.close()
+    with open(json_file) as f:
+        tree = json.load(f)
+    assert replay_journal(json_file, tree) == 2
+    assert text(tree) == text(expected_after(OPS[:2]))
+
+
+def test_compaction_matches_eager_save(tmp_path, load):
+    json_file = write(tmp_path, make_tree())
+    tree = load(json_file)
+    journal = EditJournal(json_file)
+    for op in OPS:
+        apply_op(tree, op)
+        journal.append(op)
+    snapshot, pending = journal.begin_compaction(tree)
+    journal.finish_compaction(snapshot, pending)
+    journal.close()
+
+    eager_file = str(tmp_path / 'eager.json')
+    save_directory_tree(eager_file, expected_after(OPS))
+    with open(json_file) as compacted, open(eager_file) as eager:
+        assert compacted.read() == eager.read()
+    assert not os.path.exists(journal_path(json_file))
+    assert not os.path.exists(compacting_path(json_file))
+    assert text(load(json_file)) == text(expected_after(OPS))
+
+
+def test_snapshot_is_not_changed_by_later_edits(tmp_path, load):
+    json_file = write(tmp_path, make_tree())
+    tree = load(json_file)
+    journal = EditJournal(json_file)
+    new = {'op': 'set', 'path': ['fit_ranges', 'Kaon', '_1'], 'value': {'SS': {'1state': {'tmin': 1}}}}
+    for op in OPS[:6] + [new]:
+        apply_op(tree, op)
+        journal.append(op)
+    snapshot, pending = journal.begin_compaction(tree)
+    frozen = text(snapshot)
+
+    # Edits while the snapshot is written: below what it holds, and below a
+    # value that is put back by a redo of the op that set it
+    later = [OPS[7], {'op': 'delete', 'path': ['fit_ranges', 'Kaon', '_1']}, new,
+             {'op': 'set', 'path': ['fit_ranges', 'Kaon', '_1', 'SS', '1state', 'tmin'], 'value': 8},
+             {'op': 'rename', 'path': ['fit_ranges', 'Pion', '_1', 'SS'], 'to': 'SP'}]
+    for op in later:
+        apply_op(tree, op)
+        journal.append(op)
+    assert text(snapshot) == frozen
+    assert new['value'] == {'SS': {'1state': {'tmin': 1}}}
+    journal.finish_compaction(snapshot, pending)
+    journal.close()
+
+    assert json.dumps(on_disk(json_file)) == frozen
+    assert text(load(json_file)) == text(tree)
+
+
+def test_unedited_spans_are_written_back_raw(tmp_path, monkeypatch):
+    monkeypatch.setattr(LazyJSONFile.__init__, '__defaults__', (64, False, True))
+    kaon = '{"_1": {"SS": {"1state": {"tmin": 3.0, "tmax": 2.1e1}, "2state": {"tmin": 4, "tmax": 22}}}}'
+    json_file = str(tmp_path / 'fits.json')
+    with open(json_file, 'w') as f:
+        f.write('{\n    "fit_ranges": {\n        "Pion": %s,\n        "Kaon": %s\n    }\n}'
+                % (json.dumps(make_tree()['fit_ranges']['Pion'], indent=4).replace('\n', '\n        '), kaon))
+    tree = load_directory_tree(json_file, lazy=True)
+    assert get_node(tree, ['fit_ranges', 'Kaon', '_1', 'SS', '1state', 'tmin']) == 3.0  # Parsed, not edited
+    journal = EditJournal(json_file)
+    apply_op(tree, OPS[0])
+    journal.append(OPS[0])
+    snapshot, pending = journal.begin_compaction(tree)
+    journal.finish_compaction(snapshot, pending)
+    journal.close()
+
+    with open(json_file) as f:
+        assert '"Kaon": ' + kaon in f.read()
+    assert on_disk(json_file)['fit_ranges']['Pion']['_1']['SS']['1state']['tmin'] == 4
@@ -0,0 +1,83 @@
+import io
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from journal import apply_op, encode_value  # noqa: E402
+from lazy_json import LazyJSONFile, LazyObject, dump_tree, resolve  # noqa: E402
+
+# Saves splice unparsed spans back in as raw bytes; after a move to another
+# depth they have to come out as json.dump(indent=4) would write them, and
+# load back to the same tree.
+
+MIN_SPAN = 64  # Small enough that every fit channel below is its own span
+
+
+def make_tree():
+    return {'fit_ranges': {
+        'Pion': {'_1': {'SS': {'%dstate' % n: {'tmin': n + 2, 'tmax': 20 + n} for n in (1, 2, 3)}}},
+        'Kaon': {},
+    }}
+
+
+def write(tmp_path, tree):
+    json_file = str(tmp_path / 'fits.json')
+    with open(json_file, 'w') as f:
+        json.dump(tree, f, indent=4)
+    return json_file
+
+
+def plain(tree):
+    return json.loads(json.dumps(tree, default=encode_value))
+
+
+def dumped(tree):
+    out = io.StringIO()
+    dump_tree(tree, out)
+    return out.getvalue()
+
+
+def load(json_file):
+    source = LazyJSONFile(json_file, min_span=MIN_SPAN)
+    return source, source.load_root()
+
+
+def move(tree, source, target):
+    apply_op(tree, {'op': 'copy', 'path': target, 'from': source})
+    apply_op(tree, {'op': 'delete', 'path': source})
+
+
+def test_unedited_save_is_byte_identical(tmp_path):
+    json_file = write(tmp_path, make_tree())
+    source, tree = load(json_file)
+    assert isinstance(tree['fit_ranges'], LazyObject)
+    with open(json_file) as f:
+        assert dumped(tree) == f.read()
+    source.close()
+
+
+def test_moved_subtree_round_trips(tmp_path):
+    expected = make_tree()
+    json_file = write(tmp_path, expected)
+    source, tree = load(json_file)
+    fit_ranges = resolve(tree, 'fit_ranges')
+    resolve(fit_ranges, 'Pion')
+    assert isinstance(fit_ranges['Pion']['_1'], LazyObject)
+
+    # Deeper, then shallower than where the unparsed span was written
+    move(tree, ['fit_ranges', 'Pion', '_1'], ['fit_ranges', 'Kaon', '_1'])
+    move(tree, ['fit_ranges', 'Kaon', '_1'], ['moved'])
+    expected['moved'] = expected['fit_ranges']['Pion'].pop('_1')
+    assert plain(tree) == expected
+
+    text = dumped(tree)
+    assert text == json.dumps(expected, indent=4)
+    source.close()
+
+    with open(json_file, 'w') as f:
+        f.write(text)
+    source, tree = load(json_file)
+    assert plain(tree) == expected
+    source.close()
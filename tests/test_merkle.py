@@ -0,0 +1,151 @@
+import copy
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fittree import get_node, load_directory_tree, save_directory_tree, to_plain  # noqa: E402
+from journal import apply_op, journal_path  # noqa: E402
+from lazy_json import LazyJSONFile  # noqa: E402
+from merkle import MerkleTree, diff_trees  # noqa: E402
+from session import TreeSession  # noqa: E402
+from undo import UndoHistory, invert_op  # noqa: E402
+
+# Subtree hashes kept up to date op by op must be the hashes of the tree
+# as it is; diff_trees must report every kind of difference; and a save
+# that the hashes skip or splices clean spans into must leave the JSON
+# exactly as a full save of the same tree would.
+
+OPS = {
+    'set': {'op': 'set', 'path': ['fit_ranges', 'Pion', '_1', 'SS', '1state', 'tmin'], 'value': 4},
+    'set new': {'op': 'set', 'path': ['fit_ranges', 'Pion', '_1', 'SS', '4state'], 'value': {'tmin': 2}},
+    'delete': {'op': 'delete', 'path': ['fit_ranges', 'Pion', '_1', 'SP', '2state']},
+    'rename': {'op': 'rename', 'path': ['fit_ranges', 'Pion', '_1', 'SS', '3state'], 'to': 'three'},
+    'rename at index': {'op': 'rename', 'path': ['fit_ranges', 'Pion', '_1', 'SP'], 'to': 'PS', 'index': 0},
+    'copy': {'op': 'copy', 'path': ['fit_ranges', 'Kaon', '_1'], 'from': ['fit_ranges', 'Pion', '_1']},
+    'edit copy': {'op': 'set', 'path': ['fit_ranges', 'Kaon', '_1', 'SS', '2state', 'tmax'], 'value': 9},
+}
+
+
+def make_tree():
+    states = {'%dstate' % n: {'tmin': n + 2, 'tmax': 20 + n} for n in (1, 2, 3)}
+    return {'fit_ranges': {
+        'Pion': {'_1': {'SS': copy.deepcopy(states), 'SP': copy.deepcopy(states)}},
+        'Kaon': {},
+    }}
+
+
+def write(tmp_path, tree):
+    json_file = str(tmp_path / 'fits.json')
+    with open(json_file, 'w') as f:
+        json.dump(tree, f, indent=4)
+    return json_file
+
+
+def directories(tree, path=()):
+    # Every directory path in the tree, parsing as it goes
+    yield path
+    node = get_node(tree, path)
+    for key in list(node.keys()):
+        if isinstance(get_node(tree, path + (key,)), dict):
+            yield from directories(tree, path + (key,))
+
+
+@pytest.fixture(params=['eager', 'lazy'])
+def load(request, monkeypatch):
+    # Lazily loaded trees split every fit channel out as its own span
+    if request.param == 'lazy':
+        monkeypatch.setattr(LazyJSONFile.__init__, '__defaults__', (64, False, True))
+    return lambda json_file: load_directory_tree(json_file, lazy=request.param == 'lazy')
+
+
+def parsed(tree):
+    # An unparsed span hashes by its bytes and differently once parsed (see
+    # merkle.py); parse it all up front, as building a session does
+    list(directories(tree))
+    return tree
+
+
+def test_incremental_digests_match_fresh(tmp_path, load):
+    tree = parsed(load(write(tmp_path, make_tree())))
+    merkle = MerkleTree(tree)
+    merkle.digest()
+    for name, op in OPS.items():
+        merkle.before(op)
+        apply_op(tree, op)
+        merkle.apply(op)
+        fresh = MerkleTree(tree)
+        for path in directories(tree):
+            assert merkle.digest(path) == fresh.digest(path), (name, path)
+    assert merkle.changed()
+
+
+def test_edits_that_cancel_out_are_unchanged(tmp_path, load):
+    tree = parsed(load(write(tmp_path, make_tree())))
+    merkle = MerkleTree(tree)
+    history = UndoHistory()
+    for op in OPS.values():
+        inverse = invert_op(tree, op)
+        merkle.before(op)
+        apply_op(tree, op)
+        merkle.apply(op)
+        history.record([op], [inverse])
+    while history.can_undo():
+        for op in history.pop_undo():
+            merkle.before(op)
+            apply_op(tree, op)
+            merkle.apply(op)
+    assert not merkle.changed()
+
+
+def test_diff_reports_every_kind_of_change():
+    old, new = make_tree(), make_tree()
+    pion = new['fit_ranges']['Pion']['_1']
+    pion['SS']['1state']['tmin'] = 7  # changed
+    del pion['SP']['2state']  # removed
+    new['fit_ranges']['Kaon']['_1'] = {}  # added
+    pion['SS'] = {key: pion['SS'][key] for key in ('2state', '1state', '3state')}  # reordered
+    changes = diff_trees(MerkleTree(old), MerkleTree(new))
+    assert sorted((kind, path) for kind, path, _, _ in changes) == [
+        ('added', ['fit_ranges', 'Kaon', '_1']),
+        ('changed', ['fit_ranges', 'Pion', '_1', 'SS', '1state', 'tmin']),
+        ('removed', ['fit_ranges', 'Pion', '_1', 'SP', '2state']),
+        ('reordered', ['fit_ranges', 'Pion', '_1', 'SS']),
+    ]
+    assert ('changed', ['fit_ranges', 'Pion', '_1', 'SS', '1state', 'tmin'], 3, 7) in changes
+    assert diff_trees(MerkleTree(old), MerkleTree(make_tree())) == []
+
+
+def test_skipped_and_clean_span_saves_match_a_full_save(tmp_path, load):
+    json_file = write(tmp_path, make_tree())
+    with open(json_file, 'rb') as f:
+        original = f.read()
+    mtime = os.stat(json_file).st_mtime_ns
+
+    # Edits that cancel out: the save is skipped and the file left alone
+    session = TreeSession(json_file, load(json_file))
+    session.indexer.join()
+    get_node(session.directory_tree, ['fit_ranges', 'Pion', '_1', 'SP', '1state'])  # Parsed, not edited
+    history = UndoHistory()
+    ops = [OPS['set'], OPS['rename']]
+    history.record(ops, session.commit_many(ops))
+    session.commit_many(history.pop_undo())
+    session.close()
+    assert os.stat(json_file).st_mtime_ns == mtime
+    assert not os.path.exists(journal_path(json_file))
+    with open(json_file, 'rb') as f:
+        assert f.read() == original
+
+    # A real edit: clean spans are spliced in raw, the rest re-encoded
+    session = TreeSession(json_file, load(json_file))
+    session.indexer.join()
+    session.commit_many([OPS['set'], OPS['copy']])
+    tree = to_plain(session.directory_tree)
+    session.close()
+    full_file = str(tmp_path / 'full.json')
+    save_directory_tree(full_file, tree)
+    with open(json_file, 'rb') as saved, open(full_file, 'rb') as full:
+        assert saved.read() == full.read()
@@ -0,0 +1,59 @@
+import json
+import os
+import random
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from fittree import to_plain  # noqa: E402
+from search import SearchIndex  # noqa: E402
+from session import TreeSession  # noqa: E402
+from synthetic import make_shaped_tree  # noqa: E402
+
+# The search index is built on a thread of its own while edits go on under
+# the session lock (see TreeSession._build_index); once it is in place it
+# must hold what a build of the edited tree from scratch would, and find()
+# must not wait for it meanwhile.
+
+
+def edits(rnd, tree, step):
+    # A random op on an existing directory of the synthetic tree, which is
+    # only edited from this thread
+    a = rnd.choice(list(tree['fit_ranges']))
+    b = rnd.choice(list(tree['fit_ranges'][a]))
+    kind = rnd.randrange(4)
+    if kind == 0:
+        return [{'op': 'set', 'path': ['fit_ranges', a, b, 'new%d' % step], 'value': {'tmin': step}}]
+    if kind == 1:
+        return [{'op': 'set', 'path': ['fit_ranges', a, b, 'tmax'], 'value': 'x%d' % step}]
+    if kind == 2:
+        return [{'op': 'copy', 'path': ['fit_ranges', a, 'copy%d' % step], 'from': ['fit_ranges', a, b]}]
+    return [{'op': 'rename', 'path': ['fit_ranges', a, b], 'to': 'renamed%d' % step}]
+
+
+def test_index_built_during_edits_matches_fresh_build(tmp_path):
+    json_file = str(tmp_path / 'fits.json')
+    with open(json_file, 'w') as f:
+        json.dump(make_shaped_tree(20, 3, 4), f)
+    built = threading.Event()
+    session = TreeSession(json_file, on_indexed=built.set)
+    rnd = random.Random(0)
+    during = 0
+    step = 0
+    while not built.is_set() and step < 5000:
+        session.commit_many(edits(rnd, session.directory_tree, step))
+        if session.find('tmin') is None:
+            during += 1
+        step += 1
+    assert built.wait(60)
+    assert during, "no edit was made while the index was being built"
+    assert session.find('tmin') is not None
+
+    index = SearchIndex(to_plain(session.directory_tree))
+    index.build()
+    session.search.complete()
+    assert session.search.keys.postings == index.keys.postings
+    assert session.search.values.postings == index.values.postings
+    session.close()
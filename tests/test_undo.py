@@ -0,0 +1,112 @@
+import copy
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fittree import load_directory_tree  # noqa: E402
+from journal import apply_op, encode_value  # noqa: E402
+from undo import UndoHistory, invert_op  # noqa: E402
+
+# Undo and redo of every kind of journal op must give back the tree exactly,
+# key order included, whether the directories are dicts, compact Records or
+# shared copies (see cow.py).
+
+OPS = {
+    'set': {'op': 'set', 'path': ['fit_ranges', 'Pion', 'SS', '2state', 'tmin'], 'value': 7},
+    'set new': {'op': 'set', 'path': ['fit_ranges', 'Pion', 'SS', '4state'], 'value': {'tmin': 1}},
+    'set at index': {'op': 'set', 'path': ['fit_ranges', 'Pion', 'SS', '0state'], 'value': {}, 'index': 0},
+    'delete first': {'op': 'delete', 'path': ['fit_ranges', 'Pion', 'SS', '1state']},
+    'delete middle': {'op': 'delete', 'path': ['fit_ranges', 'Pion', 'SS', '2state']},
+    'delete last': {'op': 'delete', 'path': ['fit_ranges', 'Pion', 'SS', '3state']},
+    'rename': {'op': 'rename', 'path': ['fit_ranges', 'Pion', 'SS', '1state'], 'to': 'one'},
+    'rename at index': {'op': 'rename', 'path': ['fit_ranges', 'Pion', 'SS', '3state'], 'to': 'three', 'index': 0},
+    'rename over': {'op': 'rename', 'path': ['fit_ranges', 'Pion', 'SS', '1state'], 'to': '3state'},
+    'rename over at index': {'op': 'rename', 'path': ['fit_ranges', 'Pion', 'SS', '3state'], 'to': '1state',
+                             'index': 1},
+    'copy': {'op': 'copy', 'path': ['fit_ranges', 'Kaon', 'SS'], 'from': ['fit_ranges', 'Pion', 'SS']},
+    'copy over': {'op': 'copy', 'path': ['fit_ranges', 'Pion', 'SP'], 'from': ['fit_ranges', 'Pion', 'SS'],
+                  'index': 0},
+    'edit shared': {'op': 'set', 'path': ['fit_ranges', 'Pion', 'SP', '1state', 'tmax'], 'value': 30},
+    'delete shared': {'op': 'delete', 'path': ['fit_ranges', 'Pion', 'SP', '2state']},
+}
+
+
+def make_tree():
+    states = {'%dstate' % n: {'tmin': n + 2, 'tmax': 20 + n} for n in (1, 2, 3)}
+    return {'fit_ranges': {
+        'Pion': {'SS': copy.deepcopy(states), 'SP': {'1state': {'tmin': 5, 'tmax': 25}}},
+        'Kaon': {},
+    }}
+
+
+def text(tree):
+    # Key order matters, so trees are compared as their JSON
+    return json.dumps(tree, default=encode_value)
+
+
+@pytest.fixture(params=['dicts', 'records', 'shared'])
+def tree(request, tmp_path):
+    json_file = str(tmp_path / 'fits.json')
+    with open(json_file, 'w') as f:
+        json.dump(make_tree(), f, indent=4)
+    directory_tree = load_directory_tree(json_file, lazy=False, compact=request.param == 'records')
+    if request.param == 'shared':
+        # Every directory under Pion is a view shared with the copy
+        apply_op(directory_tree, {'op': 'copy', 'path': ['copy'], 'from': ['fit_ranges', 'Pion']})
+        apply_op(directory_tree, {'op': 'copy', 'path': ['fit_ranges', 'Pion'], 'from': ['copy']})
+        apply_op(directory_tree, {'op': 'delete', 'path': ['copy']})
+    return directory_tree
+
+
+def commit(history, directory_tree, ops):
+    inverses = []
+    for op in ops:
+        inverses.append(invert_op(directory_tree, op))
+        apply_op(directory_tree, op)
+    history.record(ops, inverses)
+
+
+def replay(directory_tree, ops):
+    for op in ops:
+        apply_op(directory_tree, op)
+
+
+@pytest.mark.parametrize('name', list(OPS))
+def test_undo_redo_round_trip(tree, name):
+    ops = [OPS[name]]
+    if name.endswith('shared'):
+        ops.insert(0, OPS['copy over'])
+    before = text(tree)
+    history = UndoHistory()
+    commit(history, tree, ops)
+    after = text(tree)
+    assert after != before
+
+    replay(tree, history.pop_undo())
+    assert text(tree) == before
+    replay(tree, history.pop_redo())
+    assert text(tree) == after
+    replay(tree, history.pop_undo())
+    assert text(tree) == before
+
+
+def test_steps_undo_in_order(tree):
+    history = UndoHistory()
+    states = [text(tree)]
+    for name in ('delete middle', 'copy', 'rename at index', 'edit shared', 'set at index'):
+        ops = [OPS['copy over'], OPS[name]] if name.endswith('shared') else [OPS[name]]
+        commit(history, tree, ops)
+        states.append(text(tree))
+
+    for state in reversed(states[:-1]):
+        replay(tree, history.pop_undo())
+        assert text(tree) == state
+    assert not history.can_undo()
+    for state in states[1:]:
+        replay(tree, history.pop_redo())
+        assert text(tree) == state
+    assert not history.can_redo()
@@ -0,0 +1,172 @@
+import copy
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import watcher  # noqa: E402
+from fittree import get_node, load_directory_tree, read_directory_tree, to_plain  # noqa: E402
+from journal import encode_value, file_signature  # noqa: E402
+from lazy_json import LazyJSONFile  # noqa: E402
+from session import TreeSession  # noqa: E402
+from watcher import FileWatcher, plan_merge  # noqa: E402
+
+# Changes another program makes to an open file, merged back with
+# plan_merge: edits away from ours become ops, edits where we have unsaved
+# changes are conflicts, and reading the file leaves nothing behind on disk.
+
+PION = ['fit_ranges', 'Pion', '_1', 'SS']
+KAON = ['fit_ranges', 'Kaon', '_1', 'SS']
+
+
+def make_tree():
+    states = {'%dstate' % n: {'tmin': n + 2, 'tmax': 20 + n} for n in (1, 2, 3)}
+    return {'fit_ranges': {
+        'Pion': {'_1': {'SS': copy.deepcopy(states)}},
+        'Kaon': {'_1': {'SS': copy.deepcopy(states)}},
+    }}
+
+
+def get(tree, path):
+    for key in path:
+        tree = tree[key]
+    return tree
+
+
+def text(tree):
+    # Key order matters, so trees are compared as their JSON
+    return json.dumps(to_plain(tree), default=encode_value)
+
+
+def rewrite(json_file, tree):
+    # Another program replaces the file (a lazy session still reads the old
+    # one); bump the mtime so the change shows within the filesystem's
+    # timestamp resolution
+    st = os.stat(json_file)
+    with open(json_file + '.tmp', 'w') as f:
+        json.dump(tree, f, indent=4)
+    os.replace(json_file + '.tmp', json_file)
+    os.utime(json_file, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+
+@pytest.fixture(params=['eager', 'lazy'])
+def lazy(request, monkeypatch):
+    # Lazily loaded trees split every fit channel out as its own span
+    if request.param == 'lazy':
+        monkeypatch.setattr(LazyJSONFile.__init__, '__defaults__', (64, False, True))
+    return request.param == 'lazy'
+
+
+@pytest.fixture
+def session(tmp_path, lazy):
+    json_file = str(tmp_path / 'fits.json')
+    with open(json_file, 'w') as f:
+        json.dump(make_tree(), f, indent=4)
+    session = TreeSession(json_file, load_directory_tree(json_file, lazy=lazy))
+    session.indexer.join()
+    yield session
+    session.close()
+
+
+def merge(session, lazy):
+    # What the watcher does on its thread, and then on the UI thread
+    other_tree, source = read_directory_tree(session.json_file, lazy=lazy)
+    try:
+        ops, conflicts = plan_merge(session, other_tree)
+    finally:
+        if source is not None:
+            source.close()
+    session.merge_external(ops, file_signature(session.json_file))
+    return ops, conflicts
+
+
+def test_external_edits_are_merged(session, lazy):
+    theirs = make_tree()
+    get(theirs, KAON)['1state']['tmax'] = 40
+    get(theirs, PION)['4state'] = {'tmin': 6, 'tmax': None}
+    del get(theirs, KAON)['2state']
+    rewrite(session.json_file, theirs)
+
+    ops, conflicts = merge(session, lazy)
+    assert not conflicts
+    assert sorted(op['op'] for op in ops) == ['delete', 'set', 'set']
+    assert text(session.directory_tree) == text(theirs)
+    assert not session.merkle.changed()
+
+
+def test_overlapping_edit_is_a_conflict(session, lazy):
+    theirs = make_tree()
+    get(theirs, PION)['1state']['tmin'] = 5
+    get(theirs, KAON)['1state']['tmax'] = 40
+    rewrite(session.json_file, theirs)
+    session.commit_many([{'op': 'set', 'path': PION + ['1state', 'tmin'], 'value': 9}])
+
+    ops, conflicts = merge(session, lazy)
+    assert ops == [{'op': 'set', 'path': KAON + ['1state', 'tmax'], 'value': 40}]
+    assert conflicts == [('changed', PION + ['1state', 'tmin'], 9, 5)]
+    assert get(session.directory_tree, PION + ['1state', 'tmin']) == 9
+    assert get(session.directory_tree, KAON + ['1state', 'tmax']) == 40
+    assert session.merkle.changed()  # Our edit is still to be saved
+
+
+def test_reorder_is_merged_in_file_order(session, lazy):
+    theirs = make_tree()
+    states = get(theirs, PION)
+    get(theirs, PION[:-1])['SS'] = {key: states[key] for key in ('3state', '1state', '2state')}
+    get(theirs, PION)['1state']['tmin'] = 8
+    rewrite(session.json_file, theirs)
+
+    ops, conflicts = merge(session, lazy)
+    assert not conflicts
+    assert all(op['op'] == 'set' for op in ops)
+    assert list(get(session.directory_tree, PION)) == ['3state', '1state', '2state']
+    assert text(session.directory_tree) == text(theirs)
+
+
+def test_read_writes_nothing_and_closes_the_file(session, lazy, monkeypatch):
+    theirs = make_tree()
+    get(theirs, KAON)['3state']['tmin'] = 1
+    rewrite(session.json_file, theirs)
+    directory = os.path.dirname(session.json_file)
+    before = {name: os.stat(os.path.join(directory, name)).st_mtime_ns for name in os.listdir(directory)}
+
+    sources = []
+
+    def read(json_file):
+        other_tree, source = read_directory_tree(json_file, lazy=lazy)
+        sources.append(source)
+        return other_tree, source
+    monkeypatch.setattr(watcher, 'read_directory_tree', read)
+    files = FileWatcher(None, lambda: [('', session)], None)
+    files._read('', session, file_signature(session.json_file))
+    prefix, _, signature, (ops, conflicts) = files.results.get_nowait()
+
+    assert ops == [{'op': 'set', 'path': KAON + ['3state', 'tmin'], 'value': 1}] and not conflicts
+    after = {name: os.stat(os.path.join(directory, name)).st_mtime_ns for name in os.listdir(directory)}
+    assert after == before
+    if lazy:
+        assert sources[0].data.closed
+
+
+def test_unchanged_spans_are_not_parsed(session, lazy, monkeypatch):
+    if not lazy:
+        pytest.skip("eager files have no spans")
+    get_node(session.directory_tree, PION + ['1state'])  # Browsed, so parsed here
+    theirs = make_tree()
+    get(theirs, KAON)['2state']['tmax'] = 30
+    rewrite(session.json_file, theirs)
+
+    parsed = []
+    parse = LazyJSONFile.parse
+
+    def counting(self, path, start, end):
+        parsed.append(path)
+        return parse(self, path, start, end)
+    monkeypatch.setattr(LazyJSONFile, 'parse', counting)
+    ops, conflicts = merge(session, lazy)
+
+    assert ops == [{'op': 'set', 'path': KAON + ['2state', 'tmax'], 'value': 30}]
+    assert parsed and not [path for path in parsed if path[:2] == tuple(PION[:2])]
@@ -0,0 +1,112 @@
+from collections import deque
+
+from cow import SharedObject
+from journal import lookup_parent
+
+# Undo/redo for explorer edits.
+#
+# Each step keeps the journal ops that made it plus their inverse ops, which
+# are computed against the tree just before the ops are applied. Inverses
+# hold the replaced or deleted values by reference rather than copying the
+# tree, so a step costs memory proportional to the edit, and undoing or
+# redoing it is just another commit of a few ops (O(depth) to find each
+# parent directory). Because undo and redo go through the normal commit path
+# they are journaled and saved like any other edit.
+#
+# A delete or rename also records where the key stood, so undo puts it back
+# in place. Finding that position is O(1) for the last key of a directory
+# (new fits are appended, so that is the usual case) and otherwise walks the
+# keys in front of it; restoring a key in the middle re-appends the keys
+# after it (see move_key in journal.py). Both are O(width) of the one
+# directory at worst, and never paid for keys at the end.
+
+UNDO_LIMIT = 1000  # Steps kept before the oldest are forgotten
+
+
+def detach(value):
+    # A value that stays valid once it is no longer in the tree: SQLite
+    # directories are views on rows that a delete removes, so copy those out
+    if hasattr(value, 'to_dict'):
+        return value.to_dict()
+    return value
+
+
+def key_index(node, name, skip=None):
+    # Position of a key in its directory (ignoring `skip`), or None when it
+    # is the last one (the common case, and what a plain set/rename restores)
+    if type(node) is SharedObject:
+        node = node.data
+    if not isinstance(node, dict):
+        keys = [key for key in node if key != skip]  # Small records, SQLite
+        index = keys.index(name)
+        return None if index == len(keys) - 1 else index
+    if next((key for key in reversed(node) if key != skip), None) == name:
+        return None
+    index = 0
+    for key in node:
+        if key == name:
+            return index
+        if key != skip:
+            index += 1
+    raise KeyError(name)
+
+
+def invert_op(directory_tree, op):
+    # The ops that undo `op`, to be computed before `op` is applied
+    path = list(op['path'])
+    name = path[-1]
+    parent = lookup_parent(directory_tree, path)
+    kind = op['op']
+    if kind in ('set', 'copy'):
+        if name in parent:
+            inverse = {'op': 'set', 'path': path, 'value': detach(parent[name])}
+            if op.get('index') is not None:
+                # The op moves the key too; a plain set would leave it there
+                index = key_index(parent, name)
+                inverse['index'] = len(parent) - 1 if index is None else index
+            return [inverse]
+        return [{'op': 'delete', 'path': path}]
+    if kind == 'delete':
+        return [{'op': 'set', 'path': path, 'value': detach(parent[name]),
+                 'index': key_index(parent, name)}]
+    if kind == 'rename':
+        target = op['to']
+        overwrites = target in parent and target != name
+        inverse = [{'op': 'rename', 'path': path[:-1] + [target], 'to': name,
+                    'index': key_index(parent, name, skip=target if overwrites else None)}]
+        if overwrites:
+            # The rename overwrote an existing key; bring that back too
+            inverse.append({'op': 'set', 'path': path[:-1] + [target],
+                            'value': detach(parent[target]), 'index': key_index(parent, target)})
+        return inverse
+    raise ValueError("Unknown journal op: %r" % (kind,))
+
+
+class UndoHistory:
+    def __init__(self, limit=UNDO_LIMIT):
+        self.undo_steps = deque(maxlen=limit)
+        self.redo_steps = []
+
+    def record(self, ops, inverses):
+        # One step per commit; `inverses` holds the inverse ops of each op
+        undo_ops = [inverse for step in reversed(inverses) for inverse in step]
+        self.undo_steps.append((list(ops), undo_ops))
+        self.redo_steps.clear()
+
+    def can_undo(self):
+        return bool(self.undo_steps)
+
+    def can_redo(self):
+        return bool(self.redo_steps)
+
+    def pop_undo(self):
+        # The ops that revert the most recent step
+        step = self.undo_steps.pop()
+        self.redo_steps.append(step)
+        return step[1]
+
+    def pop_redo(self):
+        # The ops that reapply the most recently undone step
+        step = self.redo_steps.pop()
+        self.undo_steps.append(step)
+        return step[0]
@@ -0,0 +1,300 @@
+import functools
+import os
+import re
+from collections.abc import Mapping
+
+from bulk_edit import glob_to_regex
+from cow import unshared
+from lazy_json import LazyObject
+
+# Validation of fit ranges.
+#
+# A rule applies to every fit directory (one holding 'tmin' or 'tmax') whose
+# path matches its glob pattern (same syntax as bulk edits, see bulk_edit.py)
+# and states an invariant as a Python expression over:
+#
+#   tmin, tmax   the values in the directory (None when missing)
+#   nstates      N for a directory named 'Nstate', else None
+#   extent       the time extent of the lattice, if known (see LATTICE_EXTENTS)
+#
+# A rule is only checked when every name in `needs` is a number; `keys` are
+# the leaves its violations are shown next to. All rules are compiled into a
+# single generated function once, and each directory is checked with one
+# call to it.
+#
+# Validator.validate checks the whole tree when a file is loaded (subtrees
+# that are not parsed yet are checked when they are, see visit). After that,
+# apply(op) re-checks only what an op touched: one directory for a value
+# edit, the inserted subtree for a structural one. Violations are kept in a
+# trie keyed by path, so dropping a deleted subtree's is a single pop.
+#
+# A pasted subtree (a copy op) is not checked again when no rule looks past
+# the name of a directory: below its top directory it holds what its source
+# does under the same names, so the source's part of the trie is copied
+# over instead, at the cost of the violations in it rather than of the
+# subtree.
+
+FIT_KEYS = ('tmin', 'tmax')
+LATTICE_EXTENTS = {  # Time extent by ensemble name, for files that do not record 'Nt'
+    'a09m135': 96,
+}
+_NSTATE = re.compile(r'^(\d+)state$')
+_LEAVES = frozenset((int, float, str, bool, type(None), list))
+
+
+class Rule:
+    def __init__(self, name, pattern, needs, expression, message, keys):
+        self.name = name
+        self.pattern = pattern
+        self.needs = needs
+        self.expression = expression
+        self.message = message
+        self.keys = keys
+        self.regex = None if pattern == '**' else re.compile('^' + glob_to_regex(pattern) + '$')
+        # True if the pattern only looks at the name of the directory
+        self.local = pattern == '**' or (pattern.startswith('**/') and '/' not in pattern[3:])
+
+
+RULES = [
+    Rule('integer', '**', (), "(tmin is None or type(tmin) is int) and (tmax is None or type(tmax) is int)",
+         "tmin and tmax must be integers", FIT_KEYS),
+    Rule('negative_tmin', '**', ('tmin',), "tmin >= 0", "tmin is negative", ('tmin',)),
+    Rule('negative_tmax', '**', ('tmax',), "tmax >= 0", "tmax is negative", ('tmax',)),
+    Rule('order', '**', ('tmin', 'tmax'), "tmin < tmax", "tmin must be below tmax", FIT_KEYS),
+    Rule('extent', '**', ('tmax', 'extent'), "tmax < extent", "tmax is beyond the lattice extent", ('tmax',)),
+    Rule('window', '**/*state', ('tmin', 'tmax', 'nstates'), "tmax - tmin + 1 >= 2 * nstates",
+         "window is shorter than the 2N parameters of an N-state fit", FIT_KEYS),
+]
+
+
+_VARIABLES = ('tmin', 'tmax', 'nstates', 'extent')
+
+
+def compile_rules(rules):
+    # One function checking every rule: check(tmin, tmax, nstates, extent,
+    # path) -> indices of the failed rules. Each variable is tested for being
+    # a number once, and a rule's pattern is only matched against the path
+    # once its other guards pass.
+    lines = ["def check(tmin, tmax, nstates, extent, path):",
+             "    failed = []"]
+    lines += ["    %s_ok = type(%s) in _NUMBERS" % (name, name) for name in _VARIABLES]
+    namespace = {'_NUMBERS': _NUMBERS}
+    for i, rule in enumerate(rules):
+        guards = ["%s_ok" % name for name in rule.needs]
+        if rule.regex is not None:
+            namespace['_match%d' % i] = rule.regex.match
+            guards.append("_match%d('/'.join(path))" % i)
+        condition = "not (%s)" % rule.expression
+        if guards:
+            condition = "%s and %s" % (" and ".join(guards), condition)
+        lines.append("    if %s:" % condition)
+        lines.append("        failed.append(%d)" % i)
+    lines.append("    return failed")
+    exec("\n".join(lines), namespace)
+    return namespace['check']
+
+
+_NUMBERS = frozenset((int, float))
+
+
+def _number(value):
+    return type(value) in _NUMBERS
+
+
+@functools.lru_cache(maxsize=1024)
+def nstates(name):
+    # N for a directory named 'Nstate', else None
+    match = _NSTATE.match(name)
+    return int(match.group(1)) if match else None
+
+
+def ensemble_extent(json_file, directory_tree):
+    # A top-level 'Nt' in the file wins over the table
+    nt = directory_tree.get('Nt') if isinstance(directory_tree, Mapping) else None
+    if _number(nt):
+        return nt
+    name = os.path.splitext(os.path.basename(json_file))[0]
+    return LATTICE_EXTENTS.get(name)
+
+
+class Violation:
+    __slots__ = ('rule', 'message', 'keys')
+
+    def __init__(self, rule):
+        self.rule = rule.name
+        self.message = rule.message
+        self.keys = rule.keys
+
+
+class Validator:
+    def __init__(self, directory_tree, rules=RULES, extent=None):
+        self.directory_tree = directory_tree
+        self.rules = rules
+        self.extent = extent
+        self.check = compile_rules(rules)
+        self.trie = {}  # key -> child trie; None -> [Violation] of that directory
+        self.count = 0
+        self.pending = set()  # Paths of unparsed subtrees, checked by visit()
+        self.local = all(rule.local for rule in rules)  # Copies can reuse their source's violations
+
+    # -- Checking
+
+    def validate(self):
+        self.validate_subtree((), self.directory_tree)
+
+    def validate_subtree(self, path, directory):
+        # Check every directory below `path`, which has nothing recorded yet
+        stack = [(path, directory)]
+        while stack:
+            path, directory = stack.pop()
+            if 'tmin' in directory or 'tmax' in directory:
+                failed = self._failed(path, directory)
+                if failed:
+                    self._set(path, failed)
+            for key in list(directory.keys()):
+                child = directory[key]
+                if type(child) is dict or (not type(child) in _LEAVES and isinstance(child, Mapping)):
+                    stack.append((path + (key,), child))
+                elif isinstance(child, LazyObject):
+                    self.pending.add(path + (key,))
+
+    def check_directory(self, path, directory):
+        # (Re)check the fit keys held directly by `directory`
+        if 'tmin' in directory or 'tmax' in directory:
+            self._set(path, self._failed(path, directory))
+        else:
+            self._set(path, [])
+
+    def _failed(self, path, directory):
+        tmin = directory['tmin'] if 'tmin' in directory else None
+        tmax = directory['tmax'] if 'tmax' in directory else None
+        failed = self.check(tmin, tmax, nstates(path[-1]) if path else None, self.extent, path)
+        return [Violation(self.rules[i]) for i in failed]
+
+    def visit(self, path):
+        # Called when the explorer enters `path`: check subtrees that were
+        # unparsed at load time and have been parsed on the way down
+        path = tuple(path)
+        for pending in [p for p in self.pending if path[:len(p)] == p]:
+            value = self._lookup(pending)
+            if not isinstance(value, LazyObject):
+                self.pending.discard(pending)
+                if isinstance(value, Mapping):
+                    self.validate_subtree(pending, value)
+
+    def _lookup(self, path):
+        # The raw value at `path` (unparsed subtrees stay unparsed); None if missing
+        value = self.directory_tree
+        for key in path:
+            if not isinstance(value, Mapping) or key not in value:
+                return None
+            value = value[key]
+        return value
+
+    def apply(self, op):
+        # Re-check what a journal op that was just applied touched
+        path = tuple(op['path'])
+        parent = path[:-1]
+        copied = self._copied(op) if op['op'] == 'copy' and self.local else None
+        self._drop(path)
+        if op['op'] == 'rename':
+            path = parent + (op['to'],)
+            self._drop(path)
+        directory = self._lookup(parent)
+        if isinstance(directory, Mapping):
+            self.check_directory(parent, directory)
+        if op['op'] != 'delete':
+            value = unshared(self._lookup(path))
+            if isinstance(value, LazyObject):
+                self.pending.add(path)
+            elif copied is not None:
+                self._graft(path, *copied)
+                self.check_directory(path, value)  # Its own name is new
+            elif isinstance(value, Mapping):
+                self.validate_subtree(path, value)
+
+    def _copied(self, op):
+        # (trie, pending paths) of the source of a copy op, relative to it,
+        # taken before the op's target is dropped
+        source = tuple(op['from'])
+        node = self._node(source)
+        pending = [p[len(source):] for p in self.pending if p[:len(source)] == source]
+        return _copy_trie(node) if node is not None else {}, pending
+
+    def _graft(self, path, trie, pending):
+        # Record the violations and unparsed subtrees of a copy at `path`
+        trie.pop(None, None)
+        if trie:
+            self._node(path[:-1], create=True)[path[-1]] = trie
+            self.count += sum(len(violations) for _, violations in _walk(trie, ()))
+        self.pending.update(path + p for p in pending)
+
+    # -- Trie of violations
+
+    def _node(self, path, create=False):
+        node = self.trie
+        for key in path:
+            child = node.get(key)
+            if child is None:
+                if not create:
+                    return None
+                child = node[key] = {}
+            node = child
+        return node
+
+    def _set(self, path, violations):
+        node = self._node(path, create=bool(violations))
+        if node is None:
+            return
+        self.count += len(violations) - len(node.get(None, ()))
+        if violations:
+            node[None] = violations
+        elif node.pop(None, None) is not None:
+            self._prune(path)
+
+    def _prune(self, path):
+        # Remove the now empty trie nodes at the end of `path`
+        nodes = [self.trie]
+        for key in path:
+            nodes.append(nodes[-1][key])
+        for i in range(len(path), 0, -1):
+            if nodes[i]:
+                break
+            del nodes[i - 1][path[i - 1]]
+
+    def _drop(self, path):
+        # Forget everything recorded at or below `path`
+        if not path:
+            return
+        node = self._node(path[:-1])
+        dropped = node.pop(path[-1], None) if node is not None else None
+        if dropped is not None:
+            self.count -= sum(len(violations) for _, violations in _walk(dropped, ()))
+        if self.pending:
+            self.pending = {p for p in self.pending if p[:len(path)] != path}
+
+    # -- Queries
+
+    def problems(self, path, key):
+        # Messages of the violations in directory `path` that concern leaf `key`
+        node = self._node(path)
+        if node is None:
+            return []
+        return [v.message for v in node.get(None, ()) if key in v.keys]
+
+    def items(self):
+        # (path, [Violation]) for every directory with violations, in tree order
+        return list(_walk(self.trie, ()))
+
+
+def _copy_trie(node):
+    # The Violation lists are never changed in place, so they are shared
+    return {key: value if key is None else _copy_trie(value) for key, value in node.items()}
+
+
+def _walk(node, path):
+    if None in node:
+        yield path, node[None]
+    for key, child in node.items():
+        if key is not None:
+            yield from _walk(child, path + (key,))
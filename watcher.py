@@ -0,0 +1,127 @@
+import logging
+import os
+import queue
+import threading
+
+from fittree import get_node, read_directory_tree, to_plain
+from journal import file_signature
+from merkle import MerkleTree, diff_trees
+
+# Picks up changes other programs make to open JSON files.
+#
+# FileWatcher polls with one os.stat per open file from a MainLoop alarm,
+# which costs nothing measurable while idle. When a file's size or mtime no
+# longer matches what its session last loaded or saved (journal.signature),
+# the file is re-read on a worker thread with fittree.read_directory_tree,
+# which writes no snapshot or offset index. Large files are read lazily and
+# the diff against the in-memory tree compares unedited spans by their bytes
+# and other subtrees by their hashes (see merkle.py), so subtrees that did
+# not change are never parsed. Values taken from the new file are parsed
+# into plain dicts before it is closed.
+# plan_merge turns the differences into journal ops; a difference at, above
+# or below a path edited since the last save is a conflict and keeps the
+# local version. The result is handed back to the UI thread through a pipe,
+# where TreeSession.merge_external applies it.
+
+POLL_INTERVAL = 1.0  # Seconds between stat calls
+
+
+def plan_merge(session, other_tree):
+    # (ops, conflicts) bringing the session's tree in line with `other_tree`;
+    # conflicts are merkle.diff_trees changes that overlap unsaved edits
+    theirs = MerkleTree(other_tree)
+    theirs.digest()  # Hash the new file before taking the session's lock
+    with session.lock:
+        changes = diff_trees(session.merkle, theirs)
+        ops, conflicts = [], []
+        for change in changes:
+            kind, path, ours, value = change
+            if session.merkle.overlaps(path):
+                conflicts.append(change)
+            elif kind == 'removed':
+                ops.append({'op': 'delete', 'path': path})
+            elif kind == 'reordered':
+                # Put every key back in the file's order
+                directory = get_node(other_tree, path)
+                for index, key in enumerate(list(directory.keys())):
+                    ops.append({'op': 'set', 'path': path + [key], 'value': directory[key], 'index': index})
+            else:
+                ops.append({'op': 'set', 'path': path, 'value': value})
+    # The values may still point into the new file (see lazy_json.py)
+    for op in ops:
+        if 'value' in op:
+            op['value'] = to_plain(op['value'])
+    conflicts = [(kind, path, ours, to_plain(value)) for kind, path, ours, value in conflicts]
+    return ops, conflicts
+
+
+class FileWatcher:
+    def __init__(self, loop, get_sessions, on_change, interval=POLL_INTERVAL):
+        self.loop = loop
+        self.get_sessions = get_sessions  # Returns [(path prefix, TreeSession), ...]
+        self.on_change = on_change  # Called on the UI thread, see _deliver
+        self.interval = interval
+        self.results = queue.Queue()
+        self.reading = set()  # Files being re-read right now
+        self.seen = {}  # json_file -> signature last re-read, merged or not
+        self.pipe = None
+        self.alarm = None
+
+    def start(self):
+        self.pipe = self.loop.watch_pipe(self._deliver)
+        self.alarm = self.loop.set_alarm_in(self.interval, self._poll)
+
+    def stop(self):
+        if self.alarm is not None:
+            self.loop.remove_alarm(self.alarm)
+            self.alarm = None
+        if self.pipe is not None:
+            self.loop.remove_watch_pipe(self.pipe)
+            self.pipe = None
+
+    def _poll(self, loop=None, user_data=None):
+        for prefix, session in self.get_sessions():
+            journal = session.journal
+            if journal is None or journal.signature is None or session.json_file in self.reading:
+                continue  # SQLite, or we are writing the file ourselves
+            try:
+                signature = file_signature(session.json_file)
+            except OSError:
+                continue  # Mid-replace, or removed; look again next time
+            if signature == journal.signature or signature == self.seen.get(session.json_file):
+                continue
+            self.seen[session.json_file] = signature
+            self.reading.add(session.json_file)
+            threading.Thread(target=self._read, args=(prefix, session, signature),
+                             name='fitparams-watcher', daemon=True).start()
+        self.alarm = self.loop.set_alarm_in(self.interval, self._poll)
+
+    def _read(self, prefix, session, signature):
+        try:
+            other_tree, source = read_directory_tree(session.json_file)
+            try:
+                result = plan_merge(session, other_tree)
+            finally:
+                if source is not None:
+                    source.close()
+        except Exception as exc:
+            # e.g. caught half-written by a tool that does not replace atomically;
+            # the next write changes the signature and we try again
+            logging.warning("Could not re-read %s: %s", session.json_file, exc)
+            result = None
+        self.results.put((prefix, session, signature, result))
+        pipe = self.pipe
+        if pipe is not None:
+            os.write(pipe, b'.')
+
+    def _deliver(self, data=None):
+        # UI thread: hand each finished re-read to on_change(prefix, session,
+        # signature, (ops, conflicts) or None)
+        while True:
+            try:
+                prefix, session, signature, result = self.results.get_nowait()
+            except queue.Empty:
+                break
+            self.reading.discard(session.json_file)
+            self.on_change(prefix, session, signature, result)
+        return True  # Keep the watch_pipe callback registered
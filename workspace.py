@@ -0,0 +1,161 @@
+import logging
+import os
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+from saver import CLEAN, ERROR, EXTERNAL, PENDING
+from session import TreeSession
+from sqlite_backend import SQLITE_SUFFIXES
+
+# Multi-ensemble workspace: every ensemble file in a directory shows up as a
+# top-level node. A file is only parsed the first time it is entered, and
+# parsed trees live in a bounded LRU of TreeSessions; when the cache is over
+# budget, clean sessions are evicted first and dirty ones are flushed to disk
+# before they are dropped.
+
+MAX_TREES = 8  # Parsed ensembles kept in memory
+MAX_BYTES = 1 << 30  # Budget for the total on-disk size of parsed ensembles
+
+ENSEMBLE_SUFFIXES = ('.json',) + SQLITE_SUFFIXES
+
+
+class EnsembleRef(MutableMapping):
+    # Stand-in for an ensemble's root directory; touches the file only when
+    # something looks inside, so listing the workspace parses nothing
+    def __init__(self, workspace, name):
+        self.workspace = workspace
+        self.name = name
+
+    def tree(self):
+        return self.workspace.session(self.name).directory_tree
+
+    def __getitem__(self, key):
+        return self.tree()[key]
+
+    def __setitem__(self, key, value):
+        self.tree()[key] = value
+
+    def __delitem__(self, key):
+        del self.tree()[key]
+
+    def __iter__(self):
+        return iter(list(self.tree().keys()))
+
+    def __len__(self):
+        return len(self.tree())
+
+    def __contains__(self, key):
+        return key in self.tree()
+
+    def keys(self):
+        return list(self.tree().keys())
+
+
+class Workspace(MutableMapping):
+    def __init__(self, directory, max_trees=MAX_TREES, max_bytes=MAX_BYTES, notify=None):
+        self.directory = directory
+        self.max_trees = max_trees
+        self.max_bytes = max_bytes
+        self.notify = notify  # Passed on to each session's saver
+        self.on_indexed = None  # Passed on to each session, see TreeSession.find
+        self.on_evict = None  # Called with the ensemble name when its tree is dropped
+        self.files = OrderedDict(
+            (name, os.path.join(directory, name))
+            for name in sorted(os.listdir(directory))
+            if name.endswith(ENSEMBLE_SUFFIXES) and os.path.isfile(os.path.join(directory, name)))
+        self.refs = {name: EnsembleRef(self, name) for name in self.files}
+        self.sessions = OrderedDict()  # LRU order, most recently used last
+
+    # The workspace root is a read-only mapping of ensemble name -> EnsembleRef
+    def __getitem__(self, name):
+        return self.refs[name]
+
+    def __setitem__(self, name, value):
+        raise KeyError("Ensembles cannot be added from the explorer")
+
+    def __delitem__(self, name):
+        raise KeyError("Ensembles cannot be deleted from the explorer")
+
+    def __iter__(self):
+        return iter(self.files)
+
+    def __len__(self):
+        return len(self.files)
+
+    def keys(self):
+        return list(self.files)
+
+    def session(self, name):
+        session = self.sessions.get(name)
+        if session is not None:
+            self.sessions.move_to_end(name)
+            return session
+        logging.debug("Workspace: loading %s", name)
+        session = TreeSession(self.files[name], notify=self._notify, on_indexed=self._on_indexed)
+        self.sessions[name] = session
+        self._evict(keep=name)
+        return session
+
+    def _notify(self, status):
+        if self.notify is not None:
+            self.notify(status)
+
+    def _on_indexed(self):
+        if self.on_indexed is not None:
+            self.on_indexed()
+
+    def _size(self, name):
+        try:
+            return os.path.getsize(self.files[name])
+        except OSError:
+            return 0
+
+    def _over_budget(self):
+        return (len(self.sessions) > self.max_trees
+                or sum(self._size(name) for name in self.sessions) > self.max_bytes)
+
+    def _evict(self, keep):
+        while len(self.sessions) > 1 and self._over_budget():
+            candidates = [name for name in self.sessions if name != keep]
+            # Least recently used clean tree first; otherwise flush the LRU one
+            victim = next((name for name in candidates if not self.sessions[name].dirty()),
+                          candidates[0])
+            logging.debug("Workspace: evicting %s", victim)
+            self.sessions.pop(victim).close()
+            if self.on_evict is not None:
+                self.on_evict(victim)
+
+    def commit_many(self, ops):
+        # Route each op to its ensemble's session with the ensemble name
+        # stripped; the inverse ops come back with it put back on
+        grouped = OrderedDict()
+        for op in ops:
+            if len(op['path']) < 2:
+                raise KeyError("Ensembles cannot be modified from the explorer")
+            stripped = dict(op, path=op['path'][1:])
+            if 'from' in op:
+                if op['from'][0] != op['path'][0]:
+                    raise KeyError("Copies between ensembles go through 'set'")
+                stripped['from'] = op['from'][1:]
+            grouped.setdefault(op['path'][0], []).append(stripped)
+        inverses = []
+        for name, ensemble_ops in grouped.items():
+            for inverse in self.session(name).commit_many(ensemble_ops):
+                inverses.append([dict(op, path=[name] + op['path']) for op in inverse])
+        return inverses
+
+    @property
+    def status(self):
+        statuses = {session.status for session in self.sessions.values()}
+        if ERROR in statuses:
+            return ERROR
+        if EXTERNAL in statuses:
+            return EXTERNAL
+        if statuses - {CLEAN}:
+            return PENDING
+        return CLEAN
+
+    def close(self):
+        for session in self.sessions.values():
+            session.close()
+        self.sessions.clear()